@@ -1,22 +1,19 @@
 import sys
 import os
-from PyQt6.QtWidgets import QApplication, QWidget, QGraphicsScene, QFileDialog
-from PyQt6.QtGui import QPixmap, QImage
-from PyQt6.QtCore import QTimer, Qt
-import tkinter
-from tkinter import messagebox
-import qimage2ndarray
+from PyQt6.QtWidgets import QApplication, QWidget, QGraphicsScene, QFileDialog, QMessageBox, QPlainTextEdit
+from PyQt6.QtCore import QTimer, Qt, QThread
+from PyQt6.QtGui import QFontDatabase
 import numpy as np
-import re
 from interface import Ui_Form
-import Lockin_SR_class as Lockin_class
-import Newport_XPS_class as DelayLine_class
-import micromanager_class
-import time
+import scan_planner
+from display import FrameDisplay
+from scan_worker import ScanWorker, CameraConnector
 import pyqtgraph as pg
-from pyqtgraph.graphicsItems.ROI import ROI
+from pyqtgraph.graphicsItems.ROI import RectROI
+from roi_traces import RoiTraces
+# the hardware classes (pyvisa, newportxps, pymmcore) and the scan engine (h5py)
+# are imported when they are first used, so the window comes up quickly
 
-uiclass, baseclass = pg.Qt.loadUiType("interface.ui")
 
 class MainForm(QWidget):
     def __init__(self):
@@ -38,10 +35,6 @@ class MainForm(QWidget):
         self.scene = QGraphicsScene()
         self.show()
 
-        # camera initialization
-        self.camera_init()
-
-
         # set functions for buttons
         self.ui.folderButton.clicked.connect(self.show_folder_dialog)
         self.ui.connectLIAandXPSbutton.clicked.connect(self.connect_LIA_XPS)
@@ -53,44 +46,91 @@ class MainForm(QWidget):
         # self.ui.binningComboBox.currentIndexChanged(self.binningComboBox_changed)
         # folder and file names
         # self.ui.SanpName.editingFinished.connect(self.update_snap_name)
-        self.isStop = True
         self.folder_path = self.ui.folder_edit.text()
+        # the scan runs in a worker thread, the views are redrawn by a timer with the latest frames
+        self.scan_thread = None
+        self.displays = {kind: FrameDisplay(view) for kind, view in self.views().items()}
+        # user ROIs on the difference / normalized views and their live kinetics
+        self.rois = {}  # name -> (kind, RectROI)
+        self.roi_traces = None
+        self.trace_plot = None
+        self.trace_curves = {}
+        self.trace_version = -1
+        self.ui.addDiffRoiButton.clicked.connect(lambda: self.add_roi("diff"))
+        self.ui.addNormRoiButton.clicked.connect(lambda: self.add_roi("diffNorm"))
+        # step timing table, and cProfile of one step
+        self.engine = None
+        self.timing_view = None
+        self.timing_version = -1
+        self.timing_message = ""
+        self.ui.timingButton.clicked.connect(self.show_timing)
+        self.ui.checkBoxProfileStep.toggled.connect(self.profile_step_toggled)
+        # with raw frames only, the kind check boxes do not apply
+        self.ui.checkBoxRawOnly.toggled.connect(self.raw_only_toggled)
+        self.render_timer = QTimer(self)
+        self.render_timer.timeout.connect(self.render_latest)
+        self.render_timer.start(200)
+
+        # camera initialization, in the background
+        self.camera = None
+        self.camera_thread = None
+        self.camera_init()
 
     def camera_init(self):
-        # camera connection
-        self.camera = micromanager_class.MMcamera()
-        #set max sensetivity
-        self.camera.setMaxSens()
+        # camera connection; the buttons which need the camera stay disabled until it is connected
+        self.ui.cameraStatusLabel.setText("Camera: connecting...")
+        self.set_buttons_enabled(self.scan_thread is None)
+        self.camera_thread = QThread()
+        self.camera_connector = CameraConnector()
+        self.camera_connector.moveToThread(self.camera_thread)
+        self.camera_thread.started.connect(self.camera_connector.run)
+        self.camera_connector.connected.connect(self.on_camera_connected)
+        self.camera_connector.failed.connect(self.on_camera_failed)
+        self.camera_connector.finished.connect(self.on_camera_finished)
+        self.camera_thread.start()
+
+    def on_camera_connected(self, camera, settings):
+        self.camera = camera
         #get gain
-        gain = int(self.camera.getGain())
-        self.ui.gain_spinBox.setValue(gain)
+        self.ui.gain_spinBox.setValue(settings["gain"])
         #get and set PModes to combobox
-        PModes = self.camera.getAllPModevalues()
+        PModes = settings["pmodes"]
         self.ui.pModeComboBox.addItems(PModes)
-        pmode = self.camera.getPMode()
-        index = PModes.index(pmode)
-        if index >= 0:
-            self.ui.pModeComboBox.setCurrentIndex(index)
+        if settings["pmode"] in PModes:
+            self.ui.pModeComboBox.setCurrentIndex(PModes.index(settings["pmode"]))
         #get and set binnings to combobox
-        binnings = self.camera.getAllBinningvalues()
+        binnings = settings["binnings"]
         self.ui.binningComboBox.addItems(binnings)
-        bin = self.camera.getBinning()
-        index = binnings.index(bin)
-        if index >= 0:
-            self.ui.binningComboBox.setCurrentIndex(index)
+        if settings["binning"] in binnings:
+            self.ui.binningComboBox.setCurrentIndex(binnings.index(settings["binning"]))
+        self.ui.cameraStatusLabel.setText("Camera: connected")
+
+    def on_camera_failed(self, message):
+        self.ui.cameraStatusLabel.setText("Camera: not connected")
+        QMessageBox.critical(self, "Error", f"Camera is not connected: {message}")
+
+    def on_camera_finished(self):
+        self.camera_thread.quit()
+        self.camera_thread.wait()
+        self.camera_thread = None
+        self.set_buttons_enabled(self.scan_thread is None)
 
     def connect_LIA_XPS(self):
+        import Lockin_SR_class as Lockin_class
+        import Newport_XPS_class as DelayLine_class
         # connect LIA
         self.lockin_id = self.ui.LockIn.text() #set lock-in addres
         self.lia = Lockin_class.Lockin(self.lockin_id)
-        self.ui.liaStatuslabel.setText(self.lia.state)
+        latency = self.lia.round_trip()
+        self.ui.liaStatuslabel.setText(f"{self.lia.state}, GPIB round trip {latency['median'] * 1e3:.1f} ms")
         #connect delay line
         controller = 'GROUP1.POSITIONER'
-        self.delay_line = DelayLine_class.DelayLine(controller)
+        # 5e-4 mm = 3 fs for single delay stage
+        self.delay_line = DelayLine_class.DelayLine(controller, tolerance=0.0005)
         self.getDLposition()
         # connect Pump PWR L/2
         controller = 'GROUP3.POSITIONER'
-        self.pumpPWR = DelayLine_class.DelayLine(controller)
+        self.pumpPWR = DelayLine_class.DelayLine(controller, tolerance=0.001)
         self.getPumpPWR()
         self.ui.XPSStatuslabel.setText("XPS is connected")
 
@@ -109,101 +149,316 @@ class MainForm(QWidget):
         self.camera.setBinning(str(self.ui.binningComboBox.currentText()))
 
     def stop_button(self):
-        self.isStop = True
+        if self.scan_thread is not None:
+            self.engine.stop()
 
     def start_button(self):
         # start main measurements
         if not hasattr(self, 'lia'):
-            messagebox.showerror("Error", "Lock-in is not connected!")
+            QMessageBox.critical(self, "Error", "Lock-in is not connected!")
             return
 
         if not hasattr(self, 'delay_line'):
-            messagebox.showerror("Error", "Delay line is not connected!")
+            QMessageBox.critical(self, "Error", "Delay line is not connected!")
             return
 
-        # main loop measurements
-        self.isStop = False
-        self.delay_move(self.ui.DelayLineMin.text())
-        self.PWR_move(self.ui.PWRmin.text())
-        self.set_camera_settings()
+        # load the parameters of measurements; the additional sequences may have several
+        # start:step:end segments separated by ";"
+        dl_sequence = self.ui.additionalDLseq_Edit.text() if self.ui.additionalDL_checkBox.isChecked() else None
+        pwr_sequence = self.ui.additionalPWRseq_Edit.text() if self.ui.additionalPWR_checkBox.isChecked() else None
+        try:
+            arrayoftime = scan_planner.axis(float(self.ui.DelayLineMin.text()), float(self.ui.DelayLineMax.text()),
+                                            float(self.ui.DelayLineStep.text()), dl_sequence)
+            arrayofpwr = scan_planner.axis(float(self.ui.PWRmin.text()), float(self.ui.PWRmax.text()),
+                                           float(self.ui.PWRstep.text()), pwr_sequence)
+            options = self.scan_options()
+        except ValueError as error:
+            QMessageBox.critical(self, "Error", f"Wrong scan parameters: {error}")
+            return
 
-        # load the parameters of measurements
-        delay = {}
-        delay['start'] = float(self.ui.DelayLineMin.text())
-        delay['stop'] = float(self.ui.DelayLineMax.text())
-        delay['step'] = float(self.ui.DelayLineStep.text()) * np.sign(delay['stop'] - delay['start'])
-        if delay['start'] == delay['stop']:
-            arrayoftime = np.array(delay['start'])
-        else:
-            arrayoftime = np.arange(delay['start'], delay['stop'] + delay['step'], delay['step'])
-
-
-        if self.ui.additionalDL_checkBox.isChecked():
-            seq = self.ui.additionalDLseq_Edit.text()
-            temp = re.findall(r"[-+]?\d*\.\d+|\d+", seq)
-            res = list(map(float, temp))
-            begintimearray = np.arange(res[0], res[2] + res[1], res[1])
-            arrayoftime = np.unique(np.concatenate([begintimearray, arrayoftime])) #concatenate and exclude doubled items
-
-        power = {}
-        power['start'] = float(self.ui.PWRmin.text())
-        power['stop'] = float(self.ui.PWRmax.text())
-        power['step'] = float(self.ui.PWRstep.text()) * np.sign(power['stop'] - power['start'])
-        if power['start'] == power['stop']:
-            arrayofpwr = np.array(power['start'])
-        else:
-            arrayofpwr = np.arange(power['start'], power['stop'] + power['step'], power['step'])
-
-        all_steps = len(arrayoftime)*len(arrayofpwr)
-        counter = 0
-        for pwr_index, pwr_position in enumerate(arrayofpwr):
-            if not self.isStop:
-                self.PWR_move(pwr_position)
-                for delay_index, delay_position in enumerate(arrayoftime):
-                    if not self.isStop:
-                        self.delay_move(delay_position)
-                        self.take_images()
-                        delay_pwr = f"pwr_{pwr_position}_delay_{delay_position}"
-                        self.save_images(delay_pwr)
-                        counter += 1
-                        progress = int(100*counter / all_steps)
-                        self.ui.progressBar.setValue(progress)
-                        self.repaint()
-                        self.update()
-                        # save first reference image any case
-                        if counter == 1:
-                            folder = self.ui.folder_edit.text()
-                            filename = self.ui.FileName.text()
-                            fullpath = os.path.join(folder, filename)
-                            self.save_snap(self.reference_img, fullname=fullpath+".dat")
-                            self.ui.referenceImage_view.export(fullpath + ".png")
-                            fullpath = os.path.join(folder, "protocol_"+filename)
-                            self.save_mainwindow_screenshot(fullpath + ".png")
-
-        messagebox.showinfo("Done", "Measurements are done.")
+        # all frames of the scan go to one HDF5 file: folder/filename.h5
+        folder = self.ui.folder_edit.text()
+        filename = self.ui.FileName.text()
+        if not os.path.isdir(folder):
+            QMessageBox.critical(self, "Error", "Folder does not exist!")
+            return
+        fullname = os.path.join(folder, filename + ".h5")
+        resume = self.ui.checkBoxResume.isChecked() and os.path.exists(fullname)
+        if resume:
+            # grid of the existing scan, only its missing points are acquired
+            import scan_writer
+            arrayofpwr, arrayoftime = scan_writer.scan_grid(fullname)
+        elif os.path.exists(fullname):
+            answer = QMessageBox.question(self, 'File already exists', 'Scan file already exists. Overwrite?')
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+        self.set_camera_settings()
+        self.scan_kinds = self.selected_kinds()
+        self.ui.progressBar.setValue(0)
+        self.roi_traces = RoiTraces(arrayofpwr, arrayoftime)
+        for name in self.rois:
+            self.roi_changed(name)
+        self.start_worker(self.engine_for_scan(options).run, arrayofpwr, arrayoftime, folder, filename,
+                          self.scan_kinds, settings=self.scan_settings(options),
+                          legacy_dat=self.ui.checkBoxLegacyDat.isChecked(), roi_traces=self.roi_traces,
+                          resume=resume)
+
+    def scan_options(self):
+        # the number fields of the scan options, read before anything starts;
+        # ValueError names the field with a wrong entry
+        edits = {"SNR target": self.ui.snrTargetEdit, "adaptive tolerance": self.ui.adaptiveToleranceEdit,
+                 "shutter settle time": self.ui.shutterSettleEdit}
+        if self.ui.checkBoxLockinLog.isChecked():
+            edits["lock-in log rate"] = self.ui.lockinRateEdit
+        options = {"lock-in log rate": 0.0}
+        for name, edit in edits.items():
+            try:
+                options[name] = float(edit.text())
+            except ValueError:
+                raise ValueError(f"{name} must be a number, not '{edit.text()}'") from None
+        return options
+
+    def engine_for_scan(self, options):
+        import scan_engine
+        lockin_logger = None
+        if self.ui.checkBoxLockinLog.isChecked():
+            from lockin_logger import LockinLogger
+            lockin_logger = LockinLogger(self.lia, rate=options["lock-in log rate"])
+        self.engine = scan_engine.ScanEngine(self.camera, self.lia, self.delay_line, self.pumpPWR,
+                                             self.ui.ShutterOut.text(),
+                                             pipelined=self.ui.checkBoxPipelined.isChecked(),
+                                             shots=self.ui.shotsSpinBox.value(),
+                                             snr_target=options["SNR target"] or None,
+                                             burst=self.ui.burstSpinBox.value(),
+                                             adaptive_budget=self.ui.adaptiveBudgetSpinBox.value()
+                                             if self.ui.checkBoxAdaptive.isChecked() else 0,
+                                             adaptive_tolerance=options["adaptive tolerance"],
+                                             order=self.ui.orderComboBox.currentText(),
+                                             shutter_confirm=self.ui.checkBoxShutterConfirm.isChecked(),
+                                             shutter_settle=options["shutter settle time"] / 1000,
+                                             lockin_logger=lockin_logger,
+                                             png=self.ui.pngComboBox.currentText())
+        self.engine.profile_next_step = self.ui.checkBoxProfileStep.isChecked()
+        self.timing_version = -1
+        return self.engine
+
+    def start_worker(self, job, *args, **kwargs):
+        # run an engine job in a QThread; the buttons which use the hardware are disabled meanwhile
+        self.set_buttons_enabled(False)
+        self.scan_failed = False  # set by on_failed, the worker emits finished afterwards anyway
+        self.scan_thread = QThread()
+        self.scan_worker = ScanWorker(self.engine, job, *args, **kwargs)
+        self.scan_worker.moveToThread(self.scan_thread)
+        self.scan_thread.started.connect(self.scan_worker.run)
+        self.scan_worker.progress.connect(self.on_progress)
+        self.scan_worker.frames.connect(self.on_frames)
+        self.scan_worker.status.connect(self.on_status)
+        self.scan_worker.timeline.connect(self.on_timeline)
+        self.scan_worker.failed.connect(self.on_failed)
+        self.scan_worker.finished.connect(self.on_finished)
+        self.scan_thread.start()
+
+    def set_buttons_enabled(self, enabled):
+        # Start, Test and Test image also need the camera
+        with_camera = enabled and self.camera is not None
+        self.ui.StartButton.setEnabled(with_camera)
+        self.ui.TestButton.setEnabled(with_camera)
+        self.ui.testImgButton.setEnabled(with_camera)
+        self.ui.connectLIAandXPSbutton.setEnabled(enabled)
+
+    def on_progress(self, counter, all_steps):
+        self.ui.progressBar.setValue(int(100*counter / all_steps))
+
+    def on_status(self, source, message):
+        if source == "delay":
+            self.ui.currentDLposituionlabel.setText(message)
+        elif source == "power":
+            self.ui.curr_pumpPWRlabel.setText(message)
+        elif source == "xps":
+            self.ui.XPSStatuslabel.setText(message)
+        elif source in ("shots", "camera"):
+            self.ui.shotsStatusLabel.setText(message)
+        elif source == "plan":
+            self.ui.planLabel.setText(message)
+        elif source == "timing":
+            self.timing_message = message
+            self.timing_version = -1
+            self.ui.checkBoxProfileStep.setChecked(False)
+
+    def on_timeline(self, timeline):
+        text = "\n".join(f"{phase}: {duration:.3f} s" for phase, duration in timeline.items())
+        self.ui.timelineLabel.setText("Step timeline:\n" + text)
+
+    def on_frames(self, step):
+        # the views only show the latest frames; the .png previews are written by the engine (png_export)
+        for kind, frame in step["frames"].items():
+            self.displays[kind].submit(frame)
+        if step["counter"] == 1:
+            folder = self.ui.folder_edit.text()
+            filename = self.ui.FileName.text()
+            fullpath = os.path.join(folder, "protocol_"+filename)
+            # timed in the engine's timer, it shows up as a background span of the next step
+            with self.engine.timer.span("gui.protocol_png"):
+                self.save_mainwindow_screenshot(fullpath + ".png")
+
+    def render_latest(self):
+        # throttled redraw, frames which arrived in between are skipped
+        for display in self.displays.values():
+            display.render()
+        self.plot_traces()
+        self.show_timing_table()
+
+    def show_timing(self):
+        if self.timing_view is None:
+            self.timing_view = QPlainTextEdit()
+            self.timing_view.setWindowTitle("Step timing")
+            self.timing_view.setReadOnly(True)
+            self.timing_view.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+            self.timing_view.resize(620, 420)
+        self.timing_view.show()
+        self.timing_view.raise_()
+        self.timing_version = -1
+        self.show_timing_table()
+
+    def show_timing_table(self):
+        # histograms of the timing spans of the current scan, in ms
+        if self.timing_view is None or not self.timing_view.isVisible() or self.engine is None:
+            return
+        if self.engine.timer.version == self.timing_version:
+            return
+        self.timing_version = self.engine.timer.version
+        lines = [f"{'span':<20}{'count':>7}{'mean':>9}{'median':>9}{'p95':>9}{'max':>9}"]
+        for name, stats in sorted(self.engine.timer.summary().items()):
+            lines.append(f"{name:<20}{stats['count']:>7}" + "".join(
+                f"{stats[key] * 1e3:>9.1f}" for key in ("mean", "p50", "p95", "max")))
+        lines.append("")
+        lines.append("gui.*, write.* and the moves of a pipelined scan run beside the loop")
+        if self.timing_message:
+            lines.append(self.timing_message)
+        self.timing_view.setPlainText("\n".join(lines))
+
+    def profile_step_toggled(self, checked):
+        # also during a scan: the engine profiles its next step
+        if self.engine is not None:
+            self.engine.profile_next_step = checked
+
+    def add_roi(self, kind):
+        num_rows, num_columns = self.displays[kind].shape or (100, 100)
+        name = f"roi{len(self.rois) + 1}_{kind}"
+        roi = RectROI([num_columns//4, num_rows//4], [max(2, num_columns//8), max(2, num_rows//8)],
+                      pen=pg.intColor(len(self.rois)))
+        self.views()[kind].addItem(roi)
+        self.rois[name] = (kind, roi)
+        roi.sigRegionChangeFinished.connect(lambda: self.roi_changed(name))
+        self.roi_changed(name)
+
+    def roi_changed(self, name):
+        # the views show frame.T, so x is the column and y the row of the frame
+        if self.roi_traces is None:
+            return
+        kind, roi = self.rois[name]
+        x, y = roi.pos()
+        width, height = roi.size()
+        rows = (max(0, int(y)), max(0, int(y + height)))
+        columns = (max(0, int(x)), max(0, int(x + width)))
+        self.roi_traces.set_roi(name, kind, rows, columns)
+
+    def plot_traces(self):
+        # mean of every ROI versus delay at the power being scanned
+        if self.roi_traces is None or not self.rois or self.roi_traces.version == self.trace_version:
+            return
+        self.trace_version = self.roi_traces.version
+        if self.trace_plot is None:
+            self.trace_plot = pg.PlotWidget(title="ROI kinetics")
+            self.trace_plot.setLabel("bottom", "Delay line position", units="mm")
+            self.trace_plot.addLegend()
+        self.trace_plot.show()
+        _, mean, _ = self.roi_traces.snapshot()
+        pwr_index = self.roi_traces.last_power_index
+        for index, (name, trace) in enumerate(mean.items()):
+            if name not in self.trace_curves:
+                self.trace_curves[name] = self.trace_plot.plot(name=name, pen=pg.intColor(index), symbol="o")
+            # delays only grow (adaptive scans add them unsorted), so this prefix matches the snapshot
+            delays = self.roi_traces.delays[:trace.shape[1]]
+            order = np.argsort(delays)
+            self.trace_curves[name].setData(delays[order], trace[pwr_index][order], connect="finite")
+
+    def on_failed(self, message):
+        self.scan_failed = True
+        QMessageBox.critical(self, "Error", f"Measurement stopped: {message}")
+
+    def on_finished(self):
+        self.scan_thread.quit()
+        self.scan_thread.wait()
+        self.scan_thread = None
+        self.set_buttons_enabled(True)
+        if self.scan_worker.job == self.engine.run and not self.scan_failed:
+            summary = self.engine.timeline_summary()
+            self.ui.timelineLabel.setText(
+                f"Scan timeline: {summary['steps']} steps, {summary['wall']:.1f} s "
+                f"(serial {summary['serial']:.1f} s, overlap saved {summary['saved']:.1f} s)")
+            png = self.engine.png_exporter
+            if png is not None and png.errors:
+                QMessageBox.warning(self, "Done", f"Measurements are done, {len(png.errors)} .png files "
+                                                  f"could not be written:\n" + "\n".join(png.errors[:5]))
+            else:
+                QMessageBox.information(self, "Done", "Measurements are done.")
+
+    def views(self):
+        return {"ref": self.ui.referenceImage_view, "pumped": self.ui.pumpedImage_view,
+                "diff": self.ui.differenceImage_view, "diffNorm": self.ui.normalizedImage_view}
+
+    def scan_settings(self, options):
+        # camera settings stored in the scan file
+        return {
+            "exposure_ms": int(self.ui.ExpTime.text()),
+            "binning": self.ui.binningComboBox.currentText(),
+            "gain": int(self.ui.gain_spinBox.text()),
+            "pmode": self.ui.pModeComboBox.currentText(),
+            "shutter_aux": self.ui.ShutterOut.text(),
+            "shutter_confirm": self.ui.checkBoxShutterConfirm.isChecked(),
+            "shutter_settle_ms": options["shutter settle time"],
+            "lockin_log_rate_hz": options["lock-in log rate"],
+            "png": self.ui.pngComboBox.currentText(),
+            "raw_only": self.ui.checkBoxRawOnly.isChecked(),
+            "shots": self.ui.shotsSpinBox.value(),
+            "snr_target": options["SNR target"],
+            "burst": self.ui.burstSpinBox.value(),
+        }
+
+    def raw_only_toggled(self, checked):
+        for check_box in (self.ui.checkBoxReferenceImg, self.ui.checkBoxPumped, self.ui.checkBoxDifference,
+                          self.ui.checkBoxDifferenceNormalized):
+            check_box.setEnabled(not checked)
+
+    def selected_kinds(self):
+        if self.ui.checkBoxRawOnly.isChecked():
+            # diff and diffNorm are computed from these when the scan is read (derived_views)
+            return ["ref", "pumped"]
+        kinds = []
+        if self.ui.checkBoxReferenceImg.isChecked():
+            kinds.append("ref")
+        if self.ui.checkBoxPumped.isChecked():
+            kinds.append("pumped")
+        if self.ui.checkBoxDifference.isChecked():
+            kinds.append("diff")
+        if self.ui.checkBoxDifferenceNormalized.isChecked():
+            kinds.append("diffNorm")
+        return kinds
 
     def test_button(self):
-        self.delay_move(self.ui.DelayLineMin.text())
-        self.PWR_move(self.ui.PWRmin.text())
+        if not hasattr(self, 'lia') or not hasattr(self, 'delay_line'):
+            QMessageBox.critical(self, "Error", "Lock-in and XPS are not connected!")
+            return
+        try:
+            options = self.scan_options()
+            delay_position, pwr_position = float(self.ui.DelayLineMin.text()), float(self.ui.PWRmin.text())
+        except ValueError as error:
+            QMessageBox.critical(self, "Error", f"Wrong scan parameters: {error}")
+            return
         self.set_camera_settings()
-        self.take_images()
-
-    def take_images(self):
-        aux = self.ui.ShutterOut.text()
-        self.lia.set_aux(aux, 0) # close shutter
-        self.reference_img = self.camera.getImage()
-        self.update_frame(self.reference_img, self.ui.referenceImage_view)
-        self.lia.set_aux(aux, 5) # open shutter
-        self.pumped_img = self.camera.getImage()
-        self.lia.set_aux(aux, 0) # open shutter
-        self.update_frame(self.pumped_img, self.ui.pumpedImage_view)
-        self.difference_img = self.pumped_img - self.reference_img
-        a = self.difference_img.astype(float)
-        b = self.reference_img.astype(float)
-        self.norm_img = np.divide(a, b, out=np.zeros_like(a), where=b != 0)
-        # update images on ui
-        self.update_frame(self.difference_img, self.ui.differenceImage_view)
-        self.update_frame(self.norm_img, self.ui.normalizedImage_view)
+        engine = self.engine_for_scan(options)
+        self.start_worker(engine.test, delay_position, pwr_position)
 
     def get_test_img(self):
         self.set_camera_settings()
@@ -224,30 +479,6 @@ class MainForm(QWidget):
         # mode = self.ui.pModeComboBox.currentText()
         # self.camera.setPMode(mode) # Normal mode closes the program
 
-    def delay_move(self, position):
-        self.ui.currentDLposituionlabel.setText("Delay line is moving")
-        currDLposition = self.delay_line.get_position()
-        self.delay_line.move_to(position)
-        # check the position accuracy. 5e-4 mm = 3 fs for single delay stage
-        while abs(currDLposition - float(position)) > 0.0005:
-            currDLposition = self.delay_line.get_position()
-            time.sleep(0.05)
-        self.ui.currentDLposituionlabel.setText(f"Current delay pos: {currDLposition}mm")
-        self.ui.currentDLposituionlabel.repaint()
-        self.ui.currentDLposituionlabel.update()
-
-    def PWR_move(self, position):
-        self.ui.curr_pumpPWRlabel.setText("PWR is moving")
-        curr_pumpPWR = self.pumpPWR.get_position()
-        self.pumpPWR.move_to(position)
-        # check the position accuracy
-        while abs(curr_pumpPWR - float(position)) > 0.001:
-            curr_pumpPWR = self.pumpPWR.get_position()
-            time.sleep(0.05)
-        self.ui.curr_pumpPWRlabel.setText(f"Current PWR: {curr_pumpPWR}deg")
-        self.ui.curr_pumpPWRlabel.repaint()
-        self.ui.curr_pumpPWRlabel.update()
-
     def show_folder_dialog(self):
         folder_path = QFileDialog.getExistingDirectory(self, "Select Directory")
         if folder_path:
@@ -268,79 +499,6 @@ class MainForm(QWidget):
         widget.setLevels(min_value, max_value)  # Set min_value and max_value according to your desired range
         widget.show()
 
-    def save_snap(self, image, fullname, format='%d'):
-        # saving one image
-        folder = self.ui.folder_edit.text()
-        # filename = self.ui.FileName.text()
-        if not os.path.isdir(folder):
-            messagebox.showerror("Error", "Folder does not exist!")
-            return
-        # if not filename:
-        #     messagebox.showerror("Error", "Please enter a file name")
-        #     return
-        # fullname = os.path.join(folder, filename)
-        if os.path.exists(fullname):
-            overwrite = messagebox.askyesno('File already exists', 'File already exists. Overwrite?')
-            if overwrite:
-                with open(fullname, "w") as file:
-                    np.savetxt(file, image, fmt=format)
-                    # messagebox.showinfo("Save", "File saved successfully.")
-            else:
-                self.isStop = True
-        else:
-            with open(fullname, "w") as file:
-                np.savetxt(file, image, fmt=format)
-                # messagebox.showinfo("Save", "File saved successfully.")
-        return
-
-    def save_images(self, delay_pwr=""):
-        base_folder = self.ui.folder_edit.text()
-        file_base_name = self.ui.FileName.text()
-        # save reference image
-        if self.ui.checkBoxReferenceImg.isChecked():
-            folder = base_folder + f"ref_{file_base_name}"
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-            filename = f"{delay_pwr}.dat"
-            fullname = os.path.join(folder, filename)
-            self.save_snap(self.reference_img, fullname=fullname)
-            # save screenshot
-            self.ui.referenceImage_view.export(fullname+".png")
-
-        # save pumped image
-        if self.ui.checkBoxPumped.isChecked():
-            folder = base_folder + f"pumped_{file_base_name}"
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-            filename = f"{delay_pwr}.dat"
-            fullname = os.path.join(folder, filename)
-            self.save_snap(self.pumped_img, fullname=fullname)
-            # save screenshot
-            self.ui.pumpedImage_view.export(fullname + ".png")
-
-        # save difference image
-        if self.ui.checkBoxDifference.isChecked():
-            folder = base_folder + f"diff_{file_base_name}"
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-            filename = f"{delay_pwr}.dat"
-            fullname = os.path.join(folder, filename)
-            self.save_snap(self.difference_img, fullname=fullname)
-            # save screenshot
-            self.ui.differenceImage_view.export(fullname + ".png")
-
-         # save pumped image
-        if self.ui.checkBoxDifferenceNormalized.isChecked():
-            folder = base_folder + f"diffNorm_{file_base_name}"
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-            filename = f"{delay_pwr}.dat"
-            fullname = os.path.join(folder, filename)
-            self.save_snap(self.norm_img,  fullname=fullname, format="%.5f")
-            # save screenshot
-            self.ui.normalizedImage_view.export(fullname + ".png")
-        return
-
     def save_mainwindow_screenshot(self, fullpath):
         # Get the primary screen
         screen = QApplication.primaryScreen()
@@ -1,5 +1,9 @@
 import pyvisa
 import re
+import statistics
+import threading
+import time
+import numpy as np
 
 
 class Lockin:
@@ -12,10 +16,13 @@ class Lockin:
         self.model = int(match.group(1))
 #         self.model = 830
         self.state = f'Lock-in is connected. Model {self.model}'
+        # one command at a time: the buffer logger thread shares the bus with the shutter writes
+        self.lock = threading.RLock()
 
     def getXYR(self):
         # get X Y R signals from SR844
-        out_signal = self.lockin.query("SNAP? 1,2,3")
+        with self.lock:
+            out_signal = self.lockin.query("SNAP? 1,2,3")
         signal = out_signal.split(",")
         sigX = float(signal[0])
         sigY = float(signal[1])
@@ -25,15 +32,64 @@ class Lockin:
     def set_aux(self, aux, voltage):
         if self.model == 844:  # check the model number
             # set aux_out_1 voltage to SR844
-            self.lockin.write(f"AUXO {aux}, " + str(voltage))  # !!!! SR844 command. SR830 has another string
+            with self.lock:
+                self.lockin.write(f"AUXO {aux}, " + str(voltage))  # !!!! SR844 command. SR830 has another string
             return voltage
         elif self.model == 830:  # check the model number
-            self.lockin.write(f"AUXV {aux}, " + str(voltage))  # SR830
+            with self.lock:
+                self.lockin.write(f"AUXV {aux}, " + str(voltage))  # SR830
             return voltage
 
+    def opc(self):
+        # *OPC? is answered once the commands sent before it are executed
+        with self.lock:
+            return self.lockin.query("*OPC?")
+
+    def round_trip(self, repeats=10):
+        # GPIB query round trip (median and max of *STB? queries), s
+        times = []
+        for _ in range(repeats):
+            with self.lock:
+                start = time.perf_counter()
+                self.lockin.query("*STB?")
+                times.append(time.perf_counter() - start)
+        return {"median": statistics.median(times), "max": max(times)}
+
+    def buffer_start(self, rate_code):
+        # clear the data buffer and start storing X (channel 1) and Y (channel 2) at
+        # 2**(rate_code - 4) Hz (SRAT); storage stops when the buffer is full.
+        # Returns time.perf_counter() when the first point was taken (middle of the STRT write).
+        with self.lock:
+            if self.model == 844:
+                self.lockin.write("DDEF 1,0; DDEF 2,0")  # displays X and Y
+            else:
+                self.lockin.write("DDEF 1,0,0; DDEF 2,0,0")  # displays X and Y, no ratio
+            self.lockin.write(f"SRAT {rate_code}; SEND 0; REST")  # single shot
+            before = time.perf_counter()
+            self.lockin.write("STRT")
+            return (before + time.perf_counter()) / 2
+
+    def buffer_pause(self):
+        with self.lock:
+            self.lockin.write("PAUS")
+
+    def buffer_count(self):
+        # points stored since buffer_start
+        with self.lock:
+            return int(self.lockin.query("SPTS?"))
+
+    def buffer_read(self, channel, start, count):
+        # binary transfer (TRCB?, 4-byte floats) of count points from point start
+        with self.lock:
+            values = self.lockin.query_binary_values(f"TRCB? {channel},{start},{count}", datatype="f",
+                                                     is_big_endian=False, header_fmt="empty", data_points=count,
+                                                     expect_termination=False)
+        return np.array(values, dtype=np.float32)
+
 
 if __name__ == "__main__":
     lia = Lockin(8)
     lia.set_aux(2, 0)
     print(lia.state)
     print(lia.getXYR())
+    print(lia.round_trip())
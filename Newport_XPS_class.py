@@ -1,59 +1,341 @@
 from newportxps import NewportXPS
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio
+import random
+import re
+import threading
 import time
 
+# default controller address and login
+XPS_HOST = '192.168.50.2'
+XPS_USERNAME = 'Administrator'
+XPS_PASSWORD = 'Administrator'
+
+# XPS group status codes 10..18 are the READY states (12 = ready state from motion)
+READY_STATES = range(10, 19)
+
+# XPS error codes of a lost connection: busy socket, TCP timeout, connection closed by the administrator
+CONNECTION_ERRORS = (-1, -2, -108)
+
+
+class XPSRecoveryError(RuntimeError):
+    # the controller did not come back within the retry budget
+    pass
+
+
+class XPSRecoveryStopped(XPSRecoveryError):
+    # the stop event was set while waiting to reconnect
+    pass
+
+
+def is_connection_error(error):
+    # socket errors and timeouts (also as XPS error codes, see newportxps check_error)
+    # are recovered from, command errors (position out of range, group in the wrong state) are not
+    if isinstance(error, OSError):  # socket.timeout, ConnectionError, TimeoutError
+        return True
+    message = str(error)
+    code = re.search(r"error (-?\d+)", message, re.IGNORECASE)
+    if code:
+        return int(code.group(1)) in CONNECTION_ERRORS
+    return "invalid socket" in message or "Login failed" in message
+
+
+def _wait(seconds, stop_event=None):
+    # sleep which ends early when stop_event is set; returns True if stopped
+    if stop_event is None:
+        time.sleep(seconds)
+        return False
+    return stop_event.wait(seconds)
+
+
+class XPSSession:
+    # One connection to an XPS controller, shared by all DelayLine objects of
+    # that controller and login (see XPSSession.get). Commands go through call() and hold
+    # a lock, so the session can be used from several threads. GroupMoveAbsolute
+    # only answers when the motion is done, so moves are sent on a socket of
+    # their own (open_socket) without the lock; status polls and GroupMoveAbort
+    # go through the main socket meanwhile.
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def __init__(self, host=XPS_HOST, username=XPS_USERNAME, password=XPS_PASSWORD):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.lock = threading.RLock()
+        self.generation = 0  # incremented on every (re)connection
+        self.connect()
+
+    @classmethod
+    def get(cls, host=XPS_HOST, username=XPS_USERNAME, password=XPS_PASSWORD):
+        # the shared session of the controller and login, connected on first use
+        with cls.sessions_lock:
+            session = cls.sessions.get((host, username))
+            if session is None:
+                session = cls(host, username, password)
+                cls.sessions[(host, username)] = session
+            elif session.password != password:
+                raise ValueError(f"XPS {host} is already connected as {username} with another password")
+            return session
+
+    def connect(self):
+        with self.lock:
+            self.xps = NewportXPS(self.host, username=self.username, password=self.password)
+            self.generation += 1
+
+    def reconnect(self, failed_generation):
+        # reconnect unless another DelayLine of this session already did it
+        # after the failure seen in failed_generation
+        with self.lock:
+            if self.generation == failed_generation:
+                self.connect()
+
+    def call(self, method, *args, **kwargs):
+        # NewportXPS method by name, e.g. call('move_stage', 'GROUP1.POSITIONER', 10)
+        with self.lock:
+            return getattr(self.xps, method)(*args, **kwargs)
+
+    def _group_state(self, group):
+        err, state = self.xps._xps.GroupStatusGet(self.xps._sid, group)
+        if err != 0:
+            raise RuntimeError(f"GroupStatusGet {group} failed with error {err}")
+        return state
+
+    def group_state(self, group):
+        with self.lock:
+            return self._group_state(group)
+
+    def open_socket(self):
+        # another logged in socket to the controller, for the moves of one DelayLine
+        with self.lock:
+            api = self.xps._xps
+            socket_id = api.TCP_ConnectToServer(self.host, self.xps.port, self.xps.timeout)
+            if socket_id < 0:
+                raise ConnectionError(f"no socket to the XPS at {self.host}")
+            err, _ = api.Login(socket_id, self.username, self.password)
+            if err != 0:
+                api.TCP_CloseSocket(socket_id)
+                raise ConnectionError(f"XPS login failed with error {err}")
+            return socket_id
+
+    def close_socket(self, socket_id):
+        with self.lock:
+            self.xps._xps.TCP_CloseSocket(socket_id)
+
+    def move_absolute(self, socket_id, positioner, position):
+        # returns when the motion is done or aborted; socket_id from open_socket, not shared
+        err, _ = self.xps._xps.GroupMoveAbsolute(socket_id, positioner, [position])
+        if err != 0:
+            raise RuntimeError(f"GroupMoveAbsolute {positioner} failed with error {err}")
+
+    def abort_move(self, group):
+        # the move pending on the other socket then fails; returns the XPS error code
+        # (not 0 e.g. when the motion ended just before)
+        with self.lock:
+            return self.xps._xps.GroupMoveAbort(self.xps._sid, group)[0]
+
+    def motion_parameters(self, positioner):
+        # (velocity, acceleration) of the positioner's SGamma profile
+        with self.lock:
+            result = self.xps._xps.PositionerSGammaParametersGet(self.xps._sid, positioner)
+        if result[0] != 0:
+            raise RuntimeError(f"PositionerSGammaParametersGet {positioner} failed with error {result[0]}")
+        return float(result[1]), float(result[2])
+
+    def group_states(self, groups):
+        # status codes of several groups in one locked batch, {group: code}
+        with self.lock:
+            return {group: self._group_state(group) for group in groups}
+
 
 class DelayLine:
-    def __init__(self, controller='GROUP1.POSITIONER'):
+    # tolerance: accepted position error (mm or deg); settle_time: pause (s) after
+    # the motion is done, before the position is checked. All DelayLines of one
+    # controller share its XPSSession unless a session is given.
+    def __init__(self, controller='GROUP1.POSITIONER', tolerance=0.0005, settle_time=0.0, timeout=60.0,
+                 session=None, host=XPS_HOST, username=XPS_USERNAME, password=XPS_PASSWORD):
         self.controller = controller
         self.group = controller.split('.')[0]  # get group name
+        self.session = session or XPSSession.get(host, username, password)
+        # fault recovery: up to max_retries reconnections with exponential backoff
+        # (backoff_base * 2**attempt s, at most backoff_max, with random jitter)
+        self.max_retries = 6
+        self.backoff_base = 0.5
+        self.backoff_max = 20.0
+        self.health = "ok"  # "ok", "recovering" or "failed"
+        self.recovery_count = 0
+        self.rehome_count = 0
+        self.last_error = None
+        self.cancel = None  # event of the running move_and_wait which ends a recovery, see move_and_wait
+        self.tolerance = tolerance
+        self.settle_time = settle_time
+        self.timeout = timeout
+        self.poll_interval = 0.01
+        # measured durations of the last move_and_wait, s
+        self.last_move_time = 0.0
+        self.last_settle_time = 0.0
+        self.position = 0  # last commanded position, restored after a recovery
+        # moves run in a worker thread on their own socket, so move_and_wait can poll and abort them
+        self.mover = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"XPS-{self.group}")
+        self.move_socket = None
+        self.move_generation = None  # session generation the move socket belongs to
         self.init()  # Delay Line initialization
 
     def init(self):
         # Delay Line initialization
-        self.myxps = NewportXPS('192.168.50.2', username='Administrator',
-                                password='Administrator')  # Connect to the XPS
-        self.myxps.kill_group(group=self.group)
+        self.session.call('kill_group', group=self.group)
         # self.myxps.kill_group()
         # self.myxps.initialize_allgroups()
-        self.myxps.initialize_group(group=self.group)
+        self.session.call('initialize_group', group=self.group)
         # self.myxps.home_allgroups()
-        self.myxps.home_group(group=self.group)
-        self.position = 0
+        self.session.call('home_group', group=self.group)
+
+    def _call(self, func, *args, **kwargs):
+        # XPS command with fault recovery: on a connection failure reconnect,
+        # restore the last commanded position and repeat the command
+        generation = self.session.generation
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if not is_connection_error(error):
+                raise
+            return self.recover(error, generation, lambda: func(*args, **kwargs))
+
+    def recover(self, error, failed_generation, command):
+        # returns the result of command once it succeeds on the recovered connection
+        self.health = "recovering"
+        self.last_error = repr(error)
+        print(f"XPS {self.group} failed: {self.last_error}, reconnecting")
+        for attempt in range(self.max_retries):
+            self._check_cancel(min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0))
+            try:
+                self.session.reconnect(failed_generation)
+                # the group keeps its reference while it stays in a READY state,
+                # only a lost reference (controller reboot, emergency stop) needs homing
+                if self.session.group_state(self.group) not in READY_STATES:
+                    self.init()
+                    self.rehome_count += 1
+                self._check_cancel()
+                self._move(self.position)
+                self._check_cancel()
+                result = command()
+                self.recovery_count += 1
+                self.health = "ok"
+                print(f"XPS {self.group} reconnected")
+                return result
+            except Exception as error:
+                if not is_connection_error(error):
+                    self.health = "failed"
+                    raise
+                self.last_error = repr(error)
+                failed_generation = self.session.generation
+        self.health = "failed"
+        raise XPSRecoveryError(f"XPS {self.group} not recovered after {self.max_retries} attempts: {self.last_error}")
+
+    def _check_cancel(self, seconds=0.0):
+        # waits seconds, raises XPSRecoveryStopped once the cancel event is set
+        if _wait(seconds, self.cancel) or (self.cancel is not None and self.cancel.is_set()):
+            self.health = "failed"
+            raise XPSRecoveryStopped(f"XPS {self.group} recovery stopped: {self.last_error}")
+
+    def health_status(self):
+        return {"group": self.group, "health": self.health, "recovery_count": self.recovery_count,
+                "rehome_count": self.rehome_count, "last_error": self.last_error}
+
+    def _move(self, position):
+        # the move socket is opened again after a reconnection of the session
+        if self.move_generation != self.session.generation:
+            if self.move_socket is not None:
+                self.session.close_socket(self.move_socket)
+            self.move_socket = self.session.open_socket()
+            self.move_generation = self.session.generation
+        self.session.move_absolute(self.move_socket, self.controller, position)
 
     def move_to(self, position):
+        # returns when the motion is done
         self.position = position
+        self._call(self._move, position)
+
+    def group_state(self):
+        # XPS group status code, see READY_STATES
+        return self._call(self.session.group_state, self.group)
+
+    def move_and_wait(self, position, tolerance=None, settle_time=None, stop_event=None):
+        # Move and return the reached position once the group reports that the
+        # motion is done and the position is within tolerance. Returns None if
+        # stop_event was set while waiting (also during a fault recovery).
+        # A recovery during the move runs in the mover thread and ends on an event of
+        # its own, set on stop or timeout; move_and_wait returns only after it ended,
+        # so nothing of the move goes on afterwards.
         try:
-            self.myxps.move_stage(self.controller, position)
-        except:  # if XPS controller crashed
-            while True:
-                time.sleep(20)
-                try:
-                    print("Reconnecting XPS")
-                    self.init()
-                    self.myxps.move_stage(self.controller, position)
-                    print(f"XPS {self.group} reconnected")
-                    break
-                except:
-                    print("Reconnecting XPS again")
+            return self._move_and_wait(float(position), tolerance, settle_time, stop_event)
+        except XPSRecoveryStopped:
+            return None
+        finally:
+            self.cancel = None
+
+    def _move_and_wait(self, position, tolerance, settle_time, stop_event):
+        tolerance = self.tolerance if tolerance is None else tolerance
+        settle_time = self.settle_time if settle_time is None else settle_time
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        self.cancel = threading.Event()
+        move = self.mover.submit(self.move_to, position)
+        cancelled = None  # "stop" or "timeout"
+        aborted = None  # session generation of the last GroupMoveAbort
+        while not move.done():
+            if cancelled is not None:
+                wait([move], self.poll_interval)
+            elif _wait(self.poll_interval, stop_event):
+                cancelled = "stop"
+            elif self.health == "recovering":
+                # the recovery has its own retry budget, the deadline is for the motion
+                deadline = time.perf_counter() + self.timeout
+            elif time.perf_counter() > deadline:
+                cancelled = "timeout"
+            if cancelled is not None:
+                self.cancel.set()
+                # a motion is aborted (its error in the worker is not of interest), a recovery
+                # ends at its next step; a connection being recovered is not used
+                if self.health != "recovering" and aborted != self.session.generation:
+                    aborted = self.session.generation
+                    self.session.abort_move(self.group)
+        if cancelled == "stop":
+            return None
+        if cancelled == "timeout":
+            raise TimeoutError(f"{self.group} is still moving after {self.timeout} s, aborted")
+        move.result()
+        # from here the commands run in this thread, a recovery ends on stop_event
+        self.cancel = stop_event
+        while self.group_state() not in READY_STATES:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"{self.group} is still moving after {self.timeout} s")
+            if _wait(self.poll_interval, stop_event):
+                return None
+        moved = time.perf_counter()
+        if settle_time > 0 and _wait(settle_time, stop_event):
+            return None
+        current = self.get_position()
+        while abs(current - position) > tolerance:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"{self.group} did not reach {position} within {tolerance}, at {current}")
+            if _wait(self.poll_interval, stop_event):
+                return None
+            current = self.get_position()
+        self.last_move_time = moved - start
+        self.last_settle_time = time.perf_counter() - moved
+        return current
+
+    def motion_parameters(self):
+        # (velocity, acceleration) used for move time estimates; no fault recovery, may raise RuntimeError
+        return self.session.motion_parameters(self.controller)
+
+    async def move_and_wait_async(self, position, **kwargs):
+        # awaitable move_and_wait, the blocking XPS calls run in a worker thread
+        return await asyncio.to_thread(self.move_and_wait, position, **kwargs)
 
-        
     def get_position(self):
-        positioner = self.controller
-        try:
-            pos = self.myxps.get_stage_position(positioner)
-        except:  # if XPS controller crashed
-            while True:
-                time.sleep(20)
-                try:
-                    print("Reconnecting XPS")
-                    self.init()
-                    self.move_to(self.position)
-                    pos = self.myxps.get_stage_position(positioner)
-                    print(f"XPS {self.group} reconnected")
-                    break
-                except:
-                    print("Reconnecting XPS again")
-        return pos
+        return self._call(self.session.call, 'get_stage_position', self.controller)
 
 
 if __name__ == "__main__":
@@ -68,5 +350,10 @@ if __name__ == "__main__":
     controller = 'GROUP1.POSITIONER'
     delay_line = DelayLine(controller)
     for position in range(0, 50, 5): # in mm
-        delay_line.move_to(position)
-        print(delay_line.get_position())
+        print(delay_line.move_and_wait(position))
+        print(f"move {delay_line.last_move_time:.3f} s, settle {delay_line.last_settle_time:.3f} s")
+    # both groups through the same connection
+    waveplate = DelayLine('GROUP3.POSITIONER', tolerance=0.001)
+    print(waveplate.session is delay_line.session)
+    print(delay_line.session.group_states(['GROUP1', 'GROUP3']))
+    print(delay_line.health_status())
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def interval_scores(delays, signal):
+    # how much the signal changes over each interval between neighbouring delays
+    # (sorted), in units of the signal range: |step| plus the mean curvature
+    # (change of slope times interval width) at its two ends
+    delays = np.asarray(delays, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    span = np.ptp(signal) if len(signal) else 0.0
+    signal = (signal - signal.min()) / span if span > 0 else np.zeros_like(signal)
+    widths = np.diff(delays)
+    steps = np.diff(signal)
+    slopes = steps / widths
+    curvature = np.zeros(len(delays))
+    curvature[1:-1] = np.abs(np.diff(slopes)) * (widths[:-1] + widths[1:]) / 2
+    return np.abs(steps) + (curvature[:-1] + curvature[1:]) / 2
+
+
+def refine_delays(delays, signal, count, tolerance=0.05, min_step=0.0):
+    # up to `count` new delays: midpoints of the intervals which score highest,
+    # only intervals scoring above `tolerance` and wider than 2*min_step are split.
+    # NaN values (points not measured) are ignored.
+    delays = np.asarray(delays, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    measured = ~np.isnan(signal)
+    delays, signal = delays[measured], signal[measured]
+    order = np.argsort(delays)
+    delays, signal = delays[order], signal[order]
+    if count <= 0 or len(delays) < 2:
+        return np.array([])
+    scores = interval_scores(delays, signal)
+    scores[np.diff(delays) < 2 * min_step] = 0
+    best = np.argsort(scores)[::-1][:count]
+    best = best[scores[best] > tolerance]
+    # sorted, so the delay line moves in one direction
+    return np.sort((delays[best] + delays[best + 1]) / 2)
+
+
+if __name__ == "__main__":
+    # a step near zero delay with a slow decay: the refinement goes to the rise
+    delays = np.linspace(-10, 50, 13)
+    def kinetics(t):
+        return np.where(t < 0, 0, np.exp(-t / 20)) * (1 + np.tanh(t / 0.5)) / 2
+    for refine_pass in range(6):
+        new = refine_delays(delays, kinetics(delays), count=4, tolerance=0.02, min_step=0.1)
+        print(refine_pass, new)
+        if not len(new):
+            break
+        delays = np.concatenate([delays, new])
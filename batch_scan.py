@@ -0,0 +1,203 @@
+import argparse
+import copy
+import json
+import os
+import signal
+import sys
+import time
+import scan_engine
+import scan_planner
+import scan_writer
+from lockin_logger import LockinLogger
+from roi_traces import RoiTraces
+
+# Scans without the window, e.g. overnight from a remote shell:
+#   python batch_scan.py example_scan.yaml
+#   python batch_scan.py example_scan.yaml --dry-run    (plans only, no hardware)
+#   python batch_scan.py example_scan.yaml --simulate   (simulated hardware, see simulators.py)
+# The file (YAML or JSON) has the fields of the main window, see DEFAULTS and
+# example_scan.yaml. An optional list "scans" runs several scans one after the
+# other, each entry overrides the fields above it. Nothing of Qt or tkinter is
+# imported, the hardware classes are those of the GUI.
+
+DEFAULTS = {
+    "folder": "./",
+    "filename": "scan",
+    "kinds": list(scan_writer.KINDS),
+    "delay": {"start": 0.0, "stop": 0.0, "step": 1.0, "sequence": None},  # mm
+    "power": {"start": 0.0, "stop": 0.0, "step": 1.0, "sequence": None},  # deg of the L/2 plate
+    "camera": {"exposure_ms": 100, "binning": "1x1", "gain": 1},
+    "lockin": {"gpib": 8, "shutter_aux": "1", "shutter_confirm": False, "shutter_settle_ms": 0.0,
+               "log_rate_hz": 0},  # 0 = no lock-in logging
+    "xps": {"host": "192.168.50.2", "username": "Administrator", "password": "Administrator",
+            "delay_group": "GROUP1.POSITIONER", "power_group": "GROUP3.POSITIONER",
+            "delay_tolerance": 0.0005, "power_tolerance": 0.001},
+    "scan": {"pipelined": False, "shots": 1, "snr_target": None, "burst": 0, "order": "raster",
+             "adaptive_budget": 0, "adaptive_tolerance": 0.05, "legacy_dat": False, "resume": False,
+             "overwrite": False, "png": "off"},  # .png previews: "live", "deferred" (after the scan) or "off" (YAML reads off as false)
+    "rois": {},  # name -> {"kind": "diff" or "diffNorm", "rows": [start, stop], "columns": [start, stop]}
+}
+
+
+def load_config(fullname):
+    with open(fullname) as file:
+        if os.path.splitext(fullname)[1].lower() in (".yaml", ".yml"):
+            import yaml  # optional, only needed for YAML files
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def merge(base, override):
+    # nested dicts are merged key by key, anything else is replaced
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def expand(config):
+    # the list of complete scan descriptions of a config file
+    base = merge(DEFAULTS, {key: value for key, value in config.items() if key != "scans"})
+    scans = [merge(base, scan) for scan in config.get("scans") or [{}]]
+    for scan in scans:
+        unknown = set(scan) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown fields {sorted(unknown)}")
+    return scans
+
+
+def axes(scan):
+    # (powers, delays) as the main window builds them
+    return (scan_planner.axis(scan["power"]["start"], scan["power"]["stop"], scan["power"]["step"],
+                              scan["power"]["sequence"]),
+            scan_planner.axis(scan["delay"]["start"], scan["delay"]["stop"], scan["delay"]["step"],
+                              scan["delay"]["sequence"]))
+
+
+def log(message):
+    print(f"{time.strftime('%H:%M:%S')} {message}", flush=True)
+
+
+class Hardware:
+    # camera, lock-in and stages, connected once for all scans of a file
+    def __init__(self, config, simulate=False):
+        if simulate:
+            from simulators import SimulatedSetup
+            setup = SimulatedSetup(shutter_aux=config["lockin"]["shutter_aux"])
+            self.camera, self.lia, self.delay_line, self.pump_pwr = (setup.camera, setup.lia,
+                                                                     setup.delay_line, setup.pump_pwr)
+            log("simulated hardware")
+            return
+        import Lockin_SR_class
+        import micromanager_class
+        import Newport_XPS_class
+        self.camera = micromanager_class.MMcamera()
+        self.camera.setMaxSens()
+        self.lia = Lockin_SR_class.Lockin(config["lockin"]["gpib"])
+        log(f"{self.lia.state}, GPIB round trip {self.lia.round_trip()['median'] * 1e3:.1f} ms")
+        xps = config["xps"]
+        login = {"host": xps["host"], "username": xps["username"], "password": xps["password"]}
+        self.delay_line = Newport_XPS_class.DelayLine(xps["delay_group"], tolerance=xps["delay_tolerance"], **login)
+        self.pump_pwr = Newport_XPS_class.DelayLine(xps["power_group"], tolerance=xps["power_tolerance"], **login)
+        log(f"XPS is connected, delay {self.delay_line.get_position()} mm, PWR {self.pump_pwr.get_position()} deg")
+
+    def set_camera(self, camera):
+        self.camera.setExptime(int(camera["exposure_ms"]))
+        self.camera.setBinning(camera["binning"])
+        self.camera.setGain(int(camera["gain"]))
+
+
+def run_scan(hardware, scan):
+    options = scan["scan"]
+    powers, delays = axes(scan)
+    hardware.set_camera(scan["camera"])
+    lockin_logger = None
+    if scan["lockin"]["log_rate_hz"]:
+        lockin_logger = LockinLogger(hardware.lia, rate=scan["lockin"]["log_rate_hz"])
+    engine = scan_engine.ScanEngine(hardware.camera, hardware.lia, hardware.delay_line, hardware.pump_pwr,
+                                    scan["lockin"]["shutter_aux"], pipelined=options["pipelined"],
+                                    shots=options["shots"], snr_target=options["snr_target"],
+                                    burst=options["burst"], order=options["order"],
+                                    adaptive_budget=options["adaptive_budget"],
+                                    adaptive_tolerance=options["adaptive_tolerance"],
+                                    shutter_confirm=scan["lockin"]["shutter_confirm"],
+                                    shutter_settle=scan["lockin"]["shutter_settle_ms"] / 1000,
+                                    lockin_logger=lockin_logger, png=options["png"] or "off")
+    fullname = os.path.join(scan["folder"], scan["filename"] + ".h5")
+    resume = options["resume"] and os.path.exists(fullname)
+    if resume:
+        powers, delays = scan_writer.scan_grid(fullname)
+    roi_traces = None
+    if scan["rois"]:
+        roi_traces = RoiTraces(powers, delays)
+        for name, roi in scan["rois"].items():
+            roi_traces.set_roi(name, roi["kind"], roi["rows"], roi["columns"])
+    engine.on_progress = lambda counter, all_steps: log(f"step {counter}/{all_steps}")
+    engine.on_status = lambda source, message: log(message) if source in ("xps", "camera", "plan") else None
+
+    def stop(signum, frame):
+        log("stopping after the current exposure")
+        engine.stop()
+
+    previous = signal.signal(signal.SIGINT, stop)
+    try:
+        settings = dict(scan["camera"], shutter_aux=scan["lockin"]["shutter_aux"],
+                        shutter_confirm=scan["lockin"]["shutter_confirm"],
+                        shutter_settle_ms=scan["lockin"]["shutter_settle_ms"],
+                        lockin_log_rate_hz=scan["lockin"]["log_rate_hz"], shots=options["shots"],
+                        snr_target=options["snr_target"], burst=options["burst"], png=options["png"])
+        engine.run(powers, delays, scan["folder"], scan["filename"], scan["kinds"], settings=settings,
+                   legacy_dat=options["legacy_dat"], roi_traces=roi_traces, resume=resume)
+    finally:
+        signal.signal(signal.SIGINT, previous)
+    summary = engine.timeline_summary()
+    log(f"{scan['filename']}: {summary['steps']} steps in {summary['wall']:.1f} s")
+    return not engine.stop_event.is_set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pump-probe imaging scans without the GUI")
+    parser.add_argument("config", help="scan description, .yaml/.yml or .json")
+    parser.add_argument("--dry-run", action="store_true", help="print the scan plans, do not connect the hardware")
+    parser.add_argument("--resume", action="store_true", help="continue existing scan files of the same name")
+    parser.add_argument("--simulate", action="store_true", help="run with simulated camera, lock-in and stages")
+    parser.add_argument("--overwrite", action="store_true", help="replace existing scan files instead of refusing")
+    args = parser.parse_args(argv)
+    scans = expand(load_config(args.config))
+    names = set()
+    for scan in scans:
+        if args.resume:
+            scan["scan"]["resume"] = True
+        if args.overwrite:
+            scan["scan"]["overwrite"] = True
+        if not os.path.isdir(scan["folder"]):
+            raise SystemExit(f"Folder {scan['folder']} does not exist")
+        # a scan which is not resumed starts a new file: finished scans are only replaced on request
+        fullname = os.path.normpath(os.path.join(scan["folder"], scan["filename"] + ".h5"))
+        if fullname in names:
+            raise SystemExit(f"{fullname} is the file of more than one scan")
+        names.add(fullname)
+        if os.path.exists(fullname) and not (scan["scan"]["resume"] or scan["scan"]["overwrite"]):
+            raise SystemExit(f"{fullname} exists, use --resume to continue it or --overwrite (overwrite: true) "
+                             f"to replace it")
+        powers, delays = axes(scan)
+        summary = scan_planner.ScanPlan(powers, delays, scan["scan"]["order"]).summary()
+        log(f"{scan['filename']}: {len(powers)} powers x {len(delays)} delays, {summary['points']} points "
+            f"({summary['order']}), stage travel {summary['total']:.1f}")
+    if args.dry_run:
+        return 0
+    hardware = Hardware(scans[0], simulate=args.simulate)
+    for scan in scans:
+        log(f"starting {scan['filename']}")
+        if not run_scan(hardware, scan):
+            log("stopped")
+            return 1
+    log("all scans done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
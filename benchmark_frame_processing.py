@@ -0,0 +1,45 @@
+import time
+import tracemalloc
+import numpy as np
+from frame_processing import FrameProcessor
+
+# Retiga R3 sensor, 1x1 and 4x4 binning
+SHAPES = {"1x1": (1460, 1920), "4x4": (365, 480)}
+
+
+def old_step(ref_raw, pumped_raw):
+    # the processing of take_images before FrameProcessor
+    reference_img = ref_raw.astype(int)  # MMcamera.getImage
+    pumped_img = pumped_raw.astype(int)
+    difference_img = pumped_img - reference_img
+    a = difference_img.astype(float)
+    b = reference_img.astype(float)
+    norm_img = np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+    return {"ref": reference_img, "pumped": pumped_img, "diff": difference_img, "diffNorm": norm_img}
+
+
+def measure(step, ref, pumped, repeats):
+    step(ref, pumped)  # warm up, allocates the buffers of the processor
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        frames = step(ref, pumped)
+        del frames
+    elapsed = (time.perf_counter() - start) / repeats
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    for binning, shape in SHAPES.items():
+        ref = np.random.randint(100, 4096, shape, dtype=np.uint16)
+        pumped = np.random.randint(100, 4096, shape, dtype=np.uint16)
+        repeats = 20 if binning == "1x1" else 200
+        print(f"binning {binning}, frame {shape}")
+        for dtype in ("float32", "float64"):
+            processor = FrameProcessor(dtype)
+            elapsed, peak = measure(processor.process, ref, pumped, repeats)
+            print(f"  FrameProcessor {dtype}: {elapsed * 1e3:7.2f} ms/step, peak allocated {peak / 1e6:7.2f} MB")
+        elapsed, peak = measure(old_step, ref, pumped, repeats)
+        print(f"  old astype path:        {elapsed * 1e3:7.2f} ms/step, peak allocated {peak / 1e6:7.2f} MB")
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import scan_engine
+import scan_planner
+from simulators import SimulatedSetup
+
+# End-to-end throughput of the scan loop with the simulated hardware: steps
+# per hour, median time per stage of a step (from the engine timelines) and
+# memory, for typical scan shapes. Frames are written to a temporary folder.
+# steps/h counts the whole run (first moves, closing the file), steady steps/h
+# uses the median step. Memory is the resident set size of the process, sampled
+# from /proc while the scan runs (tracemalloc would slow the 1x1 scans down ten times).
+#   python benchmark_scan.py                      all scenarios
+#   python benchmark_scan.py --save base.json     keep the results
+#   python benchmark_scan.py --compare base.json  exit code 1 if steps/hour dropped by more than --tolerance
+
+PHASES = ("move_wait", "acquire", "process", "save", "report")
+
+# name -> binning, axes (start, stop, step) and ScanEngine options
+SCENARIOS = {
+    "delay scan 4x4": {"binning": "4x4", "delays": (-1, 10, 0.25), "powers": (30, 30, 1), "engine": {}},
+    "delay scan 4x4 pipelined": {"binning": "4x4", "delays": (-1, 10, 0.25), "powers": (30, 30, 1),
+                                 "engine": {"pipelined": True}},
+    "power x delay 4x4 serpentine": {"binning": "4x4", "delays": (-1, 4, 0.5), "powers": (10, 40, 10),
+                                     "engine": {"pipelined": True, "order": "serpentine"}},
+    "delay scan 4x4 png live": {"binning": "4x4", "delays": (-1, 10, 0.25), "powers": (30, 30, 1),
+                                "engine": {"pipelined": True, "png": "live"}},
+    "delay scan 1x1": {"binning": "1x1", "delays": (-1, 4, 0.5), "powers": (30, 30, 1), "engine": {}},
+    "averaged burst 4x4": {"binning": "4x4", "delays": (-1, 4, 0.5), "powers": (30, 30, 1),
+                           "engine": {"shots": 8, "burst": 8}},
+}
+
+
+def rss_mb():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+class RssSampler(threading.Thread):
+    # peak resident set size while running
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        return self.peak
+
+
+def run_scenario(scenario, exposure_ms):
+    setup = SimulatedSetup()
+    setup.camera.setBinning(scenario["binning"])
+    setup.camera.setExptime(exposure_ms)
+    powers = scan_planner.axis(*scenario["powers"])
+    delays = scan_planner.axis(*scenario["delays"])
+    engine = scan_engine.ScanEngine(setup.camera, setup.lia, setup.delay_line, setup.pump_pwr, setup.shutter_aux,
+                                    **scenario["engine"])
+    with tempfile.TemporaryDirectory() as folder:
+        rss_start = rss_mb()
+        sampler = RssSampler()
+        sampler.start()
+        start = time.perf_counter()
+        engine.run(powers, delays, folder + "/", "benchmark", scan_engine.scan_writer.KINDS)
+        wall = time.perf_counter() - start
+        peak = sampler.stop()
+    steps = len(engine.timelines)
+    result = {"steps": steps, "wall_s": wall, "steps_per_hour": steps / wall * 3600,
+              "steady_steps_per_hour": 3600 / statistics.median(t["step"] for t in engine.timelines),
+              "peak_rss_mb": peak, "rss_growth_mb": peak - rss_start}
+    for phase in PHASES + ("step",):
+        result[f"{phase}_ms"] = statistics.median(t[phase] for t in engine.timelines) * 1e3
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # names of the scenarios whose steps/hour dropped by more than tolerance (fraction)
+    return [name for name, result in results.items()
+            if name in baseline and result["steps_per_hour"] < baseline[name]["steps_per_hour"] * (1 - tolerance)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan throughput with simulated hardware")
+    parser.add_argument("--exposure-ms", type=float, default=20.0, help="camera exposure per frame")
+    parser.add_argument("--only", nargs="*", help="scenario names to run")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of earlier results")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="accepted drop of steps/hour (fraction)")
+    args = parser.parse_args(argv)
+    results = {}
+    print(f"exposure {args.exposure_ms} ms; median ms per step: " + ", ".join(PHASES))
+    for name, scenario in SCENARIOS.items():
+        if args.only and name not in args.only:
+            continue
+        result = run_scenario(scenario, args.exposure_ms)
+        results[name] = result
+        phases = " ".join(f"{result[f'{phase}_ms']:7.1f}" for phase in PHASES)
+        print(f"{name:>30}: {result['steps_per_hour']:6.0f} steps/h ({result['steps']} steps, "
+              f"steady {result['steady_steps_per_hour']:6.0f}), {phases}, "
+              f"peak RSS {result['peak_rss_mb']:5.0f} MB (+{result['rss_growth_mb']:.0f})")
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"exposure_ms": args.exposure_ms, "results": results}, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        slower = compare(results, baseline, args.tolerance)
+        for name in slower:
+            print(f"REGRESSION {name}: {results[name]['steps_per_hour']:.0f} steps/h, "
+                  f"was {baseline[name]['steps_per_hour']:.0f}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
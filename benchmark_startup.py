@@ -0,0 +1,70 @@
+import json
+import statistics
+import subprocess
+import sys
+
+# Startup time of the GUI, every run in a fresh interpreter:
+#   import      import of GUI_pump_probe_imaging (Qt, pyqtgraph, interface.py)
+#   window      MainForm() until the window is shown and the event loop runs
+#   camera      until the camera is connected in the background (or has failed)
+# and, for comparison, what the old startup also paid for: tkinter for the
+# message boxes and parsing interface.ui with pg.Qt.loadUiType.
+# Run it in the program folder; with QT_QPA_PLATFORM=offscreen it works without a display.
+
+CHILD = r"""
+import json, time
+start = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+import GUI_pump_probe_imaging
+imported = time.perf_counter()
+from PyQt6.QtWidgets import QMessageBox
+QMessageBox.critical = staticmethod(lambda *args: None)  # no modal box when there is no camera
+app = QApplication([])
+window = GUI_pump_probe_imaging.MainForm()
+app.processEvents()
+shown = time.perf_counter()
+while window.camera_thread is not None:
+    app.processEvents()
+    time.sleep(0.001)
+connected = time.perf_counter()
+print(json.dumps({"import": imported - start, "window": shown - imported, "camera": connected - shown,
+                  "camera_connected": window.camera is not None}))
+"""
+
+OLD_EXTRAS = r"""
+import json, time
+import pyqtgraph as pg
+start = time.perf_counter()
+import tkinter
+from tkinter import messagebox
+tk = time.perf_counter()
+pg.Qt.loadUiType("interface.ui")
+ui = time.perf_counter()
+print(json.dumps({"tkinter": tk - start, "loadUiType": ui - tk}))
+"""
+
+
+def run_child(code):
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_times(code, repeats):
+    runs = [run_child(code) for _ in range(repeats)]
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    startup = median_times(CHILD, repeats)
+    print(f"median of {repeats} runs")
+    print(f"  import GUI module:  {startup['import'] * 1e3:8.1f} ms")
+    print(f"  window shown:       {startup['window'] * 1e3:8.1f} ms")
+    state = "connected" if startup["camera_connected"] else "failed (no camera)"
+    print(f"  camera {state}: {startup['camera'] * 1e3:8.1f} ms after the window, in the background")
+    try:
+        extras = median_times(OLD_EXTRAS, repeats)
+        print(f"  no longer paid: tkinter {extras['tkinter'] * 1e3:.1f} ms, "
+              f"loadUiType {extras['loadUiType'] * 1e3:.1f} ms")
+    except subprocess.CalledProcessError:
+        print("  (tkinter or pyqtgraph's loadUiType not available for the comparison)")
@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import h5py
+import numpy as np
+import scan_writer
+from scan_journal import ScanJournal
+from scan_reader import LegacyScan
+
+# Converts old scans saved as .dat text frames (ref_<name>/, pumped_<name>/,
+# diff_<name>/, diffNorm_<name>/ with pwr_<power>_delay_<delay>.dat) into
+# scan files <name>.h5 next to the folders, readable with scan_reader:
+#   python convert_dat.py D:/data                  every scan below D:/data
+#   python convert_dat.py D:/data --dry-run        list what would be converted
+# The text files are parsed in a process pool. The scan file is written as
+# <name>.h5.partial with a journal <name>.convert.jsonl, so an interrupted
+# conversion continues where it stopped; it is renamed to <name>.h5 after
+# every frame was read back and matches its text file at the text's precision.
+# The .dat folders are only read, never changed. Scans with files modified in
+# the last --min-age minutes (possibly still being measured) are skipped, and
+# a scan whose files change during the conversion is discarded.
+
+KIND_FOLDER = re.compile(r"^(diffNorm|diff|pumped|ref)_(.+)$")
+
+
+class PrecisionError(ValueError):
+    # a frame does not survive the cast to the dtype of the scan file
+    pass
+
+
+def discover(root):
+    # base names (folder/name) of the legacy scans below root
+    bases = set()
+    for folder, subfolders, files in os.walk(root):
+        for subfolder in subfolders:
+            match = KIND_FOLDER.match(subfolder)
+            if match:
+                bases.add(os.path.join(folder, match.group(2)))
+    return sorted(bases)
+
+
+def decimals(text):
+    # digits after the decimal point of the first number with one (0 for %d files)
+    match = re.search(r"\.(\d+)", text[:1000])
+    return len(match.group(1)) if match else 0
+
+
+def digest(values, places):
+    # of the values rounded to the precision of the text; + 0.0 turns -0.0 into 0.0
+    return hashlib.blake2b((np.round(values.astype(np.float64), places) + 0.0).tobytes(), digest_size=16).hexdigest()
+
+
+def load_dat(fullname, dtype):
+    # runs in the worker processes: (frame in dtype, decimals, digest of the text, digest after the cast)
+    with open(fullname) as file:
+        text = file.read()
+    lines = text.split("\n", 1)
+    columns = len(lines[0].split())
+    values = np.array(text.split(), dtype=np.float64).reshape(-1, columns)
+    places = decimals(text)
+    frame = values.astype(dtype)
+    return frame, places, digest(values, places), digest(frame, places)
+
+
+def ignore_interrupt():
+    # Ctrl+C reaches the workers too; only the main process stops, between two frames
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def source_state(scan):
+    # (number of .dat files, newest modification time, total size) of a legacy scan
+    newest, size = 0.0, 0
+    for fullname in scan.files.values():
+        stat = os.stat(fullname)
+        newest = max(newest, stat.st_mtime)
+        size += stat.st_size
+    return len(scan.files), newest, size
+
+
+def choose_dtype(scan, kinds, dtype):
+    # "auto": float32 if the first frame of every kind survives the cast at its precision
+    if dtype != "auto":
+        return dtype
+    firsts = {}
+    for (power, delay, kind), fullname in sorted(scan.files.items()):
+        if kind in kinds:
+            firsts.setdefault(kind, fullname)
+    for fullname in firsts.values():
+        _, _, text_digest, cast_digest = load_dat(fullname, "float32")
+        if text_digest != cast_digest:
+            return "float64"
+    return "float32"
+
+
+def verify(fullname, scan, journal):
+    # every written frame read back from the closed file against the digest of its text
+    with h5py.File(fullname, "r") as file:
+        frames = file["frames"]
+        kinds = journal.header["kinds"]
+        for (pwr_index, delay_index), entry in journal.entries.items():
+            for kind, (places, expected) in entry["frames"].items():
+                if digest(frames[pwr_index, delay_index, kinds.index(kind)], places) != expected:
+                    return f"frame {kind} at power {scan.powers[pwr_index]}, delay {scan.delays[delay_index]} differs"
+    return None
+
+
+def convert(base, workers, dtype="auto", compression=None, min_age=10.0, raw_only=False):
+    # returns (status, message); status is "converted", "skipped" or "failed".
+    # raw_only: only ref and pumped are converted, diff and diffNorm are derived when read (derived_views).
+    # "auto" chooses the dtype from the first frames; if a later one needs float64, the scan starts again with it
+    requested_dtype = dtype
+    output = base + ".h5"
+    partial = output + ".partial"
+    journal_fullname = base + ".convert.jsonl"
+    if os.path.exists(output):
+        return "skipped", "scan file exists"
+    scan = LegacyScan(base)
+    count, newest, source_bytes = source_state(scan)
+    if time.time() - newest < min_age * 60:
+        return "skipped", f"modified {(time.time() - newest) / 60:.0f} min ago, may still be measured"
+    kinds = scan.kinds
+    if raw_only and {"ref", "pumped"} <= set(kinds):
+        kinds = ("ref", "pumped")
+    points = {}  # (pwr_index, delay_index) -> {kind: file name}
+    for (power, delay, kind), fullname in scan.files.items():
+        if kind not in kinds:
+            continue
+        key = (int(np.searchsorted(scan.powers, power)), int(np.searchsorted(scan.delays, delay)))
+        points.setdefault(key, {})[kind] = fullname
+    journal = None
+    if os.path.exists(partial) and os.path.exists(journal_fullname):
+        journal = ScanJournal.open(journal_fullname)
+        # the .dat files and kinds must be those the partial file was started with
+        if journal.header.get("source") != [count, newest, source_bytes] or journal.header["kinds"] != list(kinds):
+            journal = None
+    if journal is not None:
+        writer = scan_writer.ScanWriter.resume(partial)
+        dtype = writer.dtype
+    else:
+        dtype = choose_dtype(scan, kinds, dtype)
+        settings = {"converted_from": base, "dat_files": count, "dat_bytes": source_bytes}
+        writer = scan_writer.ScanWriter(partial, scan.powers, scan.delays, kinds=kinds, settings=settings,
+                                        dtype=dtype, compression=compression)
+        journal = ScanJournal.create(journal_fullname, scan.powers, scan.delays, kinds,
+                                     source=[count, newest, source_bytes])
+    todo = [(key, kind, fullname) for key, point_files in sorted(points.items()) if not journal.is_done(*key)
+            for kind, fullname in point_files.items()]
+    name = os.path.basename(base)
+    start = last_report = time.perf_counter()
+    done_files = 0
+    restart = False
+    # spawned, not forked: forked workers would keep the scan file open (and locked) after writer.close()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=ignore_interrupt)
+    try:
+        # at most 4 files per worker in flight, so parsed frames do not pile up in memory
+        pending = deque()
+        remaining = iter(todo)
+        point_frames = {}  # (pwr_index, delay_index) -> {kind: (decimals, digest)} of a point being written
+        while True:
+            while len(pending) < 4 * workers:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                pending.append((item, pool.submit(load_dat, item[2], dtype)))
+            if not pending:
+                break
+            (key, kind, fullname), future = pending.popleft()
+            try:
+                frame, places, text_digest, cast_digest = future.result()
+            except ValueError as error:
+                # a damaged text file; the points converted so far stay resumable
+                raise ValueError(f"{fullname} could not be read: {error}") from error
+            if text_digest != cast_digest:
+                raise PrecisionError(f"{fullname} does not fit {dtype}, convert with --dtype float64")
+            writer.write_step(key[0], key[1], {kind: frame})
+            point_frames.setdefault(key, {})[kind] = (places, text_digest)
+            if len(point_frames[key]) == len(points[key]):
+                journal.mark_done(*key, frames=point_frames.pop(key))
+            done_files += 1
+            if time.perf_counter() - last_report > 2 or done_files == len(todo):
+                last_report = time.perf_counter()
+                rate = done_files / (last_report - start)
+                print(f"  {name}: {len(journal.completed)}/{len(points)} points, {rate:.0f} files/s", flush=True)
+    except PrecisionError:
+        # the partial file has the wrong dtype, do not resume it
+        writer.close()
+        os.remove(partial)
+        os.remove(journal_fullname)
+        if requested_dtype != "auto":
+            raise
+        restart = True
+    finally:
+        # an interrupted conversion does not wait for the files still being parsed
+        pool.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    if restart:
+        print(f"  {name}: a frame does not fit {dtype}, starting again in float64", flush=True)
+        return convert(base, workers, "float64", compression, min_age, raw_only)
+    if source_state(LegacyScan(base)) != (count, newest, source_bytes):
+        os.remove(partial)
+        os.remove(journal_fullname)
+        return "failed", ".dat files changed during the conversion, discarded"
+    problem = verify(partial, scan, journal)
+    if problem:
+        return "failed", f"verification: {problem} (kept {partial})"
+    os.replace(partial, output)
+    os.remove(journal_fullname)
+    output_bytes = os.path.getsize(output)
+    return "converted", (f"{count} files, {source_bytes / 1e6:.1f} MB -> {output_bytes / 1e6:.1f} MB "
+                         f"({dtype}, {source_bytes / max(output_bytes, 1):.1f}x smaller)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert legacy .dat scan folders into scan files")
+    parser.add_argument("roots", nargs="+", help="folders searched for ref_*/pumped_*/diff_*/diffNorm_* folders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parsing processes")
+    parser.add_argument("--dtype", choices=["auto", "float32", "float64"], default="auto",
+                        help="auto: float32 unless the text has more precision")
+    parser.add_argument("--compress", action="store_true", help="gzip the frames (smaller, not memory mappable)")
+    parser.add_argument("--min-age", type=float, default=10.0, help="skip scans modified in the last minutes")
+    parser.add_argument("--raw-only", action="store_true",
+                        help="convert only ref and pumped, diff and diffNorm are computed when read")
+    parser.add_argument("--dry-run", action="store_true", help="only list the scans found")
+    args = parser.parse_args(argv)
+    bases = [base for root in args.roots for base in discover(root)]
+    print(f"{len(bases)} legacy scans found")
+    if args.dry_run:
+        for base in bases:
+            print(f"{base}: {'converted' if os.path.exists(base + '.h5') else 'to convert'}")
+        return 0
+    results = {"converted": 0, "skipped": 0, "failed": 0}
+    for base in bases:
+        try:
+            status, message = convert(base, args.workers, args.dtype, "gzip" if args.compress else None,
+                                      args.min_age, args.raw_only)
+        except (OSError, ValueError) as error:
+            status, message = "failed", str(error)
+        except KeyboardInterrupt:
+            print(f"{base}: interrupted, run again to continue")
+            return 130
+        results[status] += 1
+        print(f"{base}: {status}, {message}", flush=True)
+    print(", ".join(f"{count} {status}" for status, count in results.items()))
+    return 1 if results["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
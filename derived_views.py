@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import numpy as np
+
+# Images computed from the raw ref/pumped frames when they are read, so a scan
+# only needs to store the raw frames:
+#   scan.derived("diff")[0, :, 120, 200]              (power, delay, y, x)
+#   scan.derived("dRR", dark=100.0)[0, 5]             dR/R with a dark offset (number or dark frame)
+#   scan.trace("diffNorm", 120, 200)                  also for kinds which are not stored
+# All of them are per pixel functions f(ref, pumped, **params), so only the
+# selected pixels of ref and pumped are read. More can be added to DERIVED.
+# Averaged scans store the mean ref and pumped: derived diffNorm is then the
+# ratio of the means, not the mean of the per shot ratios.
+
+
+def difference(ref, pumped):
+    # as FrameProcessor.process
+    return np.subtract(pumped, ref, dtype=float_dtype(ref))
+
+
+def normalized(ref, pumped):
+    # (pumped - ref) / ref, 0 where ref is 0, as FrameProcessor.process
+    return ratio(difference(ref, pumped), ref)
+
+
+def delta_r(ref, pumped, dark=0.0):
+    # dR/R = (pumped - ref) / (ref - dark), 0 where ref equals the dark level
+    return ratio(difference(ref, pumped), np.subtract(ref, dark, dtype=float_dtype(ref)))
+
+
+DERIVED = {"diff": difference, "diffNorm": normalized, "dRR": delta_r}
+
+
+def float_dtype(frame):
+    # the dtype policy of FrameProcessor: float32 unless the frames are float64 already
+    return np.float64 if np.asarray(frame).dtype == np.float64 else np.float32
+
+
+def ratio(numerator, denominator):
+    out = np.zeros(np.broadcast(numerator, denominator).shape, dtype=numerator.dtype)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def hashable(index):
+    # cache key of an index (slices and arrays are not hashable)
+    if isinstance(index, slice):
+        return ("slice", index.start, index.stop, index.step)
+    if isinstance(index, str) or np.ndim(index) == 0:
+        return index.item() if isinstance(index, np.generic) else index
+    array = np.asarray(index)
+    return ("array", array.shape, array.tobytes())
+
+
+class FrameCache:
+    # LRU cache of computed arrays, bounded by their total size in bytes.
+    # The arrays are made read-only, since every later hit returns the same one.
+    def __init__(self, max_bytes=256e6):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        array = self.entries.get(key)
+        if array is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return array  # would push out everything else
+        array.flags.writeable = False
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+        self.entries[key] = array
+        self.nbytes += array.nbytes
+        while self.nbytes > self.max_bytes:
+            _, oldest = self.entries.popitem(last=False)
+            self.nbytes -= oldest.nbytes
+        return array
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+class DerivedArray:
+    # (power, delay, y, x) view of a derived image kind over the frames of a scan
+    # (scan_reader.ScanArray with "ref" and "pumped"), indexed like ScanArray.
+    # Results are kept in cache (a FrameCache, may be shared by several views).
+    def __init__(self, frames, name, cache=None, **params):
+        if name not in DERIVED:
+            raise KeyError(f"unknown derived kind {name}, known are {tuple(DERIVED)}")
+        missing = {"ref", "pumped"} - set(frames.kinds)
+        if missing:
+            raise KeyError(f"{name} needs the {sorted(missing)} frames, the scan has {frames.kinds}")
+        self.frames = frames
+        self.name = name
+        self.function = DERIVED[name]
+        self.params = params
+        self.cache = FrameCache() if cache is None else cache
+        self.shape = frames.shape[:2] + frames.shape[3:]
+        self.params_key = tuple(sorted((key, hashable(value)) for key, value in params.items()))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > self.ndim:
+            raise IndexError("too many indices, the axes are ('power', 'delay', 'y', 'x')")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        cache_key = (self.name, self.params_key) + tuple(hashable(index) for index in key)
+        out = self.cache.get(cache_key)
+        if out is not None:
+            return out
+        power, delay, y, x = key
+        ref = self.frames[power, delay, "ref", y, x]
+        pumped = self.frames[power, delay, "pumped", y, x]
+        params = {name: self.select(value, y, x) for name, value in self.params.items()}
+        return self.cache.put(cache_key, np.asarray(self.function(ref, pumped, **params)))
+
+    @staticmethod
+    def select(value, y, x):
+        # frame shaped parameters (a dark frame) cut like the frames, numbers as they are
+        if np.ndim(value) != 2:
+            return value
+        return np.asarray(value)[y][..., x]  # rows, then columns: each axis on its own
+
+
+if __name__ == "__main__":
+    import time
+    from scan_reader import ScanArray
+    rng = np.random.default_rng(0)
+    stack = rng.integers(100, 4096, (1, 200, 2, 512, 512)).astype(np.float32)
+    frames = ScanArray(stack.shape, stack.dtype, ("ref", "pumped"), lambda p, d, k: stack[p, d, k])
+    view = DerivedArray(frames, "dRR", dark=100.0)
+    for attempt in ("computed", "cached"):
+        start = time.perf_counter()
+        trace = view[0, :, 256, 256]
+        print(f"dR/R trace of 200 delays, {attempt}: {(time.perf_counter() - start) * 1e3:.2f} ms")
+    print(f"cache: {view.cache.hits} hits, {view.cache.misses} misses, {view.cache.nbytes / 1e3:.1f} kB")
@@ -0,0 +1,47 @@
+import math
+from PyQt6.QtCore import QRectF
+from frame_processing import central_levels
+
+
+class FrameDisplay:
+    # Preview of the frames of one ImageView. submit() only keeps the newest
+    # frame (latest wins); render(), called from a GUI timer, draws it decimated
+    # to the widget size into the existing ImageItem. Levels are cached and
+    # recomputed from a subsample every level_every frames or when the shape changes.
+    def __init__(self, view, level_every=10, percentiles=None):
+        self.view = view
+        self.image_item = view.getImageItem()
+        self.level_every = level_every
+        self.percentiles = percentiles
+        self.pending = None
+        self.levels = None
+        self.shape = None
+        self.frames_since_levels = 0
+
+    def submit(self, frame):
+        self.pending = frame
+
+    def decimate(self, frame):
+        # strided view, no copy; one stride for both axes keeps the aspect ratio
+        stride = max(1, math.ceil(frame.shape[0] / max(1, self.view.height())),
+                     math.ceil(frame.shape[1] / max(1, self.view.width())))
+        return frame[::stride, ::stride]
+
+    def render(self):
+        if self.pending is None:
+            return False
+        frame = self.pending
+        self.pending = None
+        new_shape = frame.shape != self.shape
+        if new_shape or self.levels is None or self.frames_since_levels >= self.level_every:
+            self.levels = central_levels(frame, percentiles=self.percentiles)
+            self.frames_since_levels = 0
+        self.frames_since_levels += 1
+        preview = self.decimate(frame)
+        self.image_item.setImage(preview.T, autoLevels=False, levels=self.levels)
+        # keep full-frame pixel coordinates whatever the decimation
+        self.image_item.setRect(QRectF(0, 0, frame.shape[1], frame.shape[0]))
+        if new_shape:
+            self.shape = frame.shape
+            self.view.getView().autoRange()
+        return True
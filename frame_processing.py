@@ -0,0 +1,85 @@
+import math
+import threading
+import time
+import numpy as np
+
+# dtype policy of the derived images: float32 is exact for differences of
+# 16-bit frames and half the size of float64
+DTYPES = ("float32", "float64")
+
+
+class FrameProcessor:
+    # Difference and normalized difference of raw (uint16) frames, computed
+    # in place into preallocated buffers. Buffer sets are kept per
+    # (frame shape, binning). The frames of process() are valid until its next
+    # call; whoever keeps them longer (the write queue, the .png exporter) calls
+    # hold(frames) and the returned release() when done. A set is reused when
+    # nothing holds it; at most max_sets sets are allocated per key, then
+    # process() waits for a release (RuntimeError after wait_timeout s).
+    def __init__(self, dtype="float32", max_sets=16, wait_timeout=60.0):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.dtype = np.dtype(dtype)
+        self.max_sets = max_sets
+        self.wait_timeout = wait_timeout
+        self.buffers = {}  # (shape, binning) -> list of buffer sets
+        self.holds = {}  # id of a set's diff buffer -> [number of holds]
+        self.released = threading.Condition()
+
+    def buffers_for(self, shape, binning=None):
+        with self.released:
+            sets = self.buffers.setdefault((tuple(shape), binning), [])
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                for arrays in sets:
+                    if self.holds[id(arrays["diff"])][0] == 0:
+                        return arrays
+                if len(sets) < self.max_sets:
+                    arrays = {"diff": np.empty(shape, self.dtype), "diffNorm": np.empty(shape, self.dtype),
+                              "mask": np.empty(shape, bool)}
+                    sets.append(arrays)
+                    self.holds[id(arrays["diff"])] = [0]
+                    return arrays
+                if not self.released.wait(max(0.0, deadline - time.monotonic())):
+                    raise RuntimeError(f"all {self.max_sets} frame buffer sets held for {self.wait_timeout} s")
+
+    def hold(self, frames):
+        # keeps the buffers of frames (a result of process) from being reused until
+        # the returned release() is called; frames of other buffers need no hold
+        count = self.holds.get(id(frames.get("diff")))
+        if count is None:
+            return lambda: None
+        with self.released:
+            count[0] += 1
+
+        def release():
+            with self.released:
+                count[0] -= 1
+                self.released.notify_all()
+        return release
+
+    def process(self, reference_img, pumped_img, binning=None):
+        # returns {kind: image}; ref and pumped stay in their native dtype
+        buffers = self.buffers_for(reference_img.shape, binning)
+        diff = buffers["diff"]
+        norm = buffers["diffNorm"]
+        mask = buffers["mask"]
+        np.subtract(pumped_img, reference_img, out=diff, dtype=self.dtype)
+        np.not_equal(reference_img, 0, out=mask)
+        norm.fill(0)
+        np.divide(diff, reference_img, out=norm, where=mask)
+        return {"ref": reference_img, "pumped": pumped_img, "diff": diff, "diffNorm": norm}
+
+
+def central_levels(frame, max_samples=20000, percentiles=None):
+    # min/max of the central half of the frame, as in MainForm.update_frame.
+    # The crop is subsampled to about max_samples pixels; with percentiles=(low, high)
+    # those percentiles are used instead of min/max.
+    num_rows, num_columns = frame.shape
+    central = frame[num_rows//4: num_rows*3//4, num_columns//4: num_columns*3//4]
+    stride = max(1, int(math.sqrt(central.size / max_samples)))
+    sample = central[::stride, ::stride]
+    if percentiles is None:
+        return float(np.min(sample)), float(np.max(sample))
+    low, high = np.percentile(sample, percentiles)
+    return float(low), float(high)
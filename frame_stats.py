@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class RunningStats:
+    # Welford running mean and variance of frames. All buffers are allocated
+    # once for the frame shape, so memory does not grow with the number of shots
+    # and add() makes no temporary arrays.
+    def __init__(self, shape, dtype=np.float32):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = np.zeros(shape, dtype)
+        self.m2 = np.zeros(shape, dtype)  # sum of squared deviations from the mean
+        self.delta = np.empty(shape, dtype)
+        self.scratch = np.empty(shape, dtype)
+
+    def reset(self):
+        self.count = 0
+        self.mean.fill(0)
+        self.m2.fill(0)
+
+    def add(self, frame):
+        self.count += 1
+        np.subtract(frame, self.mean, out=self.delta)  # x - old mean
+        np.multiply(self.delta, 1.0 / self.count, out=self.scratch)
+        self.mean += self.scratch
+        np.subtract(frame, self.mean, out=self.scratch)  # x - new mean
+        self.scratch *= self.delta
+        self.m2 += self.scratch
+
+    def variance(self):
+        if self.count < 2:
+            return np.zeros(self.shape, self.mean.dtype)
+        return self.m2 / (self.count - 1)
+
+    def stderr(self):
+        # per-pixel standard error of the mean
+        if self.count < 2:
+            return np.zeros(self.shape, self.mean.dtype)
+        return np.sqrt(self.m2 / ((self.count - 1) * self.count))
+
+
+class ScalarStats:
+    # the same for one number per shot, e.g. the ROI mean of the difference image
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def snr(self):
+        # |mean| / standard error of the mean
+        if self.count < 2 or self.m2 == 0:
+            return 0.0
+        return abs(self.mean) / np.sqrt(self.m2 / ((self.count - 1) * self.count))
+
+
+if __name__ == "__main__":
+    frames = np.random.normal(100, 5, (50, 128, 128)).astype(np.float32)
+    stats = RunningStats(frames.shape[1:])
+    for frame in frames:
+        stats.add(frame)
+    print(np.abs(stats.mean - frames.mean(0)).max(), np.abs(stats.variance() - frames.var(0, ddof=1)).max())
+    roi = ScalarStats()
+    for frame in frames:
+        roi.add(frame[32:96, 32:96].mean())
+    print(f"ROI SNR {roi.snr():.1f}")
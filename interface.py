@@ -12,7 +12,7 @@ from PyQt6 import QtCore, QtGui, QtWidgets
 class Ui_Form(object):
     def setupUi(self, Form):
         Form.setObjectName("Form")
-        Form.resize(1281, 1030)
+        Form.resize(1511, 1030)
         self.folder_edit = QtWidgets.QLineEdit(parent=Form)
         self.folder_edit.setGeometry(QtCore.QRect(11, 181, 401, 25))
         font = QtGui.QFont()
@@ -395,6 +395,130 @@ class Ui_Form(object):
         self.additionalPWRseq_Edit.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         self.additionalPWRseq_Edit.setObjectName("additionalPWRseq_Edit")
         self.verticalLayout.addWidget(self.additionalPWRseq_Edit)
+        self.optionsWidget = QtWidgets.QWidget(parent=Form)
+        self.optionsWidget.setGeometry(QtCore.QRect(1280, 21, 221, 1000))
+        self.optionsWidget.setObjectName("optionsWidget")
+        self.optionsLayout = QtWidgets.QVBoxLayout(self.optionsWidget)
+        self.optionsLayout.setContentsMargins(0, 0, 0, 0)
+        self.optionsLayout.setObjectName("optionsLayout")
+        self.cameraStatusLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.cameraStatusLabel.setObjectName("cameraStatusLabel")
+        self.optionsLayout.addWidget(self.cameraStatusLabel)
+        self.checkBoxLegacyDat = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxLegacyDat.setObjectName("checkBoxLegacyDat")
+        self.optionsLayout.addWidget(self.checkBoxLegacyDat)
+        self.checkBoxRawOnly = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxRawOnly.setObjectName("checkBoxRawOnly")
+        self.optionsLayout.addWidget(self.checkBoxRawOnly)
+        self.pngLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.pngLabel.setObjectName("pngLabel")
+        self.optionsLayout.addWidget(self.pngLabel)
+        self.pngComboBox = QtWidgets.QComboBox(parent=self.optionsWidget)
+        self.pngComboBox.setObjectName("pngComboBox")
+        self.pngComboBox.addItem("")
+        self.pngComboBox.addItem("")
+        self.pngComboBox.addItem("")
+        self.optionsLayout.addWidget(self.pngComboBox)
+        self.checkBoxPipelined = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxPipelined.setObjectName("checkBoxPipelined")
+        self.optionsLayout.addWidget(self.checkBoxPipelined)
+        self.orderLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.orderLabel.setObjectName("orderLabel")
+        self.optionsLayout.addWidget(self.orderLabel)
+        self.orderComboBox = QtWidgets.QComboBox(parent=self.optionsWidget)
+        self.orderComboBox.setObjectName("orderComboBox")
+        self.orderComboBox.addItem("")
+        self.orderComboBox.addItem("")
+        self.orderComboBox.addItem("")
+        self.optionsLayout.addWidget(self.orderComboBox)
+        self.planLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.planLabel.setText("")
+        self.planLabel.setWordWrap(True)
+        self.planLabel.setObjectName("planLabel")
+        self.optionsLayout.addWidget(self.planLabel)
+        self.checkBoxResume = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxResume.setObjectName("checkBoxResume")
+        self.optionsLayout.addWidget(self.checkBoxResume)
+        self.timelineLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.timelineLabel.setWordWrap(True)
+        self.timelineLabel.setObjectName("timelineLabel")
+        self.optionsLayout.addWidget(self.timelineLabel)
+        self.timingButton = QtWidgets.QPushButton(parent=self.optionsWidget)
+        self.timingButton.setObjectName("timingButton")
+        self.optionsLayout.addWidget(self.timingButton)
+        self.checkBoxProfileStep = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxProfileStep.setObjectName("checkBoxProfileStep")
+        self.optionsLayout.addWidget(self.checkBoxProfileStep)
+        self.shotsLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.shotsLabel.setObjectName("shotsLabel")
+        self.optionsLayout.addWidget(self.shotsLabel)
+        self.shotsSpinBox = QtWidgets.QSpinBox(parent=self.optionsWidget)
+        self.shotsSpinBox.setMinimum(1)
+        self.shotsSpinBox.setMaximum(10000)
+        self.shotsSpinBox.setObjectName("shotsSpinBox")
+        self.optionsLayout.addWidget(self.shotsSpinBox)
+        self.burstLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.burstLabel.setObjectName("burstLabel")
+        self.optionsLayout.addWidget(self.burstLabel)
+        self.burstSpinBox = QtWidgets.QSpinBox(parent=self.optionsWidget)
+        self.burstSpinBox.setMaximum(1000)
+        self.burstSpinBox.setObjectName("burstSpinBox")
+        self.optionsLayout.addWidget(self.burstSpinBox)
+        self.snrTargetLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.snrTargetLabel.setObjectName("snrTargetLabel")
+        self.optionsLayout.addWidget(self.snrTargetLabel)
+        self.snrTargetEdit = QtWidgets.QLineEdit(parent=self.optionsWidget)
+        self.snrTargetEdit.setObjectName("snrTargetEdit")
+        self.optionsLayout.addWidget(self.snrTargetEdit)
+        self.shotsStatusLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.shotsStatusLabel.setText("")
+        self.shotsStatusLabel.setObjectName("shotsStatusLabel")
+        self.optionsLayout.addWidget(self.shotsStatusLabel)
+        self.checkBoxShutterConfirm = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxShutterConfirm.setObjectName("checkBoxShutterConfirm")
+        self.optionsLayout.addWidget(self.checkBoxShutterConfirm)
+        self.shutterSettleLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.shutterSettleLabel.setObjectName("shutterSettleLabel")
+        self.optionsLayout.addWidget(self.shutterSettleLabel)
+        self.shutterSettleEdit = QtWidgets.QLineEdit(parent=self.optionsWidget)
+        self.shutterSettleEdit.setObjectName("shutterSettleEdit")
+        self.optionsLayout.addWidget(self.shutterSettleEdit)
+        self.checkBoxLockinLog = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxLockinLog.setObjectName("checkBoxLockinLog")
+        self.optionsLayout.addWidget(self.checkBoxLockinLog)
+        self.lockinRateLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.lockinRateLabel.setObjectName("lockinRateLabel")
+        self.optionsLayout.addWidget(self.lockinRateLabel)
+        self.lockinRateEdit = QtWidgets.QLineEdit(parent=self.optionsWidget)
+        self.lockinRateEdit.setObjectName("lockinRateEdit")
+        self.optionsLayout.addWidget(self.lockinRateEdit)
+        self.checkBoxAdaptive = QtWidgets.QCheckBox(parent=self.optionsWidget)
+        self.checkBoxAdaptive.setObjectName("checkBoxAdaptive")
+        self.optionsLayout.addWidget(self.checkBoxAdaptive)
+        self.adaptiveBudgetLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.adaptiveBudgetLabel.setObjectName("adaptiveBudgetLabel")
+        self.optionsLayout.addWidget(self.adaptiveBudgetLabel)
+        self.adaptiveBudgetSpinBox = QtWidgets.QSpinBox(parent=self.optionsWidget)
+        self.adaptiveBudgetSpinBox.setMinimum(2)
+        self.adaptiveBudgetSpinBox.setMaximum(10000)
+        self.adaptiveBudgetSpinBox.setProperty("value", 50)
+        self.adaptiveBudgetSpinBox.setObjectName("adaptiveBudgetSpinBox")
+        self.optionsLayout.addWidget(self.adaptiveBudgetSpinBox)
+        self.adaptiveToleranceLabel = QtWidgets.QLabel(parent=self.optionsWidget)
+        self.adaptiveToleranceLabel.setWordWrap(True)
+        self.adaptiveToleranceLabel.setObjectName("adaptiveToleranceLabel")
+        self.optionsLayout.addWidget(self.adaptiveToleranceLabel)
+        self.adaptiveToleranceEdit = QtWidgets.QLineEdit(parent=self.optionsWidget)
+        self.adaptiveToleranceEdit.setObjectName("adaptiveToleranceEdit")
+        self.optionsLayout.addWidget(self.adaptiveToleranceEdit)
+        self.addDiffRoiButton = QtWidgets.QPushButton(parent=self.optionsWidget)
+        self.addDiffRoiButton.setObjectName("addDiffRoiButton")
+        self.optionsLayout.addWidget(self.addDiffRoiButton)
+        self.addNormRoiButton = QtWidgets.QPushButton(parent=self.optionsWidget)
+        self.addNormRoiButton.setObjectName("addNormRoiButton")
+        self.optionsLayout.addWidget(self.addNormRoiButton)
+        spacerItem = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Policy.Minimum, QtWidgets.QSizePolicy.Policy.Expanding)
+        self.optionsLayout.addItem(spacerItem)
 
         self.retranslateUi(Form)
         self.binningComboBox.setCurrentIndex(-1)
@@ -446,4 +570,51 @@ class Ui_Form(object):
         self.additionalDLseq_Edit.setText(_translate("Form", "0:2:8"))
         self.additionalPWR_checkBox.setText(_translate("Form", "Use additional PWR sequence"))
         self.additionalPWRseq_Edit.setText(_translate("Form", "0:2:8"))
+        self.cameraStatusLabel.setText(_translate("Form", "Camera: not connected"))
+        self.checkBoxLegacyDat.setText(_translate("Form", "Also save legacy .dat files"))
+        self.checkBoxRawOnly.setToolTip(_translate("Form", "Save only the ref and pumped frames; difference and normalized images are computed when the scan is read (scan_reader)"))
+        self.checkBoxRawOnly.setText(_translate("Form", "Save raw frames only"))
+        self.pngLabel.setText(_translate("Form", ".png previews"))
+        self.pngComboBox.setToolTip(_translate("Form", "live: written in the background during the scan; deferred: written from the scan file when the scan ends; off: no .png files"))
+        self.pngComboBox.setItemText(0, _translate("Form", "live"))
+        self.pngComboBox.setItemText(1, _translate("Form", "deferred"))
+        self.pngComboBox.setItemText(2, _translate("Form", "off"))
+        self.checkBoxPipelined.setToolTip(_translate("Form", "Move the stages to the next point while the current step is processed and saved"))
+        self.checkBoxPipelined.setText(_translate("Form", "Pipelined scan"))
+        self.orderLabel.setText(_translate("Form", "Point order"))
+        self.orderComboBox.setToolTip(_translate("Form", "raster: every power from the first delay; serpentine: delay direction alternates; travel: start at the nearer end from the current stage positions"))
+        self.orderComboBox.setItemText(0, _translate("Form", "raster"))
+        self.orderComboBox.setItemText(1, _translate("Form", "serpentine"))
+        self.orderComboBox.setItemText(2, _translate("Form", "travel"))
+        self.checkBoxResume.setToolTip(_translate("Form", "Continue the scan file of this name: points already in its journal are skipped"))
+        self.checkBoxResume.setText(_translate("Form", "Resume scan (skip acquired points)"))
+        self.timelineLabel.setText(_translate("Form", "Step timeline:"))
+        self.timingButton.setToolTip(_translate("Form", "Time per part of the scan steps (median, 95th percentile, maximum) in a separate window"))
+        self.timingButton.setText(_translate("Form", "Step timing"))
+        self.checkBoxProfileStep.setToolTip(_translate("Form", "Run the next scan step under cProfile and save the profile next to the scan file"))
+        self.checkBoxProfileStep.setText(_translate("Form", "Profile next step"))
+        self.shotsLabel.setText(_translate("Form", "Shots per point"))
+        self.burstLabel.setText(_translate("Form", "Burst size (0 = single snaps)"))
+        self.burstSpinBox.setToolTip(_translate("Form", "Take the shots as camera sequences of this many refs, then as many pumped frames"))
+        self.snrTargetLabel.setText(_translate("Form", "Stop at ROI SNR (0 = off)"))
+        self.snrTargetEdit.setText(_translate("Form", "0"))
+        self.checkBoxShutterConfirm.setToolTip(_translate("Form", "Wait for *OPC? of the lock-in after every shutter write"))
+        self.checkBoxShutterConfirm.setText(_translate("Form", "Confirm shutter writes"))
+        self.shutterSettleLabel.setText(_translate("Form", "Shutter settle time (ms)"))
+        self.shutterSettleEdit.setToolTip(_translate("Form", "Time the shutter needs to open or close after the write, waited before the next exposure"))
+        self.shutterSettleEdit.setText(_translate("Form", "0"))
+        self.checkBoxLockinLog.setToolTip(_translate("Form", "Record X/Y/R of the lock-in (internal data buffer) during every exposure and save mean and std per point"))
+        self.checkBoxLockinLog.setText(_translate("Form", "Log lock-in signal"))
+        self.lockinRateLabel.setText(_translate("Form", "Lock-in sample rate (Hz)"))
+        self.lockinRateEdit.setToolTip(_translate("Form", "Rounded to a power of 2 between 0.0625 and 512 Hz"))
+        self.lockinRateEdit.setText(_translate("Form", "64"))
+        self.checkBoxAdaptive.setToolTip(_translate("Form", "Take the delays above as a coarse pass, then add delays where the ROI signal of the difference image changes most"))
+        self.checkBoxAdaptive.setText(_translate("Form", "Adaptive delays"))
+        self.adaptiveBudgetLabel.setText(_translate("Form", "Max. delays per power"))
+        self.adaptiveToleranceLabel.setText(_translate("Form", "Refine while change > (fraction of signal range)"))
+        self.adaptiveToleranceEdit.setText(_translate("Form", "0.05"))
+        self.addDiffRoiButton.setToolTip(_translate("Form", "Add a ROI to the difference view, its mean versus delay is plotted during the scan"))
+        self.addDiffRoiButton.setText(_translate("Form", "Add ROI (difference)"))
+        self.addNormRoiButton.setToolTip(_translate("Form", "Add a ROI to the normalized view, its mean versus delay is plotted during the scan"))
+        self.addNormRoiButton.setText(_translate("Form", "Add ROI (normalized)"))
 from pyqtgraph import ImageView
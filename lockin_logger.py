@@ -0,0 +1,149 @@
+import threading
+import time
+import numpy as np
+
+# internal data buffer of the SR830 / SR844: sample rate code n (SRAT) is 2**(n - 4) Hz
+# (62.5 mHz .. 512 Hz), 16383 points per channel
+BUFFER_RATES = [2.0 ** (code - 4) for code in range(14)]
+BUFFER_SIZE = 16383
+CHANNELS = ("X", "Y", "R")
+SHUTTER_STATES = ("closed", "open")
+
+
+def empty_stats(windows=0):
+    # per shutter state (closed, open) and channel (X, Y, R); "window_*" per exposure window
+    # first: the n-th window of each shutter state (the n-th shot, or burst block) is row n
+    return {"mean": np.full((2, 3), np.nan), "std": np.full((2, 3), np.nan), "count": np.zeros(2, dtype=int),
+            "window_mean": np.full((windows, 2, 3), np.nan), "window_std": np.full((windows, 2, 3), np.nan),
+            "window_count": np.zeros((windows, 2), dtype=int)}
+
+
+class LockinLogger:
+    # Background logging of X and Y (R = hypot) from the lock-in's internal
+    # data buffer while the scan runs. A thread fills the buffer at `rate` Hz
+    # (rounded to a rate the lock-in has) and collects the new points every
+    # poll_interval s with binary transfers (SPTS?, TRCB?); before the buffer
+    # is full it is restarted. Sample times are perf_counter() times counted
+    # from the STRT command. The acquisition loop only notes the time windows
+    # of its exposures; stats() (called in the write queue thread) waits until
+    # the samples of the windows are read and returns their mean and std per
+    # shutter state, and per window so the shot to shot fluctuations are kept
+    # (a burst block is one window). Samples before the windows asked for are dropped, so
+    # stats() must be called in the order of the exposures.
+    def __init__(self, lia, rate=64.0, poll_interval=0.5):
+        self.lia = lia
+        self.rate_code = int(np.argmin([abs(np.log2(r / rate)) for r in BUFFER_RATES]))
+        self.rate = BUFFER_RATES[self.rate_code]
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.chunks = []  # (times, x, y) arrays in the order they were read
+        self.latest = -np.inf  # time of the newest sample read
+        self.restarts = 0
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.error = None
+        self.latest = -np.inf
+        self.thread = threading.Thread(target=self._run, name="LockinLogger", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        with self.condition:
+            self.chunks = []
+            self.condition.notify_all()
+
+    def _run(self):
+        # restart before the buffer could fill up between two polls
+        limit = BUFFER_SIZE - int(2 * self.poll_interval * self.rate) - 1
+        try:
+            while not self.stop_event.is_set():
+                start_time = self.lia.buffer_start(self.rate_code)
+                read = 0
+                while read < limit and not self.stop_event.wait(self.poll_interval):
+                    count = min(self.lia.buffer_count(), BUFFER_SIZE)
+                    if count > read:
+                        x = self.lia.buffer_read(1, read, count - read)
+                        y = self.lia.buffer_read(2, read, count - read)
+                        times = start_time + np.arange(read, count) / self.rate
+                        with self.condition:
+                            self.chunks.append((times, x, y))
+                            self.latest = times[-1]
+                            self.condition.notify_all()
+                        read = count
+                self.lia.buffer_pause()
+                if not self.stop_event.is_set():
+                    self.restarts += 1
+        except Exception as error:
+            with self.condition:
+                self.error = error
+                self.condition.notify_all()
+
+    def stats(self, windows, timeout=None):
+        # windows: [(shutter open, start, end)] in perf_counter() time. Waits until the
+        # samples up to the last end are read (at most timeout s, default 3 polls + 1 s),
+        # returns {"mean", "std": (shutter state, channel), "count": per shutter state,
+        # "window_mean", "window_std": (window, shutter state, channel), "window_count": (window, shutter state)}
+        if not windows:
+            return empty_stats()
+        stats = empty_stats(max(sum(1 for window in windows if window[0] == state) for state in (False, True)))
+        end = max(window[2] for window in windows)
+        timeout = 3 * self.poll_interval + 1 if timeout is None else timeout
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest >= end or self.error is not None or self.thread is None,
+                                    timeout)
+            if self.error is not None:
+                raise RuntimeError(f"Lock-in logging failed: {self.error}")
+            first = min(window[1] for window in windows)
+            self.chunks = [chunk for chunk in self.chunks if chunk[0][-1] >= first]
+            chunks = list(self.chunks)
+        if not chunks:
+            return stats
+        times = np.concatenate([chunk[0] for chunk in chunks])
+        x = np.concatenate([chunk[1] for chunk in chunks]).astype(float)
+        y = np.concatenate([chunk[2] for chunk in chunks]).astype(float)
+        samples = np.stack([x, y, np.hypot(x, y)], axis=1)
+        for state in (False, True):
+            selected = np.zeros(len(times), dtype=bool)
+            for is_open, start, stop in windows:
+                if is_open == state:
+                    selected |= (times >= start) & (times <= stop)
+            count = int(selected.sum())
+            stats["count"][int(state)] = count
+            if count:
+                stats["mean"][int(state)] = samples[selected].mean(axis=0)
+                stats["std"][int(state)] = samples[selected].std(axis=0)
+            for number, (_, start, stop) in enumerate(window for window in windows if window[0] == state):
+                in_window = samples[(times >= start) & (times <= stop)]
+                stats["window_count"][number, int(state)] = len(in_window)
+                if len(in_window):
+                    stats["window_mean"][number, int(state)] = in_window.mean(axis=0)
+                    stats["window_std"][number, int(state)] = in_window.std(axis=0)
+        return stats
+
+
+if __name__ == "__main__":
+    from simulators import SimLockin
+    lia = SimLockin()
+    logger = LockinLogger(lia, rate=128, poll_interval=0.2)
+    logger.start()
+    windows = []
+    for is_open in (False, True, False, True):
+        lia.set_aux(lia.signal_aux, 5 if is_open else 0)
+        start = time.perf_counter()
+        time.sleep(0.5)  # exposure
+        windows.append((is_open, start, time.perf_counter()))
+    stats = logger.stats(windows)
+    logger.stop()
+    for state, name in enumerate(SHUTTER_STATES):
+        print(f"shutter {name}: {stats['count'][state]} samples, X {stats['mean'][state][0]:.3e} "
+              f"+- {stats['std'][state][0]:.1e} V, per exposure {stats['window_mean'][:, state, 0]}")
@@ -1,7 +1,7 @@
 import pymmcore
 import os.path
 import os
-import matplotlib.pyplot as plt
+import time
 
 
 class MMcamera():
@@ -10,10 +10,73 @@ class MMcamera():
         os.environ["PATH"] += os.pathsep.join(["", mm_dir])  # adviseable on Windows
         self.mmc.setDeviceAdapterSearchPaths([mm_dir])
         self.mmc.loadSystemConfiguration(os.path.join(mm_dir, config_file))
-
-    def getImage(self):
-        self.mmc.snapImage()
-        return self.mmc.getImage().astype(int)
+        self.dropped = 0  # frames lost in the last sequence()
+
+    def getImage(self, stop_event=None):
+        # frames keep the camera's native dtype (uint16)
+        if stop_event is None:
+            self.mmc.snapImage()
+            return self.mmc.getImage()
+        # one-frame sequence instead of snapImage, so a long exposure can be aborted.
+        # Returns None if stop_event was set before the frame arrived
+        self.mmc.startSequenceAcquisition(1, 0, True)
+        try:
+            while self.mmc.getRemainingImageCount() == 0:
+                if stop_event.wait(0.01):
+                    return None
+                if not self.mmc.isSequenceRunning() and self.mmc.getRemainingImageCount() == 0:
+                    raise RuntimeError("Camera sequence ended without an image")
+            return self.mmc.popNextImage()
+        finally:
+            # the camera may still report the sequence as running after its frame arrived;
+            # the next startSequenceAcquisition is refused until it has ended
+            if self.mmc.isSequenceRunning():
+                self.mmc.stopSequenceAcquisition()
+
+    def sequence(self, num_images, stop_event=None, buffer_mb=None):
+        # Burst of num_images frames at the camera's own rate, read from the core's
+        # circular buffer. Yields (frame, metadata) with the frame index, the camera
+        # image number and the time stamps. Frames lost to gaps in the image numbers,
+        # an overflowed buffer or a sequence which ends early are counted in self.dropped.
+        if buffer_mb is not None:
+            self.mmc.setCircularBufferMemoryFootprint(buffer_mb)
+        self.dropped = 0
+        md = pymmcore.Metadata()
+        received = 0
+        last_number = None
+        self.mmc.startSequenceAcquisition(num_images, 0, True)
+        try:
+            while received < num_images:
+                if self.mmc.getRemainingImageCount() > 0:
+                    frame = self.mmc.popNextImageMD(md)
+                    number = int(md.GetSingleTag("ImageNumber").GetValue()) if md.HasTag("ImageNumber") else received
+                    if last_number is not None and number > last_number + 1:
+                        self.dropped += number - last_number - 1
+                    last_number = number
+                    metadata = {
+                        "index": received,
+                        "image_number": number,
+                        "elapsed_ms": float(md.GetSingleTag("ElapsedTime-ms").GetValue())
+                        if md.HasTag("ElapsedTime-ms") else None,
+                        "host_time": time.time(),
+                    }
+                    received += 1
+                    yield frame, metadata
+                elif self.mmc.isBufferOverflowed():
+                    self.dropped = max(self.dropped, num_images - received)
+                    return
+                elif not self.mmc.isSequenceRunning():
+                    if self.mmc.getRemainingImageCount() == 0:
+                        self.dropped = max(self.dropped, num_images - received)
+                        return
+                elif stop_event is not None:
+                    if stop_event.wait(0.001):
+                        return
+                else:
+                    time.sleep(0.001)
+        finally:
+            if self.mmc.isSequenceRunning():
+                self.mmc.stopSequenceAcquisition()
 
     def getExptime(self):
         return self.mmc.getExposure()
@@ -58,6 +121,7 @@ class MMcamera():
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt  # only for the demo, the class itself has no GUI imports
     camera = MMcamera()
     camera.setExptime(100)
     print(f"Explosure time {camera.getExptime()} ms")
@@ -73,5 +137,7 @@ if __name__ == "__main__":
     print(f"Gain {camera.getGain()}")
     print(f"Bytes per pixel {camera.getBytesPerPixel()}")
     img = camera.getImage()
+    frames = [metadata for frame, metadata in camera.sequence(20)]
+    print(f"Sequence: {len(frames)} frames, {camera.dropped} dropped, last {frames[-1]}")
     imgplot = plt.imshow(img)
     plt.show()
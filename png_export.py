@@ -0,0 +1,139 @@
+import contextlib
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from frame_processing import central_levels
+
+# "live": rendered in the background during the scan, "deferred": from the scan
+# file once the scan is finished, "off": no .png files
+PNG_MODES = ("live", "deferred", "off")
+
+
+def make_lut(colormap=None):
+    # (256, 3) uint8 colors; None = gray like the ImageViews, or the name of a pyqtgraph colormap
+    if colormap is None:
+        return np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    import pyqtgraph as pg
+    return np.asarray(pg.colormap.get(colormap).getLookupTable(nPts=256, alpha=False), dtype=np.uint8)
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_png(fullname, index, lut, level=1):
+    # 8 bit palette PNG of the color indices; zlib works outside the GIL, so several
+    # threads encode in parallel (without Qt, as the batch scans)
+    num_rows, num_columns = index.shape
+    rows = np.zeros((num_rows, num_columns + 1), dtype=np.uint8)  # filter type 0 before each row
+    rows[:, 1:] = index
+    header = struct.pack(">IIBBBBB", num_columns, num_rows, 8, 3, 0, 0, 0)
+    with open(fullname, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", header) + png_chunk(b"PLTE", lut.tobytes())
+                   + png_chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) + png_chunk(b"IEND", b""))
+
+
+def render_png(frame, fullname, lut, levels=None):
+    # one pixel per frame pixel, rows from the top as in the views. levels (low, high)
+    # default to min/max of the central half of the frame, as in MainForm.update_frame
+    if levels is None:
+        levels = central_levels(frame, max_samples=frame.size)
+    low, high = levels
+    scale = 256 / (high - low) if high > low else 0.0
+    index = np.clip((np.asarray(frame, dtype=np.float32) - low) * scale, 0, 255).astype(np.uint8)
+    write_png(fullname, index, lut)
+
+
+class PngExporter:
+    # .png previews of the saved frames, rendered from the arrays in a thread
+    # pool instead of exporting the ImageViews on the GUI thread. In "live" mode
+    # submit() hands the frame to the pool (the frame must not be changed
+    # afterwards, the FrameProcessor buffers are not reused while it is held);
+    # at most max_pending frames wait, then submit() waits for the oldest.
+    # In "deferred" mode submit() only notes the point and finish() renders all
+    # of them from the closed scan file (scan_reader), so the scan does not
+    # spend anything on them. Failed files are counted, not raised: a preview
+    # must not stop a scan.
+    def __init__(self, mode="live", workers=2, colormap=None, max_pending=16, timer=None):
+        if mode not in PNG_MODES:
+            raise ValueError(f"png mode must be one of {PNG_MODES}")
+        self.mode = mode
+        self.workers = workers
+        self.lut = make_lut(colormap)
+        self.max_pending = max_pending
+        self.timer = timer  # step_timing.StepTimer, the renders are its "write.png" spans
+        self.pool = None
+        self.pending = deque()
+        self.deferred = []  # ((pwr_index, delay_index, kind), fullname)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.errors = []
+
+    def render(self, frame, fullname, release=None):
+        span = self.timer.span("write.png") if self.timer is not None else contextlib.nullcontext()
+        try:
+            with span:
+                render_png(frame, fullname, self.lut)
+        except Exception as error:
+            with self.lock:
+                self.errors.append(f"{fullname}: {error}")
+            return
+        finally:
+            if release is not None:
+                release()
+        with self.lock:
+            self.written += 1
+
+    def _submit(self, frame, fullname, release=None):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="PngExporter")
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.pool.submit(self.render, frame, fullname, release))
+
+    def submit(self, frame, fullname, point=None, release=None):
+        # point: (pwr_index, delay_index, kind) of the frame in the scan file, needed for "deferred";
+        # frames without it are always rendered right away. release() is called once the frame
+        # is no longer needed (rendered, or right away when it is not rendered now)
+        if self.mode == "off" or (self.mode == "deferred" and point is not None):
+            if self.mode == "deferred":
+                self.deferred.append((point, fullname))
+            if release is not None:
+                release()
+            return
+        self._submit(frame, fullname, release)
+
+    def finish(self, scan_fullname=None):
+        # waits for the live renders, then renders the deferred points from scan_fullname
+        if self.deferred and scan_fullname is not None:
+            import scan_reader
+            with scan_reader.ScanFile(scan_fullname) as scan:
+                for (pwr_index, delay_index, kind), fullname in self.deferred:
+                    self._submit(scan.frames[pwr_index, delay_index, kind], fullname)
+                while self.pending:
+                    self.pending.popleft().result()
+            self.deferred = []
+        while self.pending:
+            self.pending.popleft().result()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def summary(self):
+        return {"mode": self.mode, "written": self.written, "errors": len(self.errors)}
+
+
+if __name__ == "__main__":
+    import time
+    exporter = PngExporter()
+    frames = [np.random.randint(0, 4096, (1024, 1024), dtype=np.uint16) for _ in range(16)]
+    start = time.perf_counter()
+    for number, frame in enumerate(frames):
+        exporter.submit(frame, f"test_png_{number}.png")
+    submitted = time.perf_counter() - start
+    exporter.finish()
+    print(f"16 frames 1024x1024: submitted in {submitted * 1e3:.1f} ms, "
+          f"written in {(time.perf_counter() - start) * 1e3:.0f} ms, {exporter.summary()}")
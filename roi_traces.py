@@ -0,0 +1,67 @@
+import threading
+import numpy as np
+
+
+class RoiTraces:
+    # Mean and std of rectangular ROIs versus (power, delay), filled in point by
+    # point while the scan runs. update() only reads the ROI pixels of the new
+    # frames, past points are never recomputed. ROIs can be added or moved
+    # from the GUI thread at any time; points taken before keep their values
+    # (NaN if the ROI did not exist yet).
+    def __init__(self, powers, delays):
+        self.powers = np.atleast_1d(powers)
+        self.delays = np.atleast_1d(delays)
+        self.lock = threading.Lock()
+        self.rois = {}  # name -> {"kind": "diff" or "diffNorm", "rows": (start, stop), "columns": (start, stop)}
+        self.mean = {}  # name -> (power, delay) array
+        self.std = {}
+        self.version = 0  # incremented on every update, for the plots
+        self.last_power_index = 0
+
+    def set_roi(self, name, kind, rows, columns):
+        with self.lock:
+            self.rois[name] = {"kind": kind, "rows": tuple(rows), "columns": tuple(columns)}
+            if name not in self.mean:
+                shape = (len(self.powers), len(self.delays))
+                self.mean[name] = np.full(shape, np.nan)
+                self.std[name] = np.full(shape, np.nan)
+
+    def remove_roi(self, name):
+        with self.lock:
+            for table in (self.rois, self.mean, self.std):
+                table.pop(name, None)
+
+    def add_delays(self, delays):
+        # new delays of an adaptive scan, appended unsorted as in the scan file
+        with self.lock:
+            self.delays = np.concatenate([self.delays, delays])
+            for table in (self.mean, self.std):
+                for name, trace in table.items():
+                    table[name] = np.pad(trace, ((0, 0), (0, len(delays))), constant_values=np.nan)
+
+    def update(self, pwr_index, delay_index, frames):
+        with self.lock:
+            for name, roi in self.rois.items():
+                region = frames[roi["kind"]][roi["rows"][0]:roi["rows"][1], roi["columns"][0]:roi["columns"][1]]
+                if region.size:
+                    self.mean[name][pwr_index, delay_index] = region.mean()
+                    self.std[name][pwr_index, delay_index] = region.std()
+            self.last_power_index = pwr_index
+            self.version += 1
+
+    def snapshot(self):
+        # copies for plotting or saving: (rois, mean, std)
+        with self.lock:
+            return ({name: dict(roi) for name, roi in self.rois.items()},
+                    {name: trace.copy() for name, trace in self.mean.items()},
+                    {name: trace.copy() for name, trace in self.std.items()})
+
+
+if __name__ == "__main__":
+    traces = RoiTraces(powers=[8, 10], delays=np.arange(0, 20, 5))
+    traces.set_roi("roi1_diff", "diff", (10, 20), (10, 30))
+    for d in range(4):
+        frame = np.full((64, 64), d, dtype=np.float32)
+        traces.update(0, d, {"diff": frame})
+    rois, mean, std = traces.snapshot()
+    print(rois, mean["roi1_diff"])
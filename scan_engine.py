@@ -0,0 +1,554 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import adaptive_delays
+from frame_processing import FrameProcessor
+from frame_stats import RunningStats, ScalarStats
+import png_export
+import scan_journal
+import scan_planner
+import scan_writer
+from shutter import Shutter
+from step_timing import StepTimer
+import write_queue
+
+# text format of the legacy .dat export per image kind
+DAT_FORMATS = {"ref": "%d", "pumped": "%d", "diff": "%d", "diffNorm": "%.5f"}
+
+
+class ScanStopped(Exception):
+    # raised inside moves and exposures when Stop was pressed
+    pass
+
+
+def write_dat(image, fullname, format='%d'):
+    # legacy text export, runs in the write queue thread
+    with open(fullname, "w") as file:
+        np.savetxt(file, image, fmt=format)
+
+
+def save_point(writer, journal, pwr_index, delay_index, frames, stderr=None, shots=1, refine_pass=0, signal=np.nan,
+               lockin=None):
+    # runs in the write queue thread; the point goes into the journal only once it is in the scan file.
+    # lockin: function returning the lock-in stats of the point's exposures (waits for the samples)
+    writer.write_step(pwr_index, delay_index, frames, stderr=stderr, shots=shots)
+    writer.append_order(pwr_index, delay_index, refine_pass, signal)
+    if lockin is not None:
+        writer.write_lockin(pwr_index, delay_index, lockin())
+    journal.mark_done(pwr_index, delay_index)
+
+
+def add_delays(writer, journal, delays):
+    # runs in the write queue thread; the scan file first, a resumed scan brings the journal up to it
+    writer.add_delays(delays)
+    journal.add_delays(delays)
+
+
+class ScanEngine:
+    # The measurement loop without any GUI code. It runs in a worker thread and
+    # reports through the on_progress / on_frames / on_status callbacks. Stop is
+    # cooperative: stop() sets an event which is checked while the stages move
+    # and while the camera exposes.
+    # In pipelined mode the stages are sent to the next point as soon as the
+    # pumped frame is read out, and the current step is processed, shown and
+    # queued for saving while they travel.
+    # With shots > 1 every point is the mean of up to `shots` ref/pumped pairs,
+    # saved with its per-pixel standard error. With snr_target the point ends
+    # early once the ROI mean of the difference image reaches that SNR.
+    # burst > 0 takes the shots as camera sequences of up to `burst` refs (shutter
+    # closed) followed by as many pumped frames (shutter open).
+    # dtype is the policy for the derived images and the scan file ("float32" or "float64").
+    # adaptive_budget > 0 makes the delays of each power adaptive: the delays
+    # given to run() are a coarse pass, then up to adaptive_batch delays at a
+    # time are added where the ROI mean of the difference image changes most,
+    # until the power has adaptive_budget points or no interval changes by
+    # more than adaptive_tolerance (fraction of the signal range).
+    # order is the point order of the scan plan, see scan_planner.ScanPlan.
+    # timer collects timing spans of the parts of every step (moves, shutter,
+    # snaps, processing, file writes); run() appends them per step to
+    # <filename>.timing.<timing_log> ("jsonl" or "csv", None = no log).
+    # profile_next_step=True runs the next step of the loop under cProfile.
+    # The shutter state is cached (see shutter.Shutter); shutter_confirm waits
+    # for *OPC? after each write and shutter_settle (s) for the blade to move.
+    # lockin_logger (a lockin_logger.LockinLogger) records the lock-in signal
+    # during the scan; the loop only notes the time windows of the exposures,
+    # their stats are saved with the frames by the write queue.
+    # png is the mode of the .png previews next to the .dat names (png_export.PNG_MODES):
+    # rendered from the frames in a thread pool during the scan, from the scan file
+    # after the scan ("deferred"), or "off".
+    def __init__(self, camera, lia, delay_line, pump_pwr, shutter_aux, pipelined=False,
+                 shots=1, snr_target=None, burst=0, dtype="float32", adaptive_budget=0,
+                 adaptive_tolerance=0.05, adaptive_batch=4, adaptive_min_step=None, order="raster",
+                 timing_log="jsonl", shutter_confirm=False, shutter_settle=0.0, lockin_logger=None,
+                 png="off"):
+        self.camera = camera
+        self.lia = lia
+        self.delay_line = delay_line
+        self.pump_pwr = pump_pwr
+        self.shutter_aux = shutter_aux
+        self.shutter = Shutter(lia, shutter_aux, confirm=shutter_confirm, settle_time=shutter_settle)
+        self.lockin_logger = lockin_logger
+        self.windows = []  # (shutter open, start, end) of the exposures of the current point
+        self.png = png
+        self.png_exporter = None  # PngExporter of the last run
+        self.pipelined = pipelined
+        self.shots = shots
+        self.snr_target = snr_target
+        self.snr_roi = None  # (row slice, column slice); None = central half of the frame
+        self.min_shots = 3  # before the SNR of the ROI mean is trusted
+        self.burst = burst
+        self.dtype = dtype
+        self.adaptive_budget = adaptive_budget
+        self.adaptive_tolerance = adaptive_tolerance
+        self.adaptive_batch = adaptive_batch
+        self.adaptive_min_step = adaptive_min_step  # None = 1/16 of the smallest coarse step
+        self.signals = {}  # pwr_index -> {delay_index: ROI signal} of the adaptive scan
+        self.order = order
+        self.plan = None  # ScanPlan of the last run
+        self.processor = FrameProcessor(dtype)
+        self.stats = {}  # RunningStats per kind, reused while the frame shape stays the same
+        self.timelines = []  # per-step durations (s) of the last run
+        self.timer = StepTimer()
+        self.timing_log = timing_log
+        self.profile_next_step = False
+        self.stop_event = threading.Event()
+        self.on_progress = lambda counter, all_steps: None
+        self.on_frames = lambda step: None
+        self.on_status = lambda source, message: None  # "delay", "power", "xps", "shots", "camera", "plan", "timing"
+        self.on_timeline = lambda timeline: None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def move(self, stage, position):
+        # the position tolerance and settle time are set per stage
+        recoveries = stage.recovery_count
+        current = stage.move_and_wait(position, stop_event=self.stop_event)
+        if stage.recovery_count != recoveries:
+            self.on_status("xps", f"XPS {stage.group} recovered ({stage.recovery_count} recoveries, "
+                                  f"{stage.rehome_count} re-homings)")
+        if current is None:
+            raise ScanStopped()
+        return current
+
+    def delay_move(self, position):
+        self.on_status("delay", "Delay line is moving")
+        current = self.move(self.delay_line, position)
+        self.on_status("delay", f"Current delay pos: {current}mm")
+
+    def PWR_move(self, position):
+        self.on_status("power", "PWR is moving")
+        current = self.move(self.pump_pwr, position)
+        self.on_status("power", f"Current PWR: {current}deg")
+
+    def move_to_point(self, pwr_position, delay_position, move_power=True):
+        start = time.perf_counter()
+        if move_power:
+            with self.timer.span("move.power"):
+                self.PWR_move(pwr_position)
+        with self.timer.span("move.delay"):
+            self.delay_move(delay_position)
+        return time.perf_counter() - start
+
+    def snap(self):
+        image = self.camera.getImage(self.stop_event)
+        if image is None:
+            raise ScanStopped()
+        return image
+
+    def take_images(self):
+        return self.process(*self.acquire())
+
+    def set_shutter(self, is_open):
+        with self.timer.span("shutter"):
+            self.shutter.set(is_open)
+
+    def exposure(self, is_open, take, *args):
+        # take(*args), a snap or a sequence, with its time window for the lock-in logger
+        start = time.perf_counter()
+        result = take(*args)
+        self.windows.append((is_open, start, time.perf_counter()))
+        return result
+
+    def acquire(self):
+        try:
+            self.set_shutter(False)
+            with self.timer.span("snap.ref"):
+                reference_img = self.exposure(False, self.snap)
+            self.set_shutter(True)
+            with self.timer.span("snap.pumped"):
+                pumped_img = self.exposure(True, self.snap)
+        finally:
+            self.set_shutter(False)  # close shutter, also when stopped during the exposure
+        return reference_img, pumped_img
+
+    def acquire_averaged(self):
+        # up to self.shots pairs accumulated per kind; returns (shots taken, ROI SNR)
+        roi_stats = ScalarStats()
+        pairs = self.burst_pairs() if self.burst > 0 else (self.acquire() for _ in range(self.shots))
+        for shot, pair in enumerate(pairs):
+            frames = self.process(*pair)
+            with self.timer.span("accumulate"):
+                if shot == 0:
+                    shape = frames["ref"].shape
+                    if not self.stats or self.stats["ref"].shape != shape:
+                        self.stats = {kind: RunningStats(shape, self.dtype) for kind in frames}
+                    for stats in self.stats.values():
+                        stats.reset()
+                for kind, frame in frames.items():
+                    self.stats[kind].add(frame)
+                roi_stats.add(frames["diff"][self.roi(frames["diff"].shape)].mean())
+            if self.snr_target and roi_stats.count >= self.min_shots and roi_stats.snr() >= self.snr_target:
+                break
+        pairs.close()
+        return roi_stats.count, roi_stats.snr()
+
+    def burst_sequence(self, num_images):
+        frames = [frame for frame, metadata in self.camera.sequence(num_images, self.stop_event)]
+        if self.stop_event.is_set():
+            raise ScanStopped()
+        if self.camera.dropped:
+            self.on_status("camera", f"{self.camera.dropped} frames dropped")
+        return frames
+
+    def burst_pairs(self):
+        # (ref, pumped) pairs from blocks of sequence acquisitions, only one block
+        # of refs is kept in memory
+        remaining = self.shots
+        try:
+            while remaining > 0:
+                block = min(self.burst, remaining)
+                self.set_shutter(False)
+                with self.timer.span("sequence.ref"):
+                    refs = self.exposure(False, self.burst_sequence, block)
+                self.set_shutter(True)
+                with self.timer.span("sequence.pumped"):
+                    pumped = self.exposure(True, self.burst_sequence, block)
+                self.set_shutter(False)
+                # frames of one shutter state are equivalent, dropped frames just shorten the block
+                for pair in zip(refs, pumped):
+                    yield pair
+                remaining -= block
+        finally:
+            self.set_shutter(False)  # close shutter, also when stopped or ended early by the SNR
+
+    def roi(self, shape):
+        if self.snr_roi is not None:
+            return self.snr_roi
+        num_rows, num_columns = shape
+        return slice(num_rows//4, num_rows*3//4), slice(num_columns//4, num_columns*3//4)
+
+    def averaged_frames(self):
+        # copies, the stats buffers are reused for the next point
+        frames = {kind: stats.mean.copy() for kind, stats in self.stats.items()}
+        stderr = {kind: stats.stderr() for kind, stats in self.stats.items()}
+        return frames, stderr
+
+    def process(self, reference_img, pumped_img):
+        # diff and diffNorm go into reused buffers of the processor, see held()
+        with self.timer.span("process"):
+            return self.processor.process(reference_img, pumped_img)
+
+    def held(self, frames, function):
+        # function which keeps the processor buffers of frames until it has run (a job of the write queue)
+        release = self.processor.hold(frames)
+
+        def run(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            finally:
+                release()
+        return run
+
+    def test(self, delay_position, pwr_position):
+        # one step at the given positions, nothing is saved
+        self.stop_event.clear()
+        self.shutter.invalidate()
+        try:
+            self.delay_move(delay_position)
+            self.PWR_move(pwr_position)
+            self.on_frames({"frames": self.take_images(), "counter": 0})
+        except ScanStopped:
+            pass
+
+    def timed(self, name, function, *args, **kwargs):
+        # function(*args, **kwargs) as a timing span; for the jobs of the write queue
+        with self.timer.span(name):
+            return function(*args, **kwargs)
+
+    def save_profile(self, profiler, fullname, counter):
+        # <fullname>.prof for snakeviz / pstats, and the top of it as text
+        profiler.dump_stats(fullname + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(25)
+        with open(fullname + ".txt", "w") as file:
+            file.write(text.getvalue())
+        self.on_status("timing", f"Profile of step {counter}: {fullname}.prof")
+
+    def open_scan(self, fullname, powers, delays, kinds, settings, resume):
+        # returns (writer, journal); a resumed scan takes grid and kinds from the file
+        journal_fullname = scan_journal.journal_name(fullname)
+        if not resume:
+            writer = scan_writer.ScanWriter(fullname, powers, delays, kinds=kinds, settings=settings, dtype=self.dtype)
+            if self.adaptive_budget > 0:
+                writer.set_metadata("adaptive", {"coarse": len(delays), "budget": self.adaptive_budget,
+                                                 "tolerance": self.adaptive_tolerance, "batch": self.adaptive_batch})
+            return writer, scan_journal.ScanJournal.create(journal_fullname, powers, delays, kinds)
+        writer = scan_writer.ScanWriter.resume(fullname)
+        if os.path.exists(journal_fullname):
+            journal = scan_journal.ScanJournal.open(journal_fullname)
+            journal.match_delays(writer.delays)
+        else:
+            # scan file without journal: rebuild it from the "done" flags of the file
+            journal = scan_journal.ScanJournal.create(journal_fullname, writer.powers, writer.delays, writer.kinds)
+            for pwr_index, delay_index in zip(*np.nonzero(writer.done[()])):
+                journal.mark_done(pwr_index, delay_index)
+        writer.set_metadata("resumed", writer.get_metadata("resumed", []) + [time.strftime("%Y-%m-%d %H:%M:%S")])
+        return writer, journal
+
+    def motion_model(self, stage):
+        # MotionModel from the stage's velocity and acceleration, None (estimate in units) if
+        # the controller does not report them
+        try:
+            velocity, acceleration = stage.motion_parameters()
+        except RuntimeError:
+            return None
+        return scan_planner.MotionModel(velocity, acceleration, overhead=stage.settle_time)
+
+    def refinement(self, pwr_index, delays, min_step):
+        # next delays of the adaptive scan at this power as (delay_index, delay_position),
+        # delays added for other powers are reused; returns (points, new delays for the axis)
+        signals = self.signals.setdefault(pwr_index, {})
+        count = min(self.adaptive_batch, self.adaptive_budget - len(signals))
+        measured = list(signals)
+        refined = adaptive_delays.refine_delays(delays[measured], [signals[i] for i in measured], count,
+                                                self.adaptive_tolerance, min_step)
+        points, added = [], []
+        for delay in refined:
+            free = [i for i in np.flatnonzero(np.isclose(delays, delay)) if i not in signals]
+            if free:
+                points.append((free[0], delays[free[0]]))
+            else:
+                points.append((len(delays) + len(added), delay))
+                added.append(delay)
+        return points, np.array(added)
+
+    def run(self, powers, delays, folder, filename, kinds, settings=None, legacy_dat=False, roi_traces=None,
+            resume=False):
+        # roi_traces: RoiTraces updated with every point and saved with the scan.
+        # resume=True continues folder/filename.h5: points listed in its journal are skipped,
+        # powers, delays and kinds are those of the file.
+        self.stop_event.clear()
+        self.shutter.invalidate()  # written anew at the first step, it may have been set by hand
+        writer, journal = self.open_scan(os.path.join(folder, filename + ".h5"), np.atleast_1d(powers),
+                                         np.atleast_1d(delays), kinds, settings, resume)
+        powers, delays, kinds = writer.powers, writer.delays, writer.kinds
+        # per-kind folders of the .dat export and the .png previews
+        kind_folders = {kind: os.path.join(folder, f"{kind}_{filename}") for kind in kinds}
+        if legacy_dat or self.png != "off":
+            # created only when something is written into them
+            for kind_folder in kind_folders.values():
+                os.makedirs(kind_folder, exist_ok=True)
+        # files are written in the background, the loop only waits when the queue is full
+        queue_size = 8
+        queue = write_queue.WriteQueue(maxsize=queue_size)
+        self.png_exporter = png_export.PngExporter(self.png, timer=self.timer)
+        # a buffer set for every step which may wait in the queue (and its running job) or for
+        # a .png, and one for the current step; more would only wait for those anyway
+        self.processor.max_sets = queue_size + 1 + self.png_exporter.max_pending + 1
+        if self.lockin_logger is not None:
+            self.lockin_logger.start()
+        self.timer.reset()
+        if self.timing_log:
+            self.timer.open_log(os.path.join(folder, f"{filename}.timing.{self.timing_log}"),
+                                fields=("step", "power_index", "delay_index"))
+        adaptive = writer.get_metadata("adaptive") if self.adaptive_budget > 0 else None
+        # the delays of the first pass; an adaptive scan appends the refined ones to the axis
+        coarse = adaptive["coarse"] if adaptive else len(delays)
+        min_step = self.adaptive_min_step
+        if min_step is None:
+            steps = np.diff(np.unique(delays[:coarse]))
+            min_step = steps.min() / 16 if len(steps) else 0.0
+        self.signals = {}
+        passes = {}  # pwr_index -> last refinement pass
+        for row in writer.read_order():
+            if not np.isnan(row["signal"]):
+                self.signals.setdefault(int(row["power_index"]), {})[int(row["delay_index"])] = row["signal"]
+            passes[int(row["power_index"])] = max(passes.get(int(row["power_index"]), 0), int(row["pass"]))
+
+        def refine(pwr_index, pwr_position):
+            # the next adaptive points of this power, [] once its budget or tolerance is reached
+            nonlocal delays
+            with self.timer.span("refine"):
+                new_points, added = self.refinement(pwr_index, delays, min_step)
+            if len(added):
+                delays = np.concatenate([delays, added])
+                queue.put(self.timed, "write.scan", add_delays, writer, journal, added)
+                if roi_traces is not None:
+                    roi_traces.add_delays(added)
+            passes[pwr_index] = passes.get(pwr_index, 0) + 1
+            if self.order != "raster" and new_points:
+                # sorted by delay; start from the end nearer to the delay line
+                position = self.delay_line.position
+                if abs(new_points[-1][1] - position) < abs(new_points[0][1] - position):
+                    new_points.reverse()
+            return [(pwr_index, pwr_position, delay_index, delay_position, passes[pwr_index])
+                    for delay_index, delay_position in new_points]
+
+        self.plan = scan_planner.ScanPlan(powers, delays[:coarse], self.order, skip=journal.is_done,
+                                          start=(self.pump_pwr.position, self.delay_line.position),
+                                          power_motion=self.motion_model(self.pump_pwr),
+                                          delay_motion=self.motion_model(self.delay_line))
+        summary = self.plan.summary()
+        writer.set_metadata("plan", summary)
+        if self.plan.power_motion and self.plan.delay_motion:
+            moves = f"estimated moves {summary['total'] / 60:.1f} min"
+        else:
+            moves = f"stage travel {summary['total']:.1f}"
+        self.on_status("plan", f"{summary['points']} points ({self.order}), {moves}")
+        # (pwr_index, pwr_position, delay_index, delay_position, refinement pass)
+        points = [(pwr_index, powers[pwr_index], delay_index, delays[delay_index], 0)
+                  for pwr_index, delay_index in self.plan.points]
+        if adaptive:
+            planned = {pwr_index for pwr_index, _ in self.plan.points}
+            for pwr_index, pwr_position in enumerate(powers):
+                if pwr_index not in planned:
+                    # first pass of this power done before the scan was resumed
+                    points.extend(refine(pwr_index, pwr_position))
+        done_steps = len(journal.completed)
+        mover = ThreadPoolExecutor(max_workers=1) if self.pipelined else None
+        pending_move = None
+        profiler = None
+        self.timelines = []
+        index = 0
+        try:
+            while index < len(points):
+                pwr_index, pwr_position, delay_index, delay_position, refine_pass = points[index]
+                counter = done_steps + index + 1
+                all_steps = done_steps + len(points)  # grows while an adaptive scan adds points
+                last_of_power = index + 1 == len(points) or points[index + 1][0] != pwr_index
+                timeline = {}
+                if self.profile_next_step:
+                    # cProfile sees this thread only: pipelined moves and the file writes are not in it
+                    self.profile_next_step = False
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                self.timer.begin_step()
+                start = time.perf_counter()
+                if pending_move is None:
+                    # the power is only moved when it changes (a resumed scan may start anywhere)
+                    move_power = index == 0 or points[index - 1][0] != pwr_index
+                    timeline["move"] = self.move_to_point(pwr_position, delay_position, move_power=move_power)
+                else:
+                    with self.timer.span("move.pending"):
+                        timeline["move"] = pending_move.result()
+                    pending_move = None
+                # time the loop really waited for the stages
+                timeline["move_wait"] = time.perf_counter() - start
+                timeline["delay_travel"] = self.delay_line.last_move_time
+                timeline["delay_settle"] = self.delay_line.last_settle_time
+                mark = time.perf_counter()
+                self.windows = []
+                if self.shots > 1:
+                    shots, snr = self.acquire_averaged()
+                    self.on_status("shots", f"{shots} shots, ROI SNR {snr:.1f}")
+                else:
+                    reference_img, pumped_img = self.acquire()
+                timeline["acquire"], mark = time.perf_counter() - mark, time.perf_counter()
+                # an adaptive scan knows the point after the last one of a power only after refining
+                if mover is not None and index + 1 < len(points) and not (adaptive and last_of_power):
+                    next_pwr_index, next_pwr, _, next_delay, _ = points[index + 1]
+                    pending_move = mover.submit(self.move_to_point, next_pwr, next_delay,
+                                                move_power=next_pwr_index != pwr_index)
+                if self.shots > 1:
+                    frames, stderr = self.averaged_frames()
+                else:
+                    frames, stderr, shots = self.process(reference_img, pumped_img), None, 1
+                if roi_traces is not None:
+                    with self.timer.span("roi_traces"):
+                        roi_traces.update(pwr_index, delay_index, frames)
+                signal = np.nan
+                if adaptive:
+                    signal = float(frames["diff"][self.roi(frames["diff"].shape)].mean())
+                    self.signals.setdefault(pwr_index, {})[delay_index] = signal
+                timeline["process"], mark = time.perf_counter() - mark, time.perf_counter()
+                lockin = None
+                if self.lockin_logger is not None:
+                    lockin = functools.partial(self.lockin_logger.stats, self.windows)
+                queue.put(self.held(frames, self.timed), "write.scan", save_point, writer, journal, pwr_index,
+                          delay_index, frames, stderr=stderr, shots=shots, refine_pass=refine_pass, signal=signal,
+                          lockin=lockin)
+                delay_pwr = f"pwr_{pwr_position}_delay_{delay_position}"
+                names = {kind: os.path.join(kind_folders[kind], f"{delay_pwr}.dat") for kind in kinds}
+                if legacy_dat:
+                    for kind in kinds:
+                        fmt = DAT_FORMATS[kind] if self.shots == 1 else "%.5f"  # means are not integers
+                        queue.put(self.held(frames, self.timed), "write.dat", write_dat, frames[kind], names[kind],
+                                  fmt)
+                for kind in kinds:
+                    self.png_exporter.submit(frames[kind], names[kind] + ".png", (pwr_index, delay_index, kind),
+                                             release=self.processor.hold(frames))
+                # save first reference image any case
+                if counter == 1:
+                    fmt = DAT_FORMATS["ref"] if self.shots == 1 else "%.5f"
+                    first_ref = os.path.join(folder, filename) + ".dat"
+                    queue.put(self.timed, "write.dat", write_dat, frames["ref"], first_ref, fmt)
+                    self.png_exporter.submit(frames["ref"], os.path.join(folder, filename) + ".png")
+                if adaptive and last_of_power:
+                    points[index + 1:index + 1] = refine(pwr_index, pwr_position)
+                    all_steps = done_steps + len(points)
+                timeline["save"], mark = time.perf_counter() - mark, time.perf_counter()
+                # previews only: the views are not holds, they may already show the next step's buffers
+                self.on_frames({"frames": frames, "counter": counter})
+                self.on_progress(counter, all_steps)
+                timeline["report"] = time.perf_counter() - mark
+                timeline["step"] = time.perf_counter() - start
+                self.timer.end_step(step=counter, power_index=int(pwr_index), delay_index=int(delay_index),
+                                    phases=timeline)
+                if profiler is not None:
+                    profiler.disable()
+                    self.save_profile(profiler, os.path.join(folder, f"{filename}.step{counter}"), counter)
+                    profiler = None
+                self.timelines.append(timeline)
+                self.on_timeline(timeline)
+                index += 1
+        except ScanStopped:
+            pass
+        finally:
+            if profiler is not None:
+                profiler.disable()  # stopped during the profiled step
+            if mover is not None:
+                # a pending move finishes or ends on the stop event
+                mover.shutdown(wait=True)
+            # flush the queue (after Stop or at the end of the scan) and close the scan file
+            try:
+                queue.close()
+            finally:
+                if self.lockin_logger is not None:
+                    self.lockin_logger.stop()
+                    writer.set_metadata("lockin_log", {"rate": self.lockin_logger.rate,
+                                                       "restarts": self.lockin_logger.restarts})
+                writer.set_metadata("timeline", writer.get_metadata("timeline", []) + self.timelines)
+                writer.set_metadata("shutter", {"writes": self.shutter.writes, "skipped": self.shutter.skipped,
+                                                "confirm": self.shutter.confirm,
+                                                "settle_time": self.shutter.settle_time})
+                if roi_traces is not None:
+                    writer.write_roi_traces(*roi_traces.snapshot())
+                writer.close()
+                # deferred previews are rendered now, from the closed scan file
+                try:
+                    self.png_exporter.finish(writer.fullname)
+                finally:
+                    self.timer.close_log()
+
+    def timeline_summary(self):
+        # serial = what the steps would take without overlap, wall = what they took
+        serial = sum(t["move"] + t["acquire"] + t["process"] + t["save"] + t["report"] for t in self.timelines)
+        wall = sum(t["step"] for t in self.timelines)
+        return {"steps": len(self.timelines), "serial": serial, "wall": wall, "saved": serial - wall}
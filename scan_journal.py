@@ -0,0 +1,92 @@
+import json
+import os
+import time
+import numpy as np
+
+
+def journal_name(scan_fullname):
+    # folder/filename.h5 -> folder/filename.journal.jsonl
+    return os.path.splitext(scan_fullname)[0] + ".journal.jsonl"
+
+
+class ScanJournal:
+    # Append-only JSON lines file next to the scan file. The first line holds
+    # the (power, delay) grid, then one line per point once it is written to
+    # the scan file. A resumed scan reads it back into the `completed` index
+    # and acquires only the missing points. Delays added during the scan
+    # (adaptive sampling) get their own line.
+    def __init__(self, fullname, powers, delays, completed=(), entries=None, header=None):
+        self.fullname = fullname
+        self.powers = np.atleast_1d(np.asarray(powers, dtype=float))
+        self.delays = np.atleast_1d(np.asarray(delays, dtype=float))
+        self.completed = set(completed)  # {(pwr_index, delay_index)}
+        self.entries = dict(entries or {})  # (pwr_index, delay_index) -> journal line of the point
+        self.header = header or {}
+
+    @classmethod
+    def create(cls, fullname, powers, delays, kinds=(), **extra):
+        # extra: more JSON-serializable fields of the header
+        journal = cls(fullname, powers, delays)
+        journal.header = dict({"powers": journal.powers.tolist(), "delays": journal.delays.tolist(),
+                               "kinds": list(kinds), "created": time.strftime("%Y-%m-%d %H:%M:%S")}, **extra)
+        with open(fullname, "w") as file:
+            file.write(json.dumps(journal.header) + "\n")
+        return journal
+
+    @classmethod
+    def open(cls, fullname):
+        with open(fullname) as file:
+            lines = file.read().splitlines()
+        header = json.loads(lines[0])
+        delays = list(header["delays"])
+        entries = {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # last line cut by a crash
+                continue
+            if "add_delays" in entry:
+                delays.extend(entry["add_delays"])
+            else:
+                entries[(entry["power_index"], entry["delay_index"])] = entry
+        return cls(fullname, header["powers"], delays, entries, entries, header)
+
+    def is_done(self, pwr_index, delay_index):
+        return (pwr_index, delay_index) in self.completed
+
+    def append(self, entry):
+        with open(self.fullname, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def add_delays(self, delays):
+        self.append({"add_delays": [float(delay) for delay in delays]})
+        self.delays = np.concatenate([self.delays, np.asarray(delays, dtype=float)])
+
+    def match_delays(self, delays):
+        # the delay axis of the scan file is the reference: delays the file got before a crash
+        # are added, a journal which disagrees otherwise is written anew with its points on that axis
+        delays = np.asarray(delays, dtype=float)
+        count = len(self.delays)
+        if count <= len(delays) and np.array_equal(self.delays, delays[:count]):
+            if count < len(delays):
+                self.add_delays(delays[count:])
+            return
+        self.delays = delays
+        self.header["delays"] = delays.tolist()
+        self.entries = {key: entry for key, entry in self.entries.items() if key[1] < len(delays)}
+        self.completed = set(self.entries)
+        with open(self.fullname + ".tmp", "w") as file:
+            for entry in [self.header] + list(self.entries.values()):
+                file.write(json.dumps(entry) + "\n")
+        os.replace(self.fullname + ".tmp", self.fullname)
+
+    def mark_done(self, pwr_index, delay_index, **extra):
+        # extra: more JSON-serializable fields of the point, kept in self.entries
+        entry = dict({"power_index": int(pwr_index), "delay_index": int(delay_index),
+                      "power": float(self.powers[pwr_index]), "delay": float(self.delays[delay_index]),
+                      "time": time.strftime("%Y-%m-%d %H:%M:%S")}, **extra)
+        self.append(entry)
+        self.completed.add((pwr_index, delay_index))
+        self.entries[(int(pwr_index), int(delay_index))] = entry
@@ -0,0 +1,145 @@
+import re
+import numpy as np
+
+# point orders of a scan plan
+ORDERS = ("raster", "serpentine", "travel")
+
+
+def parse_sequence(text):
+    # "start:step:stop" segments and single values separated by ";" or ",",
+    # e.g. "-5:0.5:5; 10:5:100; 200". The stop value is included.
+    values = []
+    for segment in re.split(r"[;,]", text):
+        numbers = list(map(float, re.findall(r"[-+]?\d*\.\d+|[-+]?\d+", segment)))
+        if not numbers:
+            continue
+        if len(numbers) == 1:
+            values.append(numbers)
+        elif len(numbers) == 3:
+            start, step, stop = numbers
+            values.append(axis(start, stop, step))
+        else:
+            raise ValueError(f"'{segment.strip()}' is neither a value nor start:step:stop")
+    return np.unique(np.concatenate(values)) if values else np.array([])
+
+
+def axis(start, stop, step, sequence=None):
+    # start..stop (included) in steps of |step|, as the fields of the main window;
+    # merged with the values of `sequence` (text, see parse_sequence), sorted, without doubles
+    step = abs(step) * np.sign(stop - start)
+    if start == stop or step == 0:
+        values = np.array([float(start)])
+    else:
+        # half a step of margin so that stop is included despite rounding
+        values = np.arange(start, stop + step / 2, step)
+    if sequence:
+        values = np.unique(np.concatenate([parse_sequence(sequence), values]))
+    return values
+
+
+class MotionModel:
+    # Duration of a point-to-point move with a trapezoidal velocity profile
+    # (velocity in units/s, acceleration in units/s^2), plus a fixed overhead
+    # per move for settling and communication.
+    def __init__(self, velocity, acceleration, overhead=0.0):
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.overhead = overhead
+
+    def time(self, distance):
+        distance = np.abs(np.asarray(distance, dtype=float))
+        v, a = self.velocity, self.acceleration
+        ramp = v * v / a  # distance needed to reach full speed and stop again
+        duration = np.where(distance >= ramp, distance / v + v / a, 2 * np.sqrt(distance / a))
+        return np.where(distance > 0, duration + self.overhead, 0.0)
+
+
+class ScanPlan:
+    # The (power, delay) points of a scan in the order they are taken, as
+    # (pwr_index, delay_index). Each power is one block of points, the power
+    # stage is the slow one and moves once per power.
+    #   raster: every power from the first to the last delay (the old loop)
+    #   serpentine: the delay direction alternates from power to power
+    #   travel: from the current stage positions, powers and then the delays of
+    #           each power are swept starting at the nearer end
+    # skip(pwr_index, delay_index) -> True leaves a point out (e.g. already acquired).
+    def __init__(self, powers, delays, order="raster", skip=None, start=(None, None),
+                 power_motion=None, delay_motion=None):
+        if order not in ORDERS:
+            raise ValueError(f"order must be one of {ORDERS}")
+        self.powers = np.atleast_1d(np.asarray(powers, dtype=float))
+        self.delays = np.atleast_1d(np.asarray(delays, dtype=float))
+        self.order = order
+        self.start = start  # (power, delay) stage positions before the scan, None = first point
+        self.power_motion = power_motion
+        self.delay_motion = delay_motion
+        rows = {}
+        for pwr_index in range(len(self.powers)):
+            row = [delay_index for delay_index in range(len(self.delays))
+                   if skip is None or not skip(pwr_index, delay_index)]
+            if row:
+                rows[pwr_index] = row
+        self.points = self.plan(rows)
+
+    def delay_cost(self, distance):
+        return self.delay_motion.time(distance) if self.delay_motion else np.abs(distance)
+
+    def power_cost(self, distance):
+        return self.power_motion.time(distance) if self.power_motion else np.abs(distance)
+
+    @staticmethod
+    def sweep(indices, values, position):
+        # shortest path through points on a line: to the nearer end, then straight to the other
+        indices = sorted(indices, key=lambda index: values[index])
+        if position is not None and abs(values[indices[-1]] - position) < abs(values[indices[0]] - position):
+            indices.reverse()
+        return indices
+
+    def plan(self, rows):
+        points = []
+        if self.order == "raster":
+            for pwr_index, row in rows.items():
+                points += [(pwr_index, delay_index) for delay_index in row]
+        elif self.order == "serpentine":
+            for number, (pwr_index, row) in enumerate(rows.items()):
+                points += [(pwr_index, delay_index) for delay_index in (row[::-1] if number % 2 else row)]
+        else:
+            power, delay = self.start
+            for pwr_index in self.sweep(list(rows), self.powers, power):
+                row = self.sweep(rows[pwr_index], self.delays, delay)
+                points += [(pwr_index, delay_index) for delay_index in row]
+                delay = self.delays[row[-1]]
+        return points
+
+    def move_times(self):
+        # estimated (power, delay) move time per point, s; the engine moves the power
+        # stage only when the power changes, the stages one after the other
+        if not self.points:
+            return np.zeros((0, 2))
+        powers = self.powers[[pwr_index for pwr_index, _ in self.points]]
+        delays = self.delays[[delay_index for _, delay_index in self.points]]
+        power_start, delay_start = self.start
+        powers_from = np.concatenate([[powers[0] if power_start is None else power_start], powers[:-1]])
+        delays_from = np.concatenate([[delays[0] if delay_start is None else delay_start], delays[:-1]])
+        return np.column_stack([self.power_cost(powers - powers_from), self.delay_cost(delays - delays_from)])
+
+    def estimate(self):
+        # total estimated move time, s (stage travel in units when no motion model is given)
+        return float(self.move_times().sum())
+
+    def summary(self):
+        times = self.move_times()
+        return {"order": self.order, "points": len(self.points), "power_moves": float(times[:, 0].sum()),
+                "delay_moves": float(times[:, 1].sum()), "total": float(times.sum())}
+
+
+if __name__ == "__main__":
+    powers = axis(0, 40, 10, "2:2:8")
+    delays = axis(-10, 300, 10, "-2:0.2:2; 5")
+    delay_motion = MotionModel(velocity=20, acceleration=80, overhead=0.05)  # mm
+    power_motion = MotionModel(velocity=10, acceleration=40, overhead=0.2)  # deg
+    for order in ORDERS:
+        plan = ScanPlan(powers, delays, order, start=(0, 0), power_motion=power_motion, delay_motion=delay_motion)
+        summary = plan.summary()
+        print(f"{order:>10}: {summary['points']} points, moves {summary['total']:.0f} s "
+              f"(power {summary['power_moves']:.0f} s, delay {summary['delay_moves']:.0f} s)")
@@ -0,0 +1,330 @@
+import glob
+import json
+import os
+import re
+import h5py
+import numpy as np
+from derived_views import DERIVED, DerivedArray, FrameCache
+from scan_writer import KINDS, ORDER_DTYPE
+
+# Lazy, labeled access to finished scans for post-processing:
+#   scan = open_scan("D:/data/Temp_296K.h5")       scan file of ScanWriter
+#   scan = open_scan("D:/data/Temp_296K")          legacy ref_*/pumped_*/... folders of .dat files
+#   scan.frames[0, :, "diff", 120, 200]            (power, delay, kind, y, x), only these frames are read
+#   delays, trace = scan.trace("diff", 120, 200)   one pixel versus delay, sorted by delay
+#   scan.derived("dRR", dark=100)[0, :, 120, 200]  computed from ref and pumped (derived_views)
+# Frames of an uncompressed scan file are memory mapped: the file offset of
+# every frame (one HDF5 chunk) is read once and cached next to the file as
+# <name>.index.npz, so a pixel trace over thousands of points takes
+# milliseconds. Other layouts are read frame by frame through h5py.
+# Scans saved with raw frames only (ref and pumped) give diff and diffNorm
+# through derived(), and sel() / trace() compute them when they are not stored.
+
+AXES = ("power", "delay", "kind", "y", "x")
+
+
+def index_name(fullname):
+    return os.path.splitext(fullname)[0] + ".index.npz"
+
+
+def _indices(index, size):
+    # (positions along an axis, keeps the axis)
+    if isinstance(index, slice):
+        return np.arange(size)[index], True
+    if np.ndim(index) == 0:
+        position = int(index)
+        if not -size <= position < size:
+            raise IndexError(f"index {position} out of range for an axis of {size}")
+        return np.array([position % size]), False
+    return np.arange(size)[np.asarray(index)], True
+
+
+class ScanArray:
+    # (power, delay, kind, y, x) array view of a frames dataset; indexing reads only
+    # the frames selected by the first three indices. kind can be given by name.
+    # Every axis is indexed on its own (like h5py, unlike numpy's fancy indexing):
+    # lists on two axes select all their combinations.
+    # With offsets (file offset per frame, -1 = not taken) and mapped (the file as
+    # np.memmap of bytes), small cut-outs (pixel traces) are gathered in one go.
+    GATHER_LIMIT = 4096  # pixels per frame up to which the cut-out is gathered
+
+    def __init__(self, shape, dtype, kinds, read_frame, fill=np.nan, offsets=None, mapped=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.kinds = tuple(kinds)
+        self.read_frame = read_frame  # (power, delay, kind) -> 2D view or array, None = not taken
+        self.fill = fill
+        self.offsets = offsets
+        self.mapped = mapped
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def kind_index(self, kind):
+        if isinstance(kind, str):
+            if kind not in self.kinds:
+                raise ValueError(f"{kind} frames are not stored (kinds {self.kinds}), see Scan.derived()")
+            return self.kinds.index(kind)
+        if isinstance(kind, (list, tuple)):
+            return [self.kind_index(item) for item in kind]
+        return kind
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices, the axes are {AXES}")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        power, delay, kind, y, x = key
+        selected = [_indices(index, size) for index, size in
+                    zip((power, delay, self.kind_index(kind), y, x), self.shape)]
+        rows, columns = selected[3][0], selected[4][0]
+        # slices cut frames as views, anything else picks rows and columns
+        cut = (y, x) if isinstance(y, slice) and isinstance(x, slice) else np.ix_(rows, columns)
+        out_shape = tuple(len(positions) for positions, _ in selected)
+        if self.offsets is not None and len(rows) * len(columns) <= self.GATHER_LIMIT:
+            elements = rows[:, None] * self.shape[4] + columns
+            out = self.gather(*(positions for positions, _ in selected[:3]), elements)
+        else:
+            out = np.empty(out_shape, dtype=self.dtype)
+            for i, p in enumerate(selected[0][0]):
+                for j, d in enumerate(selected[1][0]):
+                    for k, kind_index in enumerate(selected[2][0]):
+                        frame = self.read_frame(p, d, kind_index)
+                        out[i, j, k] = self.fill if frame is None else frame[cut]
+        # integer indices drop their axis, like numpy
+        return out.reshape(tuple(len(positions) for positions, keep in selected if keep))
+
+    def gather(self, powers, delays, kinds, elements):
+        # the elements of the selected frames straight from the mapped file
+        offsets = self.offsets[np.ix_(powers, delays, kinds)]
+        itemsize = self.dtype.itemsize
+        positions = (offsets[..., None] + np.ravel(elements) * itemsize)[..., None] + np.arange(itemsize)
+        missing = offsets < 0
+        positions[missing] = 0
+        out = self.mapped[positions].view(self.dtype)[..., 0].reshape(offsets.shape + np.shape(elements))
+        out[missing] = self.fill
+        return out
+
+
+class Scan:
+    # axes, label based selection and traces, common to ScanFile and LegacyScan
+    powers = delays = kinds = frames = None
+    cache = None  # FrameCache of the derived views, shared by all of them
+
+    @property
+    def coords(self):
+        return {"power": self.powers, "delay": self.delays, "kind": self.kinds}
+
+    def delay_order(self):
+        # delay indices sorted by delay (adaptive scans append delays unsorted)
+        return np.argsort(self.delays, kind="stable")
+
+    def derived(self, name, **params):
+        # (power, delay, y, x) frames of a derived kind (derived_views.DERIVED) computed from ref and pumped
+        if self.cache is None:
+            self.cache = FrameCache()
+        return DerivedArray(self.frames, name, self.cache, **params)
+
+    def is_derived(self, kind, dataset="frames"):
+        # kinds which are not stored but can be computed
+        return dataset == "frames" and isinstance(kind, str) and kind not in self.kinds and kind in DERIVED
+
+    def sel(self, power=None, delay=None, kind=slice(None), y=slice(None), x=slice(None), dataset="frames"):
+        # by axis value instead of index: the nearest power / delay (None = all)
+        power_index = slice(None) if power is None else int(np.argmin(abs(self.powers - power)))
+        delay_index = slice(None) if delay is None else int(np.argmin(abs(self.delays - delay)))
+        if self.is_derived(kind, dataset):
+            return self.derived(kind)[power_index, delay_index, y, x]
+        return getattr(self, dataset)[power_index, delay_index, kind, y, x]
+
+    def trace(self, kind, y, x, power_index=0, dataset="frames"):
+        # (sorted delays, values) of a pixel (or region, y and x slices) versus delay
+        order = self.delay_order()
+        if self.is_derived(kind, dataset):
+            return self.delays[order], self.derived(kind)[power_index, order, y, x]
+        return self.delays[order], getattr(self, dataset)[power_index, order, kind, y, x]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ScanFile(Scan):
+    # a scan file of scan_writer.ScanWriter
+    def __init__(self, fullname, use_index_cache=True):
+        self.fullname = fullname
+        self.file = h5py.File(fullname, "r")
+        self.powers = self.file["power"][()]
+        self.delays = self.file["delay"][()]  # as in the file, see delay_order()
+        self.kinds = tuple(json.loads(self.file.attrs["kinds"]))
+        self.done = self.file["done"][()]
+        self.shots = self.file["shots"][()]
+        self.order = self.file["order"][()] if "order" in self.file else np.zeros(0, ORDER_DTYPE)
+        self.use_index_cache = use_index_cache
+        self.mapped = None  # np.memmap of the whole file, when the frames can be mapped
+        self.frames = self._array("frames")
+        self.stderr = self._array("stderr") if "stderr" in self.file else None
+
+    @property
+    def settings(self):
+        return self.metadata("settings", {})
+
+    def metadata(self, name, default=None):
+        if name not in self.file.attrs:
+            return default
+        return json.loads(self.file.attrs[name])
+
+    def _mappable(self, dataset):
+        frame_chunks = dataset.chunks == (1, 1, 1) + dataset.shape[3:]
+        return (frame_chunks and dataset.compression is None and not dataset.shuffle and not dataset.fletcher32
+                and dataset.scaleoffset is None)
+
+    def _array(self, name):
+        dataset = self.file[name] if name in self.file else None
+        if dataset is None:
+            # no frame written yet
+            return ScanArray((len(self.powers), len(self.delays), len(self.kinds), 0, 0), "float32", self.kinds,
+                             lambda p, d, k: None)
+        if not self._mappable(dataset):
+            return ScanArray(dataset.shape, dataset.dtype, self.kinds, lambda p, d, k: dataset[p, d, k])
+        offsets = self._offsets(name, dataset)
+        if self.mapped is None:
+            self.mapped = np.memmap(self.fullname, dtype=np.uint8, mode="r")
+        frame_shape = dataset.shape[3:]
+        frame_bytes = int(np.prod(frame_shape)) * dataset.dtype.itemsize
+        dtype = dataset.dtype
+        fill = dataset.fillvalue
+
+        def read_frame(p, d, k):
+            offset = offsets[p, d, k]
+            if offset < 0:
+                return None
+            return self.mapped[offset:offset + frame_bytes].view(dtype).reshape(frame_shape)
+
+        return ScanArray(dataset.shape, dtype, self.kinds, read_frame, fill, offsets, self.mapped)
+
+    def _offsets(self, name, dataset):
+        # file offset of every frame, -1 if it was never written; cached per file size and mtime
+        stat = os.stat(self.fullname)
+        stamp = np.array([stat.st_size, stat.st_mtime_ns])
+        cache = index_name(self.fullname)
+        if self.use_index_cache and os.path.exists(cache):
+            with np.load(cache) as saved:
+                if name in saved and np.array_equal(saved["stamp"], stamp):
+                    return saved[name]
+        offsets = np.full(dataset.shape[:3], -1, dtype=np.int64)
+
+        def add(info):
+            if info.filter_mask == 0:
+                offsets[info.chunk_offset[:3]] = info.byte_offset
+
+        if hasattr(dataset.id, "chunk_iter"):
+            dataset.id.chunk_iter(add)  # HDF5 >= 1.12.3, one pass over the chunk index
+        else:
+            for i in range(dataset.id.get_num_chunks()):
+                add(dataset.id.get_chunk_info(i))
+        if self.use_index_cache:
+            saved = {}
+            if os.path.exists(cache):
+                with np.load(cache) as old:
+                    if np.array_equal(old["stamp"], stamp):
+                        saved = {key: old[key] for key in old.files}
+            saved.update({"stamp": stamp, name: offsets})
+            try:
+                np.savez(cache, **saved)
+            except OSError:
+                pass  # read-only folder: the index is rebuilt next time
+        return offsets
+
+    def close(self):
+        self.mapped = None
+        self.file.close()
+        if self.cache is not None:
+            self.cache.clear()
+
+
+class LegacyScan(Scan):
+    # ref_<name>/, pumped_<name>/, ... folders with pwr_<power>_delay_<delay>.dat text
+    # frames. The file names are parsed once; frames are read (np.loadtxt) when indexed.
+    def __init__(self, base):
+        self.base = base
+        folder, name = os.path.split(base)
+        self.files = {}  # (power, delay, kind) -> file name
+        kinds = []
+        for kind in KINDS:
+            for fullname in glob.glob(os.path.join(folder, f"{kind}_{name}", "pwr_*_delay_*.dat")):
+                match = re.match(r"pwr_(.+)_delay_(.+)\.dat$", os.path.basename(fullname))
+                if match:
+                    self.files[(float(match.group(1)), float(match.group(2)), kind)] = fullname
+                    if kind not in kinds:
+                        kinds.append(kind)
+        if not self.files:
+            raise FileNotFoundError(f"no scan file or .dat folders for {base}")
+        self.kinds = tuple(kinds)
+        self.powers = np.array(sorted({key[0] for key in self.files}))
+        self.delays = np.array(sorted({key[1] for key in self.files}))
+        self.done = np.zeros((len(self.powers), len(self.delays)), dtype=bool)
+        for power, delay, kind in self.files:
+            self.done[np.searchsorted(self.powers, power), np.searchsorted(self.delays, delay)] = True
+        self.order = np.zeros(0, ORDER_DTYPE)
+        frame_shape = np.loadtxt(next(iter(self.files.values()))).shape
+        self.frames = ScanArray((len(self.powers), len(self.delays), len(self.kinds)) + frame_shape, "float64",
+                                self.kinds, self.read_frame)
+        self.stderr = None
+
+    @property
+    def settings(self):
+        return {}
+
+    def metadata(self, name, default=None):
+        return default
+
+    def read_frame(self, p, d, k):
+        fullname = self.files.get((self.powers[p], self.delays[d], self.kinds[k]))
+        return None if fullname is None else np.loadtxt(fullname)
+
+
+def open_scan(path, use_index_cache=True):
+    # ScanFile for a .h5 scan file, LegacyScan for the base name of .dat folders
+    # (folder/filename, as given in the window)
+    if path.endswith(".h5"):
+        return ScanFile(path, use_index_cache)
+    if os.path.exists(path + ".h5"):
+        return ScanFile(path + ".h5", use_index_cache)
+    return LegacyScan(path)
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    import scan_writer
+    if len(sys.argv) > 1:
+        fullname = sys.argv[1]
+    else:
+        # 1 power x 2000 delays (unsorted, like an adaptive scan) of 64x80 frames
+        fullname = os.path.join(tempfile.mkdtemp(), "reader_demo.h5")
+        rng = np.random.default_rng(0)
+        with scan_writer.ScanWriter(fullname, [30], rng.permutation(2000) * 0.01, kinds=["diff"]) as writer:
+            for d in range(2000):
+                writer.write_step(0, d, {"diff": rng.standard_normal((64, 80), dtype=np.float32)})
+    if os.path.exists(index_name(fullname)):
+        os.remove(index_name(fullname))
+    for attempt in ("index built", "index cached"):
+        start = time.perf_counter()
+        with open_scan(fullname) as scan:
+            opened = time.perf_counter()
+            delays, trace = scan.trace(scan.kinds[0], 20, 30)
+            done = time.perf_counter()
+        print(f"{attempt}: open {(opened - start) * 1e3:.1f} ms, pixel trace over {len(delays)} delays "
+              f"{(done - opened) * 1e3:.1f} ms")
+    print(dict(zip(AXES, scan.frames.shape)), scan.kinds)
@@ -0,0 +1,55 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+class ScanWorker(QObject):
+    # Runs one ScanEngine job in a QThread and forwards the engine callbacks as
+    # Qt signals, so the GUI is only touched from the GUI thread.
+    progress = pyqtSignal(int, int)
+    frames = pyqtSignal(object)
+    status = pyqtSignal(str, str)
+    timeline = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal()
+
+    def __init__(self, engine, job, *args, **kwargs):
+        super().__init__()
+        self.engine = engine
+        self.job = job
+        self.args = args
+        self.kwargs = kwargs
+        engine.on_progress = self.progress.emit
+        engine.on_frames = self.frames.emit
+        engine.on_status = self.status.emit
+        engine.on_timeline = self.timeline.emit
+
+    def run(self):
+        try:
+            self.job(*self.args, **self.kwargs)
+        except Exception as error:
+            self.failed.emit(str(error))
+        finally:
+            self.finished.emit()
+
+
+class CameraConnector(QObject):
+    # Connects the camera in a QThread: loading the Micro-Manager configuration
+    # takes several seconds and the window should respond meanwhile.
+    # connected carries the camera and its current settings.
+    connected = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal()
+
+    def run(self):
+        try:
+            import micromanager_class
+            camera = micromanager_class.MMcamera()
+            # set max sensitivity
+            camera.setMaxSens()
+            settings = {"gain": int(camera.getGain()),
+                        "pmodes": camera.getAllPModevalues(), "pmode": camera.getPMode(),
+                        "binnings": camera.getAllBinningvalues(), "binning": camera.getBinning()}
+            self.connected.emit(camera, settings)
+        except Exception as error:
+            self.failed.emit(str(error))
+        finally:
+            self.finished.emit()
@@ -0,0 +1,215 @@
+import json
+import time
+import h5py
+import numpy as np
+from lockin_logger import CHANNELS, SHUTTER_STATES
+
+# order of the image kinds along the "kind" axis of the scan file
+KINDS = ("ref", "pumped", "diff", "diffNorm")
+
+
+def scan_grid(fullname):
+    # (powers, delays) of an existing scan file
+    with h5py.File(fullname, "r") as file:
+        return file["power"][()], file["delay"][()]
+
+
+# lock-in statistics per point: (power, delay, shutter state, channel), and per exposure
+# window: (power, delay, window, shutter state, channel)
+LOCKIN_DATASETS = ("lockin_mean", "lockin_std", "lockin_count",
+                   "lockin_window_mean", "lockin_window_std", "lockin_window_count")
+
+
+# row of the "order" dataset
+ORDER_DTYPE = np.dtype([("power_index", "int32"), ("delay_index", "int32"), ("pass", "int32"), ("signal", "float64")])
+
+
+class ScanWriter:
+    # One HDF5 file per scan. Frames are stored in a single chunked dataset
+    # "frames" shaped (power, delay, kind, y, x), one chunk per frame, and are
+    # written as soon as each (power, delay) step is finished. Averaged scans
+    # also get "stderr" (same shape, standard error of the mean) and "shots"
+    # (number of ref/pumped pairs per point). The delay axis can grow during
+    # the scan (adaptive sampling), "order" lists the points as they were taken.
+    # With lock-in logging, "lockin_mean" / "lockin_std" (power, delay, shutter
+    # closed/open, X/Y/R) and "lockin_count" hold the lock-in signal during the
+    # exposures of each point, "lockin_window_*" the same per exposure window
+    # (power, delay, window, shutter, X/Y/R; NaN / 0 past the windows of a point). compression (an h5py filter such as "gzip") makes
+    # the file smaller, but its frames can no longer be memory mapped (scan_reader).
+    def __init__(self, fullname, powers, delays, kinds=KINDS, settings=None, dtype="float32", compression=None):
+        self.fullname = fullname
+        self.powers = np.atleast_1d(np.asarray(powers, dtype=float))
+        self.delays = np.atleast_1d(np.asarray(delays, dtype=float))
+        self.kinds = tuple(kinds)
+        self.dtype = dtype
+        self.compression = compression
+        self.file = h5py.File(fullname, "w")
+        self.file.create_dataset("power", data=self.powers)
+        self.file.create_dataset("delay", data=self.delays, maxshape=(None,))
+        # which (power, delay) points are already written
+        self.done = self.file.create_dataset("done", shape=(len(self.powers), len(self.delays)), dtype=bool,
+                                             maxshape=(len(self.powers), None))
+        self.file.attrs["kinds"] = json.dumps(self.kinds)
+        self.file.attrs["axes"] = json.dumps(("power", "delay", "kind", "y", "x"))
+        self.file.attrs["created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.file.attrs["settings"] = json.dumps(settings or {})
+        self.file.attrs["dtype"] = dtype
+        self.frames = None  # created with the first frame, when the image shape (binning) is known
+        self.stderr = None
+        self.shots = self.file.create_dataset("shots", shape=(len(self.powers), len(self.delays)), dtype="int32",
+                                              maxshape=(len(self.powers), None))
+
+    @classmethod
+    def resume(cls, fullname):
+        # reopen an existing scan file to add the points that are still missing
+        writer = cls.__new__(cls)
+        writer.fullname = fullname
+        writer.file = h5py.File(fullname, "r+")
+        writer.powers = writer.file["power"][()]
+        writer.delays = writer.file["delay"][()]
+        writer.kinds = tuple(json.loads(writer.file.attrs["kinds"]))
+        writer.dtype = writer.file.attrs.get("dtype", "float32")
+        writer.compression = writer.file["frames"].compression if "frames" in writer.file else None
+        writer.done = writer.file["done"]
+        writer.shots = writer.file["shots"]
+        writer.frames = writer.file.get("frames")
+        writer.stderr = writer.file.get("stderr")
+        return writer
+
+    def _create_frames(self, name, frame_shape):
+        shape = (len(self.powers), len(self.delays), len(self.kinds)) + tuple(frame_shape)
+        chunks = (1, 1, 1) + tuple(frame_shape)
+        maxshape = (len(self.powers), None) + shape[2:]
+        return self.file.create_dataset(name, shape=shape, dtype=self.dtype, chunks=chunks, maxshape=maxshape,
+                                        fillvalue=np.nan, compression=self.compression)
+
+    def add_delays(self, delays):
+        # appends delays to the delay axis (unsorted), returns their indices
+        first = len(self.delays)
+        self.delays = np.concatenate([self.delays, np.asarray(delays, dtype=float)])
+        lockin = [self.file.get(name) for name in LOCKIN_DATASETS]
+        for dataset in [self.file["delay"], self.done, self.shots, self.frames, self.stderr] + lockin:
+            if dataset is not None:
+                dataset.resize(len(self.delays), axis=0 if dataset.ndim == 1 else 1)
+        self.file["delay"][first:] = self.delays[first:]
+        self.file.flush()
+        return list(range(first, len(self.delays)))
+
+    def append_order(self, pwr_index, delay_index, refine_pass=0, signal=np.nan):
+        # one row per point written: indices, refinement pass (0 = first pass) and the ROI signal
+        if "order" not in self.file:
+            self.file.create_dataset("order", shape=(0,), dtype=ORDER_DTYPE, maxshape=(None,), chunks=(256,))
+        order = self.file["order"]
+        order.resize(len(order) + 1, axis=0)
+        order[-1] = (pwr_index, delay_index, refine_pass, signal)
+
+    def read_order(self):
+        if "order" not in self.file:
+            return np.zeros(0, ORDER_DTYPE)
+        return self.file["order"][()]
+
+    def write_step(self, pwr_index, delay_index, frames, stderr=None, shots=1):
+        # frames (and stderr): {kind: 2D array}, only kinds given at construction are stored
+        for kind, image in frames.items():
+            if kind not in self.kinds:
+                continue
+            if self.frames is None:
+                self.frames = self._create_frames("frames", image.shape)
+            self.frames[pwr_index, delay_index, self.kinds.index(kind)] = image
+            if stderr is not None:
+                if self.stderr is None:
+                    self.stderr = self._create_frames("stderr", image.shape)
+                self.stderr[pwr_index, delay_index, self.kinds.index(kind)] = stderr[kind]
+        self.shots[pwr_index, delay_index] = shots
+        self.done[pwr_index, delay_index] = True
+        self.file.flush()
+
+    def write_lockin(self, pwr_index, delay_index, stats):
+        # stats of lockin_logger.LockinLogger.stats()
+        if "lockin_mean" not in self.file:
+            grid = (len(self.powers), len(self.delays))
+            for name, shape, dtype, fill in (("lockin_mean", (2, 3), "float64", np.nan),
+                                             ("lockin_std", (2, 3), "float64", np.nan),
+                                             ("lockin_count", (2,), "int32", 0)):
+                dataset = self.file.create_dataset(name, shape=grid + shape, dtype=dtype, fillvalue=fill,
+                                                   maxshape=(grid[0], None) + shape)
+                dataset.attrs["axes"] = json.dumps(("power", "delay", "shutter", "channel")[:2 + len(shape)])
+            self.file["lockin_mean"].attrs["channels"] = json.dumps(CHANNELS)
+            self.file["lockin_mean"].attrs["shutter"] = json.dumps(SHUTTER_STATES)
+        self.file["lockin_mean"][pwr_index, delay_index] = stats["mean"]
+        self.file["lockin_std"][pwr_index, delay_index] = stats["std"]
+        self.file["lockin_count"][pwr_index, delay_index] = stats["count"]
+        windows = len(stats["window_count"])
+        if not windows:
+            return
+        if "lockin_window_mean" not in self.file:
+            grid = (len(self.powers), len(self.delays))
+            for name, shape, dtype, fill in (("lockin_window_mean", (windows, 2, 3), "float64", np.nan),
+                                             ("lockin_window_std", (windows, 2, 3), "float64", np.nan),
+                                             ("lockin_window_count", (windows, 2), "int32", 0)):
+                dataset = self.file.create_dataset(name, shape=grid + shape, dtype=dtype, fillvalue=fill,
+                                                   maxshape=(grid[0], None, None) + shape[1:])
+                dataset.attrs["axes"] = json.dumps(("power", "delay", "window", "shutter", "channel")[:2 + len(shape)])
+        for name in ("lockin_window_mean", "lockin_window_std", "lockin_window_count"):
+            dataset = self.file[name]
+            if dataset.shape[2] < windows:
+                dataset.resize(windows, axis=2)
+            dataset[pwr_index, delay_index, :windows] = stats[name[len("lockin_"):]]
+
+    def set_metadata(self, name, value):
+        # any JSON-serializable value, stored as a file attribute
+        self.file.attrs[name] = json.dumps(value)
+
+    def get_metadata(self, name, default=None):
+        if name not in self.file.attrs:
+            return default
+        return json.loads(self.file.attrs[name])
+
+    def write_roi_traces(self, rois, mean, std):
+        # group "roi_traces": per ROI a (power, delay) "mean" and "std", geometry as attributes.
+        # Points a resumed scan did not take again keep the values saved before.
+        group = self.file.require_group("roi_traces")
+        for name, roi in rois.items():
+            roi_mean, roi_std = mean[name], std[name]
+            if name in group:
+                old = group[name]
+                # the delay axis may have grown since (adaptive scans)
+                saved = old["mean"].shape[1]
+                if old.attrs["kind"] == roi["kind"] and saved <= roi_mean.shape[1]:
+                    roi_mean, roi_std = roi_mean.copy(), roi_std.copy()
+                    missing = np.isnan(roi_mean[:, :saved])
+                    roi_mean[:, :saved][missing] = old["mean"][()][missing]
+                    roi_std[:, :saved][missing] = old["std"][()][missing]
+                del group[name]
+            roi_group = group.create_group(name)
+            roi_group.create_dataset("mean", data=roi_mean)
+            roi_group.create_dataset("std", data=roi_std)
+            roi_group.attrs["kind"] = roi["kind"]
+            roi_group.attrs["rows"] = roi["rows"]
+            roi_group.attrs["columns"] = roi["columns"]
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    powers = np.arange(0, 10, 2)
+    delays = np.arange(0, 20, 1)
+    with ScanWriter("test_scan.h5", powers, delays, settings={"exposure": 100}) as writer:
+        for p in range(len(powers)):
+            for d in range(len(delays)):
+                ref = np.random.randint(0, 4096, (256, 256), dtype=np.uint16)
+                pumped = np.random.randint(0, 4096, (256, 256), dtype=np.uint16)
+                diff = pumped.astype(int) - ref
+                writer.write_step(p, d, {"ref": ref, "pumped": pumped, "diff": diff,
+                                         "diffNorm": diff / np.maximum(ref, 1)})
+    with h5py.File("test_scan.h5") as f:
+        print(f["frames"].shape, f["frames"].chunks, json.loads(f.attrs["settings"]))
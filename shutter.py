@@ -0,0 +1,68 @@
+import time
+
+
+class Shutter:
+    # Pump shutter driven by an AUX output of the lock-in (Lockin_SR_class.Lockin
+    # or simulators.SimLockin). The last state written is cached and writes
+    # which would not change it are skipped, so the close at the start of a
+    # step after the close at the end of the previous one costs nothing.
+    # confirm=True waits for *OPC? after every write, so the command is known
+    # to be executed; settle_time (s, calibrated for the shutter) is then
+    # waited for the blade to move. The cache trusts that nothing else writes
+    # to this output: invalidate() forgets the state (e.g. before a scan).
+    def __init__(self, lia, aux, open_voltage=5, closed_voltage=0, confirm=False, settle_time=0.0):
+        self.lia = lia
+        self.aux = aux
+        self.open_voltage = open_voltage
+        self.closed_voltage = closed_voltage
+        self.confirm = confirm
+        self.settle_time = settle_time
+        self.is_open = None  # None = unknown, the next write is always sent
+        self.writes = 0
+        self.skipped = 0
+
+    def set(self, is_open):
+        # returns True if the state was written
+        if self.is_open == is_open:
+            self.skipped += 1
+            return False
+        start = time.perf_counter()
+        try:
+            self.lia.set_aux(self.aux, self.open_voltage if is_open else self.closed_voltage)
+            if self.confirm:
+                self.lia.opc()
+        except Exception:
+            self.is_open = None  # the write may or may not have happened
+            raise
+        self.is_open = is_open
+        self.writes += 1
+        # the settle time counts from the write, the *OPC? round trip is part of it
+        remaining = self.settle_time - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def open(self):
+        return self.set(True)
+
+    def close(self):
+        return self.set(False)
+
+    def invalidate(self):
+        self.is_open = None
+
+    def latency(self, repeats=10):
+        # GPIB round trip of the lock-in, {"median", "max"} in s
+        return self.lia.round_trip(repeats)
+
+
+if __name__ == "__main__":
+    from simulators import SimLockin
+    shutter = Shutter(SimLockin(), "1", confirm=True, settle_time=0.01)
+    for _ in range(3):
+        start = time.perf_counter()
+        shutter.close()
+        shutter.open()
+        shutter.close()
+        print(f"step: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    print(f"{shutter.writes} writes, {shutter.skipped} skipped, round trip {shutter.latency()['median'] * 1e3:.1f} ms")
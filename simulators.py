@@ -0,0 +1,331 @@
+import threading
+import time
+import numpy as np
+from lockin_logger import BUFFER_RATES, BUFFER_SIZE
+from scan_planner import MotionModel
+
+# Simulated drop-in replacements of MMcamera, Lockin and DelayLine for
+# profiling and testing without the hardware. They keep the methods and
+# attributes the GUI, ScanEngine and batch_scan use, and spend the time the
+# real devices would (exposure, readout, GPIB and network latency, stage
+# motion). SimulatedSetup connects them: the camera sees the shutter state
+# set through the lock-in AUX output and the stage positions, and returns
+# synthetic pump-probe images.
+
+# frame shape per binning (Retiga R3 sensor)
+BINNINGS = {"1x1": (1460, 1920), "2x2": (730, 960), "4x4": (365, 480)}
+PMODES = ["Normal", "Alternate Normal"]
+MM_PER_PS = 0.299792458 / 2  # delay line travel per ps of delay (double pass)
+
+
+def _sleep(seconds, stop_event=None):
+    # returns True if stop_event was set meanwhile
+    if seconds <= 0:
+        return stop_event is not None and stop_event.is_set()
+    if stop_event is None:
+        time.sleep(seconds)
+        return False
+    return stop_event.wait(seconds)
+
+
+class SimLockin:
+    # SR830/SR844 with the AUX outputs and the data buffer; every command costs
+    # gpib_latency seconds. The buffered X is the probe signal, 10 % higher
+    # while the AUX output signal_aux (the shutter) is above 2.5 V, with 1 % noise.
+    def __init__(self, gpibport=8, model=830, gpib_latency=0.005, signal_aux="1", seed=0):
+        self.model = model
+        self.name = f"Stanford_Research_Systems,SR{model},s/n00000,ver1.07 (simulated)"
+        self.state = f'Lock-in is connected. Model {self.model} (simulated)'
+        self.gpib_latency = gpib_latency
+        self.signal_aux = str(signal_aux)
+        self.aux = {}  # aux output -> voltage
+        self.shutter_changes = [(-np.inf, False)]  # (perf_counter time, signal_aux above 2.5 V)
+        self.rng = np.random.default_rng(seed)
+        self.buffer_rate = 1.0
+        self.buffer_started = None  # perf_counter time of STRT, None when paused
+        self.buffer_points = 0  # points stored when paused
+        self.lock = threading.Lock()
+
+    def set_aux(self, aux, voltage):
+        with self.lock:
+            time.sleep(self.gpib_latency)
+            self.aux[str(aux)] = float(voltage)
+            if str(aux) == self.signal_aux:
+                self.shutter_changes.append((time.perf_counter(), float(voltage) > 2.5))
+        return voltage
+
+    def opc(self):
+        with self.lock:
+            time.sleep(self.gpib_latency)
+        return "1"
+
+    def round_trip(self, repeats=10):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            self.opc()
+            times.append(time.perf_counter() - start)
+        return {"median": float(np.median(times)), "max": max(times)}
+
+    def buffer_start(self, rate_code):
+        with self.lock:
+            time.sleep(3 * self.gpib_latency)
+            self.buffer_rate = BUFFER_RATES[rate_code]
+            self.buffer_started = time.perf_counter()
+            return self.buffer_started
+
+    def buffer_pause(self):
+        with self.lock:
+            time.sleep(self.gpib_latency)
+            self.buffer_points = self._points()
+            self.buffer_started = None
+
+    def _points(self):
+        if self.buffer_started is None:
+            return self.buffer_points
+        return min(BUFFER_SIZE, int((time.perf_counter() - self.buffer_started) * self.buffer_rate) + 1)
+
+    def buffer_count(self):
+        with self.lock:
+            time.sleep(self.gpib_latency)
+            return self._points()
+
+    def buffer_read(self, channel, start, count):
+        with self.lock:
+            time.sleep(self.gpib_latency + count * 4 / 1e6)  # ~1 MB/s
+            times = self.buffer_started + np.arange(start, start + count) / self.buffer_rate
+            change_times = [change[0] for change in self.shutter_changes]
+            states = np.array([change[1] for change in self.shutter_changes])
+            is_open = states[np.searchsorted(change_times, times, side="right") - 1]
+            signal = 1e-3 * (1 + 0.1 * is_open) if channel == 1 else np.full(count, 2e-4)
+            return (signal * (1 + 0.01 * self.rng.standard_normal(count))).astype(np.float32)
+
+    def getXYR(self):
+        with self.lock:
+            time.sleep(self.gpib_latency)
+        x, y = np.random.normal(0, 1e-6, 2)
+        return [x, y, float(np.hypot(x, y))]
+
+
+class SimDelayLine:
+    # XPS positioner: moves take the time of a trapezoidal velocity profile,
+    # every controller command costs network_latency seconds
+    def __init__(self, controller='GROUP1.POSITIONER', tolerance=0.0005, settle_time=0.0, timeout=60.0,
+                 velocity=20.0, acceleration=80.0, network_latency=0.002, **kwargs):
+        self.controller = controller
+        self.group = controller.split('.')[0]
+        self.tolerance = tolerance
+        self.settle_time = settle_time
+        self.timeout = timeout
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.network_latency = network_latency
+        self.motion = MotionModel(velocity, acceleration)
+        self.health = "ok"
+        self.recovery_count = 0
+        self.rehome_count = 0
+        self.last_error = None
+        self.last_move_time = 0.0
+        self.last_settle_time = 0.0
+        self.position = 0.0  # last commanded position
+        self.current = 0.0  # where the stage is
+        self.lock = threading.Lock()
+
+    def init(self):
+        self.move_to(0.0)
+
+    def health_status(self):
+        return {"group": self.group, "health": self.health, "recovery_count": self.recovery_count,
+                "rehome_count": self.rehome_count, "last_error": self.last_error}
+
+    def move_to(self, position, stop_event=None):
+        # like GroupMoveAbsolute, returns when the trajectory is finished
+        with self.lock:
+            self.position = float(position)
+            duration = float(self.motion.time(self.position - self.current))
+            stopped = _sleep(self.network_latency + duration, stop_event)
+            if not stopped:
+                self.current = self.position
+            return stopped
+
+    def group_state(self):
+        time.sleep(self.network_latency)
+        return 12  # ready state from motion
+
+    def move_and_wait(self, position, tolerance=None, settle_time=None, stop_event=None):
+        tolerance = self.tolerance if tolerance is None else tolerance
+        settle_time = self.settle_time if settle_time is None else settle_time
+        start = time.perf_counter()
+        if self.move_to(position, stop_event):
+            return None
+        moved = time.perf_counter()
+        if _sleep(settle_time, stop_event):
+            return None
+        current = self.get_position()
+        if abs(current - float(position)) > tolerance:
+            raise TimeoutError(f"{self.group} did not reach {position} within {tolerance}, at {current}")
+        self.last_move_time = moved - start
+        self.last_settle_time = time.perf_counter() - moved
+        return current
+
+    def get_position(self):
+        time.sleep(self.network_latency)
+        return self.current
+
+    def motion_parameters(self):
+        return self.velocity, self.acceleration
+
+
+class SimCamera:
+    # MMcamera with synthetic frames. A ref frame is the probe spot, a pumped
+    # frame (shutter open) adds a pump-induced change which rises at
+    # zero_delay and decays with decay_ps, scaled with the pump power
+    # (sin^2 of twice the half-wave plate angle). Exposure and readout take
+    # their time; sequences lose frames with probability drop_rate.
+    def __init__(self, setup=None, readout=0.01, noise=True, drop_rate=0.0, seed=0):
+        self.setup = setup
+        self.readout = readout
+        self.noise = noise
+        self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+        self.exposure_ms = 10.0
+        self.binning = "4x4"
+        self.pmode = "Normal"
+        self.gain = "1"
+        self.dropped = 0  # frames lost in the last sequence()
+        self.images = {}  # shape -> (probe spot, pump spot)
+        self.noise_bank = {}  # shape -> unit normal noise of 4 frames, drawn once (drawing per frame is slow at 1x1)
+
+    def spots(self, shape):
+        if shape not in self.images:
+            rows, columns = np.ogrid[:shape[0], :shape[1]]
+            r2 = ((rows - shape[0] / 2) / shape[0]) ** 2 + ((columns - shape[1] / 2) / shape[1]) ** 2
+            probe = (200 + 3000 * np.exp(-r2 / 0.08)).astype(np.float32)
+            pump = np.exp(-r2 / 0.01).astype(np.float32)
+            self.images[shape] = probe, pump
+        return self.images[shape]
+
+    def change(self):
+        # relative pump-induced change at the current stage positions
+        if self.setup is None:
+            return 0.0
+        delay_ps = (self.setup.delay_line.current - self.setup.zero_delay) / MM_PER_PS
+        if delay_ps < 0:
+            return 0.0
+        power = np.sin(2 * np.radians(self.setup.pump_pwr.current)) ** 2
+        return self.setup.signal * power * (1 - np.exp(-delay_ps / 0.2)) * np.exp(-delay_ps / self.setup.decay_ps)
+
+    def frame(self):
+        probe, pump = self.spots(BINNINGS[self.binning])
+        image = probe
+        if self.setup is not None and self.setup.shutter_open():
+            image = probe * (1 + self.change() * pump)
+        if self.noise:
+            # shot noise, gaussian approximation; every frame takes the noise at its own random
+            # offset in the bank, so no two frames get the same noise at a pixel
+            shape, size = image.shape, image.size
+            if shape not in self.noise_bank:
+                self.noise_bank[shape] = self.rng.standard_normal(4 * size, dtype=np.float32)
+            offset = self.rng.integers(3 * size + 1)
+            image = image + np.sqrt(image) * self.noise_bank[shape][offset:offset + size].reshape(shape)
+        return np.clip(image, 0, 65535).astype(np.uint16)
+
+    def expose(self, stop_event=None):
+        # a frame after exposure and readout; the time spent making it counts as part of them
+        start = time.perf_counter()
+        frame = self.frame()
+        if _sleep(self.exposure_ms / 1000 + self.readout - (time.perf_counter() - start), stop_event):
+            return None
+        return frame
+
+    def getImage(self, stop_event=None):
+        return self.expose(stop_event)
+
+    def sequence(self, num_images, stop_event=None, buffer_mb=None):
+        self.dropped = 0
+        start = time.time()
+        for index in range(num_images):
+            frame = self.expose(stop_event)
+            if frame is None:
+                return
+            if self.drop_rate and self.rng.random() < self.drop_rate:
+                self.dropped += 1
+                continue
+            yield frame, {"index": index - self.dropped, "image_number": index,
+                                 "elapsed_ms": (time.time() - start) * 1000, "host_time": time.time()}
+
+    def getExptime(self):
+        return self.exposure_ms
+
+    def setExptime(self, time=10.0):
+        self.exposure_ms = float(time)
+
+    def getBinning(self):
+        return self.binning
+
+    def setBinning(self, binning):
+        if binning not in BINNINGS:
+            raise ValueError(f"binning must be one of {list(BINNINGS)}")
+        self.binning = binning
+
+    def getPMode(self):
+        return self.pmode
+
+    def setPMode(self, mode="Normal"):
+        self.pmode = mode
+
+    def getPixelType(self):
+        return "16bit"
+
+    def getGain(self):
+        return self.gain
+
+    def setGain(self, gain=1):
+        self.gain = str(gain)
+
+    def setMaxSens(self, binning="4x4"):
+        self.setBinning(binning)
+        self.setPMode("Alternate Normal")
+        self.setGain(2)
+
+    def getAllBinningvalues(self):
+        return list(BINNINGS)
+
+    def getAllPModevalues(self):
+        return list(PMODES)
+
+    def getBytesPerPixel(self):
+        return 2
+
+
+class SimulatedSetup:
+    # camera, lock-in and the two stages of one simulated experiment
+    def __init__(self, shutter_aux="1", zero_delay=0.0, signal=0.05, decay_ps=30.0,
+                 camera=None, lockin=None, delay_line=None, pump_pwr=None):
+        self.shutter_aux = str(shutter_aux)
+        self.zero_delay = zero_delay  # delay line position of zero delay, mm
+        self.signal = signal  # maximum relative change of the pumped frame
+        self.decay_ps = decay_ps
+        self.lia = SimLockin(**dict({"signal_aux": self.shutter_aux}, **(lockin or {})))
+        self.delay_line = SimDelayLine('GROUP1.POSITIONER', **(delay_line or {}))
+        self.pump_pwr = SimDelayLine('GROUP3.POSITIONER', tolerance=0.001,
+                                     **dict({"velocity": 10.0, "acceleration": 40.0}, **(pump_pwr or {})))
+        self.camera = SimCamera(self, **(camera or {}))
+
+    def shutter_open(self):
+        return self.lia.aux.get(self.shutter_aux, 0.0) > 2.5
+
+
+if __name__ == "__main__":
+    setup = SimulatedSetup()
+    setup.camera.setExptime(50)
+    setup.pump_pwr.move_and_wait(30)
+    for delay in (-1, 0.1, 1, 5):
+        setup.delay_line.move_and_wait(delay)
+        setup.lia.set_aux(1, 0)
+        ref = setup.camera.getImage().astype(float)
+        setup.lia.set_aux(1, 5)
+        pumped = setup.camera.getImage().astype(float)
+        center = (slice(170, 195), slice(230, 250))
+        print(f"delay {delay:5} mm: dR/R {(pumped[center] - ref[center]).mean() / ref[center].mean():+.4f}, "
+              f"move {setup.delay_line.last_move_time * 1e3:.0f} ms")
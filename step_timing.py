@@ -0,0 +1,157 @@
+import csv
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SpanHistogram:
+    # durations on log-spaced bins from 10 us to 100 s, bins_per_decade per
+    # factor 10; count, total and max are exact, percentiles are bin edges
+    def __init__(self, bins_per_decade=16, low=1e-5, decades=7):
+        self.bins_per_decade = bins_per_decade
+        self.low = low
+        self.counts = [0] * (bins_per_decade * decades + 2)  # + underflow and overflow
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds < self.low:
+            index = 0
+        else:
+            index = min(len(self.counts) - 1, 1 + int(math.log10(seconds / self.low) * self.bins_per_decade))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def upper_edge(self, index):
+        return self.low * 10 ** (index / self.bins_per_decade)
+
+    def percentile(self, q):
+        # upper edge of the bin holding the q-th percentile (at most the max seen)
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_edge(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p95": self.percentile(95), "max": self.max}
+
+
+class StepTimer:
+    # Timing spans of the scan steps. span(name) times a block; spans in the
+    # thread which called begin_step() belong to that step (the same name
+    # several times in a step is summed), spans of other threads (write queue,
+    # GUI, pipelined moves) are reported as "background" with the next step.
+    # All spans go into histograms. end_step() appends the step to the log:
+    # JSON lines, or if the name ends with .csv one row per span (long format,
+    # columns: the step fields, time, group, span, seconds; group is "spans",
+    # "background" or a dict field such as "phases"). A span costs ~5 us.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # name -> SpanHistogram
+        self.current = None  # {name: seconds} of the running step
+        self.step_thread = None
+        self.background = {}
+        self.version = 0  # incremented with every finished step, for the GUI
+        self.log_file = None
+        self.csv_writer = None  # csv.DictWriter of a .csv log, None = JSON lines
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = SpanHistogram()
+            histogram.add(seconds)
+            in_step = self.current is not None and threading.get_ident() == self.step_thread
+            spans = self.current if in_step else self.background
+            spans[name] = spans.get(name, 0.0) + seconds
+
+    def begin_step(self):
+        with self.lock:
+            self.current = {}
+            self.step_thread = threading.get_ident()
+
+    def end_step(self, **fields):
+        # fields (step number, indices, phases...) are stored with the spans
+        with self.lock:
+            record = dict(fields, time=time.time(), spans=self.current or {}, background=self.background)
+            self.current = None
+            self.background = {}
+            self.version += 1
+            self.write(record)
+        return record
+
+    def open_log(self, fullname, fields=("step",)):
+        # fields: the plain (not dict) fields given to end_step(), the first columns of a .csv log
+        self.close_log()
+        self.log_file = open(fullname, "a", newline="")
+        if fullname.endswith(".csv"):
+            columns = list(fields) + ["time", "group", "span", "seconds"]
+            self.csv_writer = csv.DictWriter(self.log_file, fieldnames=columns)
+            if self.log_file.tell() == 0:
+                self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.log_file is None:
+            return
+        if self.csv_writer is not None:
+            step = {key: value for key, value in record.items() if not isinstance(value, dict)}
+            for group, spans in record.items():
+                if isinstance(spans, dict):
+                    self.csv_writer.writerows(dict(step, group=group, span=name, seconds=seconds)
+                                             for name, seconds in spans.items())
+        else:
+            self.log_file.write(json.dumps(record) + "\n")
+        self.log_file.flush()
+
+    def close_log(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = None
+            self.csv_writer = None
+
+    def summary(self):
+        # {name: {"count", "mean", "p50", "p95", "max"}} in s
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.current = None
+            self.background = {}
+            self.version += 1
+
+
+if __name__ == "__main__":
+    timer = StepTimer()
+    for step in range(20):
+        timer.begin_step()
+        with timer.span("snap"):
+            time.sleep(0.002)
+        with timer.span("process"):
+            sum(range(20000))
+        record = timer.end_step(step=step)
+        if step == 19:
+            print(record["spans"])
+    for name, stats in timer.summary().items():
+        print(f"{name}: {stats['count']} x, p50 {stats['p50'] * 1e3:.2f} ms, p95 {stats['p95'] * 1e3:.2f} ms")
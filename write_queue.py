@@ -0,0 +1,81 @@
+import queue
+import threading
+
+
+class WriteQueue:
+    # Bounded queue of saving jobs drained by background worker thread(s).
+    # put() returns immediately while there is room and blocks when the queue is
+    # full (backpressure), so the acquisition can run ahead of the disk only by
+    # maxsize jobs. Exceptions raised in the workers are kept and re-raised in
+    # the acquisition thread by put(), check() and flush().
+    def __init__(self, maxsize=8, workers=1):
+        # keep workers=1 for jobs that must run in order (HDF5 writes)
+        self.jobs = queue.Queue(maxsize)
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"WriteQueue-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:  # close() sentinel
+                self.jobs.task_done()
+                return
+            func, args, kwargs = job
+            try:
+                func(*args, **kwargs)
+            except Exception as error:
+                with self.errors_lock:
+                    self.errors.append(error)
+            finally:
+                self.jobs.task_done()
+
+    def put(self, func, *args, **kwargs):
+        self.check()
+        self.jobs.put((func, args, kwargs))
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def check(self):
+        # re-raise the first error of the workers (the rest are dropped)
+        with self.errors_lock:
+            if not self.errors:
+                return
+            error = self.errors[0]
+            self.errors = []
+        raise error
+
+    def flush(self):
+        # wait until every queued job is written
+        self.jobs.join()
+        self.check()
+
+    def close(self):
+        self.jobs.join()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.check()
+
+
+if __name__ == "__main__":
+    import time
+
+    def slow_write(i):
+        time.sleep(0.1)
+        print(f"written {i}")
+
+    write_queue = WriteQueue(maxsize=2)
+    start = time.time()
+    for i in range(5):
+        write_queue.put(slow_write, i)
+        print(f"queued {i} after {time.time() - start:.2f} s")
+    write_queue.close()
+    print(f"all written after {time.time() - start:.2f} s")